@@ -1,20 +1,20 @@
 import os
 import uuid
-import boto3
-from six.moves import configparser
 from botocore.exceptions import ClientError
+from . import aws_retry
+from . import credential_cache
+from . import role_index
+from . import session_pool
+from . import timings
 from .aws_util_exceptions import ProfileParsingError
 from .aws_util_exceptions import RoleNotFoundError
 from .aws_util_exceptions import AssumeRoleError
 
 
-def get_aws_account_id(profile=None):
-    if profile:
-        session = boto3.Session(profile_name=profile)
-        client = session.client('sts')
-    else:
-        client = boto3.client('sts')
-    account_id = client.get_caller_identity()['Account']
+def get_aws_account_id(profile=None, region=None):
+    session = session_pool.get_session(profile_name=profile)
+    client = session_pool.get_client(session, 'sts', region)
+    account_id = aws_retry.call('sts:GetCallerIdentity', client.get_caller_identity)['Account']
     return account_id
 
 
@@ -37,121 +37,129 @@ def get_credential_method_description(session):
 
 
 def get_boto3_session(aws_creds):
-    if aws_creds:
-        session_token = None
-        if 'AWS_SESSION_TOKEN' in aws_creds:
-            session_token = aws_creds['AWS_SESSION_TOKEN']
-        return boto3.Session(
-            aws_access_key_id=aws_creds['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=aws_creds['AWS_SECRET_ACCESS_KEY'],
-            aws_session_token=session_token,
-        )
+    return session_pool.get_session(aws_creds)
+
+
+def get_credential_source_creds(credential_source, environ=None):
+    """Credentials for a profile's credential_source: Environment, or the instance
+    or container credentials botocore finds."""
+    if credential_source == 'Environment':
+        environ = os.environ if environ is None else environ
+        if not environ.get('AWS_ACCESS_KEY_ID'):
+            raise ProfileParsingError(
+                "credential_source Environment but no AWS credentials found in the environment")
+        return {
+            'AWS_ACCESS_KEY_ID': environ['AWS_ACCESS_KEY_ID'],
+            'AWS_SECRET_ACCESS_KEY': environ.get('AWS_SECRET_ACCESS_KEY'),
+            'AWS_SESSION_TOKEN': environ.get('AWS_SESSION_TOKEN'),
+        }
+    import botocore.credentials
+    import botocore.utils
+    if credential_source == 'EcsContainer':
+        provider = botocore.credentials.ContainerProvider()
     else:
-        return boto3.Session()
-
-
-def get_aws_profile_credentials(profile_name, verbose=False):
-    aws_creds = {}
-    # the source_profile may be overridden if a source_profile is indicated in ~/.aws/config
-    source_profile = profile_name
-
-    config = configparser.ConfigParser()
-    config_file_path = os.path.join(os.path.expanduser("~"),'.aws/config')
-    config.read([config_file_path])
-
-    try:
-        section = 'profile {}'.format(profile_name)
-        if not config.has_section(section):
-            msg = "Profile {} not found in {}".format(profile_name, config_file_path)
-            raise ProfileParsingError(msg)
-
-        if not config.has_option(section, 'role_arn'):
-            if verbose:
-                print("Profile {} in ~/.aws/config does not indicate a role_arn".format(profile_name))
-        else:
-            aws_creds['role_arn'] = config.get(section, 'role_arn')
-            print("Profile {} indicates role to assume: {}".format(profile_name, aws_creds['role_arn']))
-            if config.has_option(section, 'source_profile'):
-                source_profile = config.get(section, 'source_profile')
-                print("Found profile {} in ~/.aws/config, indicated source_profile {}".format(
-                    profile_name, source_profile
-                ))
-            else:
-                msg = "Profile {} in ~/.aws/config does not indicate a source_profile needed to assume role {}".format(
-                    profile_name, aws_creds['role_arn']
-                )
-                raise ProfileParsingError(msg)
-    except configparser.ParsingError:
-        print('Error parsing AWS config file')
-        raise
-    except (configparser.NoSectionError, configparser.NoOptionError):
-        print('Error parsing sections or options for AWS profile {} in {}'.format(
-            profile_name,
-            config_file_path))
-        raise
-
-    credentials = configparser.ConfigParser()
-    credentials_file_path = os.path.join(os.path.expanduser("~"),'.aws/credentials')
-    credentials.read([credentials_file_path])
-
-    try:
-        aws_creds['AWS_ACCESS_KEY_ID'] = credentials.get(source_profile, 'aws_access_key_id')
-        aws_creds['AWS_SECRET_ACCESS_KEY'] = credentials.get(source_profile, 'aws_secret_access_key')
-        try:
-            aws_creds['AWS_SESSION_TOKEN'] = credentials.get(source_profile, 'aws_session_token')
-        except:
-            pass
-        if verbose:
-            print("Found source profile {} in ~/.aws/credentials, access key: {}".format(
-                source_profile, aws_creds['AWS_ACCESS_KEY_ID']
-            ))
-    except configparser.ParsingError:
-        print('Error parsing AWS credentials file')
-        raise
-    except (configparser.NoSectionError, configparser.NoOptionError):
-        print('Unable to find AWS profile named {} in {}'.format(
-            profile_name,
-            credentials_file_path))
-        raise
-    return aws_creds
-
-
-def get_role_arn_from_name(aws_creds, role_name, verbose=False):
+        provider = botocore.credentials.InstanceMetadataProvider(
+            iam_role_fetcher=botocore.utils.InstanceMetadataFetcher())
+    credentials = provider.load()
+    if credentials is None:
+        raise ProfileParsingError("No credentials found for credential_source {}".format(credential_source))
+    credentials = credentials.get_frozen_credentials()
+    return {
+        'AWS_ACCESS_KEY_ID': credentials.access_key,
+        'AWS_SECRET_ACCESS_KEY': credentials.secret_key,
+        'AWS_SESSION_TOKEN': credentials.token,
+    }
+
+
+def get_role_arn_from_name(aws_creds, role_name, verbose=False, account_id=None):
     try:
         session = get_boto3_session(aws_creds)
-        iam_client = session.client('iam')
-        role_arn = iam_client.get_role(RoleName=role_name)['Role']['Arn']
+        iam_client = session_pool.get_client(session, 'iam')
+        with timings.phase('iam:GetRole', role=role_name):
+            role_arn = aws_retry.call(
+                'iam:GetRole', iam_client.get_role, verbose=verbose, RoleName=role_name)['Role']['Arn']
         return role_arn
     except ClientError as e:
         if verbose:
           print(e)
         method = get_credential_method_description(session)
         if e.response['Error']['Code'] == 'NoSuchEntity':
-            raise RoleNotFoundError(method, e)
+            raise RoleNotFoundError(method, e, account_id=account_id)
         else:
-            raise AssumeRoleError(method, "Error reading role arn for role name {}: {}".format(role_name, e))
+            raise AssumeRoleError(method, "Error reading role arn for role name {}: {}".format(role_name, e),
+                                  account_id=account_id)
     except Exception as e:
         if verbose:
           print(e)
         method = get_credential_method_description(session)            
-        raise AssumeRoleError(method, "Error reading role arn for role name {}: {}".format(role_name, e))
+        raise AssumeRoleError(method, "Error reading role arn for role name {}: {}".format(role_name, e),
+                              account_id=account_id)
+
+
+def get_caller_account(aws_creds, index=None, verbose=False, region=None):
+    """Return the account id and partition the given credentials belong to, from
+    the role index when known, otherwise from sts:GetCallerIdentity."""
+    access_key_id = aws_creds.get('AWS_ACCESS_KEY_ID') if aws_creds else None
+    if index:
+        account = index.get_account(access_key_id)
+        if account:
+            return account['account_id'], account['partition']
+    session = get_boto3_session(aws_creds)
+    with timings.phase('sts:GetCallerIdentity'):
+        caller_arn = aws_retry.call(
+            'sts:GetCallerIdentity', session_pool.get_client(session, 'sts', region).get_caller_identity,
+            verbose=verbose)['Arn']
+    # arn:<partition>:sts::<account id>:...
+    arn_parts = caller_arn.split(':')
+    account_id, partition = arn_parts[4], arn_parts[1]
+    if verbose:
+        print("Credentials {} belong to account id {}".format(access_key_id, account_id))
+    if index and access_key_id:
+        index.put_account(access_key_id, account_id, partition)
+    return account_id, partition
+
+
+def resolve_role_arn(aws_creds, role_name, index, verbose=False, region=None):
+    """Resolve a role name to an arn without calling IAM where possible.  Returns
+    (role_arn, account_id, verified) where verified is False when the arn was only
+    constructed from the account id and has not yet been confirmed to exist."""
+    try:
+        account_id, partition = get_caller_account(aws_creds, index, verbose, region)
+    except Exception as e:
+        if verbose:
+            print("Unable to determine account id, falling back to IAM: {}".format(e))
+        return get_role_arn_from_name(aws_creds, role_name, verbose), None, True
+    role_arn = index.get_role_arn(account_id, role_name)
+    if role_arn:
+        if verbose:
+            print("Found role {} in role index: {}".format(role_name, role_arn))
+        return role_arn, account_id, True
+    return role_index.build_role_arn(account_id, role_name, partition), account_id, False
 
 
-def generate_aws_temp_creds(role_arn, aws_creds=None, verbose=False):
+def generate_aws_temp_creds(role_arn, aws_creds=None, verbose=False, region=None,
+                            external_id=None, session_name=None, duration_seconds=None):
     session = get_boto3_session(aws_creds)
-    sts_client = session.client('sts')
+    sts_client = session_pool.get_client(session, 'sts', region)
 
     aws_creds = {}
     try:
         random_session = uuid.uuid4().hex
-        assumed_role_object = sts_client.assume_role(
-            RoleArn=role_arn,
-            RoleSessionName="iamstarter-session-{}".format(random_session),
-            DurationSeconds=3600  # 1 hour max
-        )
+        assume_role_args = {
+            'RoleArn': role_arn,
+            'RoleSessionName': session_name or "iamstarter-session-{}".format(random_session),
+            'DurationSeconds': int(duration_seconds or 3600)  # 1 hour max when chaining roles
+        }
+        if external_id:
+            assume_role_args['ExternalId'] = external_id
+        with timings.phase('sts:AssumeRole', role_arn=role_arn):
+            assumed_role_object = aws_retry.call(
+                'sts:AssumeRole', sts_client.assume_role, verbose=verbose, **assume_role_args)
         aws_creds['AWS_ACCESS_KEY_ID'] = assumed_role_object["Credentials"]["AccessKeyId"]
         aws_creds['AWS_SECRET_ACCESS_KEY'] = assumed_role_object["Credentials"]["SecretAccessKey"]
         aws_creds['AWS_SESSION_TOKEN'] = assumed_role_object["Credentials"]["SessionToken"]
+        aws_creds['expiration'] = credential_cache.format_expiration(
+            assumed_role_object["Credentials"]["Expiration"])
     except Exception as e:
         if verbose:
           print(e)
@@ -0,0 +1,256 @@
+import os
+import json
+import shlex
+import subprocess
+from . import cache_utils
+from . import credential_cache
+from .aws_util_exceptions import ProfileParsingError
+
+
+INDEX_VERSION = 2
+CREDENTIAL_SOURCES = ('Environment', 'Ec2InstanceMetadata', 'EcsContainer')
+# options of a profile describing a role to assume
+ROLE_OPTIONS = ('role_arn', 'external_id', 'role_session_name', 'duration_seconds')
+# options which are never copied into the index, only read from the files they're
+# in when needed; parsed profiles map each to its [file, section] under SECRETS_KEY
+SECRET_OPTIONS = ('aws_secret_access_key', 'aws_session_token')
+SECRETS_KEY = 'secrets'
+
+# parsed profiles, by the paths and stats of the files they were parsed from
+_profiles = {}
+# the parsed files secrets are read from, by path, with the stat they were parsed at
+_secret_files = {}
+
+
+def get_config_file_path():
+    return os.path.expanduser(
+        os.environ.get('AWS_CONFIG_FILE', os.path.join('~', '.aws', 'config')))
+
+
+def get_credentials_file_path():
+    return os.path.expanduser(
+        os.environ.get('AWS_SHARED_CREDENTIALS_FILE', os.path.join('~', '.aws', 'credentials')))
+
+
+def get_file_stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime, stat.st_size]
+
+
+def read_config_file(path):
+    # only needed when the index is out of date
+    try:
+        import configparser
+    except ImportError:  # python 2
+        import ConfigParser as configparser
+    config = configparser.RawConfigParser()
+    try:
+        config.read([path])
+    except configparser.Error as e:
+        raise ProfileParsingError("Error parsing {}: {}".format(path, e))
+    return config
+
+
+def add_profile_options(profiles, name, path, config, section):
+    profile = profiles.setdefault(name, {})
+    for option, value in config.items(section):
+        if option in SECRET_OPTIONS:
+            profile.setdefault(SECRETS_KEY, {})[option] = [path, section]
+        else:
+            profile[option] = value
+
+
+def parse_profiles(config_path, credentials_path):
+    """Merge the profiles of the config and credentials files into a dict of
+    profile name -> options, the credentials file taking precedence.  Secret
+    options are left out, recording where to read them instead (see
+    get_profile_secrets)."""
+    profiles = {}
+    config = read_config_file(config_path)
+    for section in config.sections():
+        if section == 'default':
+            name = section
+        elif section.startswith('profile '):
+            name = section[len('profile '):].strip()
+        else:
+            continue
+        add_profile_options(profiles, name, config_path, config, section)
+    credentials = read_config_file(credentials_path)
+    for section in credentials.sections():
+        add_profile_options(profiles, section, credentials_path, credentials, section)
+    return profiles
+
+
+def read_secret_file(path):
+    """The parsed file, kept in memory (never on disk) until the file changes, so
+    a daemon or Runner resolving static keys again doesn't parse it every time."""
+    stat = get_file_stat(path)
+    memo = _secret_files.get(path)
+    if memo and memo[0] == stat:
+        return memo[1]
+    config = read_config_file(path)
+    _secret_files[path] = (stat, config)
+    return config
+
+
+def get_profile_secrets(profile):
+    """Read a profile's secret options from the files they're in."""
+    secrets = {}
+    for option, (path, section) in sorted(profile.get(SECRETS_KEY, {}).items()):
+        config = read_secret_file(path)
+        if config.has_option(section, option):
+            secrets[option] = config.get(section, option)
+    return secrets
+
+
+class ProfileIndex(object):
+    """On-disk index of the parsed AWS config and credentials files, so the files
+    are only parsed again once one of them changes.  Secret keys and session
+    tokens stay in the AWS files only.  Honours AWS_CONFIG_FILE and
+    AWS_SHARED_CREDENTIALS_FILE."""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or cache_utils.get_cache_dir('profiles')
+        self.config_path = get_config_file_path()
+        self.credentials_path = get_credentials_file_path()
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, 'index.json')
+
+    def load(self):
+        """Return the dict of profile name -> options."""
+        files = [
+            [self.config_path, get_file_stat(self.config_path)],
+            [self.credentials_path, get_file_stat(self.credentials_path)],
+        ]
+        memo_key = json.dumps(files)
+        if memo_key in _profiles:
+            return _profiles[memo_key]
+        index = cache_utils.read_json(self._index_path())
+        if index and index.get('version') == INDEX_VERSION and index.get('files') == files:
+            profiles = index['profiles']
+        else:
+            profiles = parse_profiles(self.config_path, self.credentials_path)
+            try:
+                cache_utils.write_json(self._index_path(), {
+                    'version': INDEX_VERSION,
+                    'files': files,
+                    'profiles': profiles,
+                })
+            except (IOError, OSError):
+                pass
+        _profiles[memo_key] = profiles
+        return profiles
+
+
+def get_base_source(profile_name, profile):
+    """Describe where the base credentials of a profile without a role come from."""
+    if profile.get('aws_access_key_id'):
+        secrets = get_profile_secrets(profile)
+        return {
+            'type': 'static',
+            'profile': profile_name,
+            'AWS_ACCESS_KEY_ID': profile['aws_access_key_id'],
+            'AWS_SECRET_ACCESS_KEY': secrets.get('aws_secret_access_key'),
+            'AWS_SESSION_TOKEN': secrets.get('aws_session_token'),
+        }
+    if profile.get('credential_process'):
+        return {
+            'type': 'credential_process',
+            'profile': profile_name,
+            'command': profile['credential_process'],
+        }
+    raise ProfileParsingError(
+        "Profile {} has no aws_access_key_id, credential_process or role_arn".format(profile_name))
+
+
+def resolve_profile_chain(profiles, profile_name):
+    """Follow a profile's source_profile chain to its base credentials.  Returns
+    (source, role_hops): where the base credentials come from, and the roles to
+    assume from them in order, the profile's own role last."""
+    role_hops = []
+    visited = []
+    name = profile_name
+    while True:
+        if name in visited:
+            raise ProfileParsingError("Profile {} has a source_profile cycle: {}".format(
+                profile_name, ' -> '.join(visited + [name])))
+        visited.append(name)
+        profile = profiles.get(name)
+        if profile is None:
+            raise ProfileParsingError("Profile {} not found in {} or {}".format(
+                name, get_config_file_path(), get_credentials_file_path()))
+        if 'role_arn' not in profile:
+            return get_base_source(name, profile), role_hops
+
+        if profile.get('mfa_serial'):
+            raise ProfileParsingError(
+                "Profile {} requires MFA (mfa_serial), which iam-docker-run can't prompt for".format(name))
+        hop = dict((option, profile[option]) for option in ROLE_OPTIONS if profile.get(option))
+        hop['profile'] = name
+        role_hops.insert(0, hop)
+
+        if profile.get('credential_source'):
+            if profile.get('source_profile'):
+                raise ProfileParsingError(
+                    "Profile {} has both a source_profile and a credential_source".format(name))
+            if profile['credential_source'] not in CREDENTIAL_SOURCES:
+                raise ProfileParsingError("Profile {} has an unsupported credential_source {}".format(
+                    name, profile['credential_source']))
+            return {
+                'type': 'credential_source',
+                'profile': name,
+                'credential_source': profile['credential_source'],
+            }, role_hops
+        if not profile.get('source_profile'):
+            raise ProfileParsingError(
+                "Profile {} does not indicate a source_profile or credential_source needed to assume role {}".format(
+                    name, profile['role_arn']))
+        if profile['source_profile'] == name:
+            # a profile can assume its role with its own keys
+            return get_base_source(name, dict(
+                (option, value) for option, value in profile.items() if option != 'role_arn')), role_hops
+        name = profile['source_profile']
+
+
+def run_credential_process(command):
+    """Run a credential_process and return the credentials it reports."""
+    try:
+        p = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE)
+        output, _ = p.communicate()
+    except OSError as e:
+        raise ProfileParsingError("Error running credential_process {}: {}".format(command, e))
+    if p.returncode != 0:
+        raise ProfileParsingError("credential_process {} exited with code {}".format(
+            command, p.returncode))
+    try:
+        data = json.loads(output.decode('utf-8'))
+        if data.get('Version') != 1:
+            raise ValueError('unsupported Version {}'.format(data.get('Version')))
+        aws_creds = {
+            'AWS_ACCESS_KEY_ID': data['AccessKeyId'],
+            'AWS_SECRET_ACCESS_KEY': data['SecretAccessKey'],
+            'AWS_SESSION_TOKEN': data.get('SessionToken'),
+        }
+        if data.get('Expiration'):
+            aws_creds['expiration'] = credential_cache.normalize_expiration(data['Expiration'])
+    except (ValueError, KeyError, AttributeError) as e:
+        raise ProfileParsingError("Invalid output from credential_process {}: {}".format(command, e))
+    return aws_creds
+
+
+def get_credential_process_creds(command, cache=None, verbose=False):
+    """Run a credential_process, reusing its output from the credential cache until
+    it expires."""
+    if not cache:
+        return run_credential_process(command)
+    key = cache.key(None, 'credential_process', command, None)
+    aws_creds, cache_hit = cache.get_or_create(
+        key, lambda: run_credential_process(command), verbose=verbose)
+    if cache_hit and verbose:
+        print("Using cached credential_process credentials (expires {})".format(
+            aws_creds['expiration']))
+    return aws_creds
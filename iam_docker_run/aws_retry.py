@@ -0,0 +1,176 @@
+from __future__ import print_function
+import os
+import time
+import random
+from botocore import exceptions as botocore_exceptions
+from botocore.exceptions import ClientError
+from . import cache_utils
+
+
+# error codes AWS returns when a request was throttled
+THROTTLING_ERROR_CODES = (
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'RequestLimitExceeded', 'RequestThrottled',
+    'PriorRequestNotComplete', 'SlowDown')
+# error codes of failures which can succeed when tried again
+TRANSIENT_ERROR_CODES = (
+    'RequestTimeout', 'RequestTimeoutException', 'InternalError', 'InternalFailure',
+    'ServiceUnavailable', 'IDPCommunicationError')
+TRANSIENT_STATUS_CODES = (500, 502, 503, 504)
+# connection failures and timeouts, HTTPClientError only exists in newer botocore
+TRANSIENT_EXCEPTIONS = tuple(
+    getattr(botocore_exceptions, name) for name in ('ConnectionError', 'HTTPClientError')
+    if hasattr(botocore_exceptions, name))
+
+DEFAULT_MAX_ATTEMPTS = 6
+DEFAULT_BASE_DELAY = 0.2
+DEFAULT_MAX_DELAY = 10.0
+# requests per second made by all iam-docker-run processes on the host together,
+# and how many can be made at once after a quiet period
+DEFAULT_RATE = 20.0
+DEFAULT_BURST = 40.0
+# the rate is halved when throttled, never going below this, and climbs back up
+# by RATE_RECOVERY per successful request
+MIN_RATE = 1.0
+RATE_RECOVERY = 0.5
+
+
+def get_env_number(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class RetryPolicy(object):
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None):
+        self.max_attempts = int(max_attempts or get_env_number(
+            'IAM_DOCKER_RUN_AWS_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS))
+        self.base_delay = DEFAULT_BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = DEFAULT_MAX_DELAY if max_delay is None else max_delay
+
+    def delay(self, attempt):
+        """Seconds to wait before retrying after the given (1 based) failed attempt,
+        exponential backoff with full jitter, so concurrent retries spread out."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+def classify_error(e):
+    """'throttled', 'transient' or None when the error isn't worth retrying."""
+    if isinstance(e, ClientError):
+        error = e.response.get('Error', {})
+        code = error.get('Code')
+        if code in THROTTLING_ERROR_CODES:
+            return 'throttled'
+        status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        if code in TRANSIENT_ERROR_CODES or status in TRANSIENT_STATUS_CODES:
+            return 'transient'
+        return None
+    if isinstance(e, TRANSIENT_EXCEPTIONS):
+        return 'transient'
+    return None
+
+
+class TokenBucket(object):
+    """Rate limiter shared by every iam-docker-run process of the user on the host,
+    its state kept in a small file in the cache directory and updated under a file
+    lock.  The rate adapts: it is halved whenever AWS throttles a request and
+    recovers as requests succeed."""
+
+    def __init__(self, cache_dir=None, rate=None, burst=None):
+        self.cache_dir = cache_dir or cache_utils.get_cache_dir('ratelimit')
+        self.max_rate = get_env_number('IAM_DOCKER_RUN_AWS_RATE', DEFAULT_RATE) if rate is None else rate
+        self.burst = get_env_number('IAM_DOCKER_RUN_AWS_BURST', DEFAULT_BURST) if burst is None else burst
+        # the rate seen by this process's last request, to skip the lock when it's at the maximum
+        self._last_rate = self.max_rate
+
+    def _state_path(self):
+        return os.path.join(self.cache_dir, 'aws.json')
+
+    def _update(self, func):
+        with cache_utils.file_lock(self._state_path()):
+            now = time.time()
+            state = cache_utils.read_json(self._state_path()) or {}
+            rate = min(self.max_rate, max(MIN_RATE, state.get('rate', self.max_rate)))
+            tokens = state.get('tokens', self.burst)
+            # refill for the time since the last update
+            tokens = min(self.burst, tokens + max(0, now - state.get('updated', now)) * rate)
+            tokens, rate, result = func(tokens, rate)
+            cache_utils.write_json(self._state_path(), {'tokens': tokens, 'rate': rate, 'updated': now})
+        self._last_rate = rate
+        return result
+
+    def reserve(self):
+        """Take a token, returning how many seconds to wait before using it."""
+        def take(tokens, rate):
+            # tokens may go negative, reserving tokens which haven't been refilled yet
+            wait = max(0.0, (1 - tokens) / rate)
+            return tokens - 1, rate, wait
+        return self._update(take)
+
+    def throttled(self):
+        self._update(lambda tokens, rate: (tokens, max(MIN_RATE, rate / 2), None))
+
+    def succeeded(self):
+        if self._last_rate < self.max_rate:
+            self._update(lambda tokens, rate: (tokens, min(self.max_rate, rate + RATE_RECOVERY), None))
+
+
+_bucket = None
+
+
+def get_bucket():
+    """The host-wide token bucket, or None when rate limiting is turned off with
+    IAM_DOCKER_RUN_AWS_RATE=0 or the cache directory is unusable."""
+    global _bucket
+    if _bucket is None:
+        if get_env_number('IAM_DOCKER_RUN_AWS_RATE', DEFAULT_RATE) <= 0:
+            return None
+        try:
+            _bucket = TokenBucket()
+        except (IOError, OSError):
+            return None
+    return _bucket
+
+
+def call(name, func, verbose=False, policy=None, bucket=None, **kwargs):
+    """Call an AWS api function with kwargs, first waiting for the host-wide rate
+    limiter, and retrying throttled and transient failures with backoff.  The last
+    error is raised once the attempts are used up."""
+    policy = policy or RetryPolicy()
+    bucket = bucket or get_bucket()
+    attempt = 1
+    while True:
+        if bucket:
+            try:
+                wait = bucket.reserve()
+            except (IOError, OSError):
+                wait = 0
+            if wait > 0:
+                if verbose:
+                    print("{}: waiting {:.2f}s for the AWS request rate limit".format(name, wait))
+                time.sleep(wait)
+        try:
+            result = func(**kwargs)
+        except Exception as e:
+            kind = classify_error(e)
+            if kind is None or attempt >= policy.max_attempts:
+                raise
+            if kind == 'throttled' and bucket:
+                try:
+                    bucket.throttled()
+                except (IOError, OSError):
+                    pass
+            delay = policy.delay(attempt)
+            if verbose:
+                print("{}: {} ({}), retrying in {:.2f}s (attempt {} of {})".format(
+                    name, kind, e, delay, attempt + 1, policy.max_attempts))
+            time.sleep(delay)
+            attempt += 1
+            continue
+        if bucket:
+            try:
+                bucket.succeeded()
+            except (IOError, OSError):
+                pass
+        return result
@@ -4,6 +4,8 @@ class ProfileParsingError(Exception):
 
 class RoleNotFoundError(Exception):
     def __init__(self, credential_method, *args, **kwargs):
+        # the account searched for the role, when already known
+        self.account_id = kwargs.pop('account_id', None)
         Exception.__init__(self, *args, **kwargs)
         # a string describing the IAM context
         self.credential_method = credential_method
@@ -11,6 +13,8 @@ class RoleNotFoundError(Exception):
 
 class AssumeRoleError(Exception):
     def __init__(self, credential_method, *args, **kwargs):
+        # the account the role was assumed from, when already known
+        self.account_id = kwargs.pop('account_id', None)
         Exception.__init__(self, *args, **kwargs)
         # a string describing the IAM context
         self.credential_method = credential_method
@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+import tempfile
+import contextlib
+from . import shell_utils
+
+try:
+    import fcntl
+except ImportError:  # windows has no fcntl, locking becomes a no-op there
+    fcntl = None
+
+
+DEFAULT_CACHE_DIR = os.path.join('~', '.cache', 'iam-docker-run')
+
+
+def get_cache_dir(subdir=None):
+    """Return the directory holding iam-docker-run's on-disk caches, creating it if
+    needed.  The location can be overridden with IAM_DOCKER_RUN_CACHE_DIR.  Cached
+    files can hold credentials, so the directory is kept private to the user."""
+    path = os.path.expanduser(
+        os.environ.get('IAM_DOCKER_RUN_CACHE_DIR', DEFAULT_CACHE_DIR))
+    if subdir:
+        path = os.path.join(path, subdir)
+    shell_utils.mkdir_p(path)
+    try:
+        os.chmod(path, 0o700)
+    except OSError:
+        pass
+    return path
+
+
+def cache_key(*parts):
+    """Build a filesystem safe key from an arbitrary tuple of values."""
+    serialized = json.dumps([p if p is not None else '' for p in parts])
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def read_json(path):
+    """Read a json cache file, treating a missing or corrupt file as a cache miss."""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    """Atomically write a json cache file readable only by the current user, so a
+    concurrent reader never sees a partially written file."""
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.chmod(temp_path, 0o600)
+        os.rename(temp_path, path)
+    except Exception:
+        shell_utils.delete_file_silently(temp_path)
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Hold an exclusive advisory lock on path + '.lock' for the duration of the
+    block, used to coalesce concurrent iam-docker-run processes on one host."""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path + '.lock', os.O_CREAT | os.O_RDWR, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
@@ -0,0 +1,356 @@
+from __future__ import print_function
+import os
+import copy
+import time
+import uuid
+import argparse
+import subprocess
+from . import cache_utils
+from . import docker_cli_utils
+from . import env_assembly
+from . import iam_docker_run
+from .docker_cli_utils import DockerCliUtilError
+
+
+POOL_LABEL = 'iam-docker-run.pool'
+CONTAINER_PREFIX = 'idr-pool-'
+DEFAULT_IDLE_TIMEOUT = 600
+# keep a container running, waiting for commands to be exec'd into it, tried in
+# order.  Containers kept this way need one of them in their image, which
+# distroless and scratch images don't have
+IDLE_COMMANDS = (['tail', '-f', '/dev/null'], ['sleep', '2147483647'])
+# docker run's exit codes when the container's command can't be run or found
+COMMAND_ERROR_CODES = (126, 127)
+# how often a launch waiting for a container another launch is starting checks on it
+STARTING_POLL_INTERVAL = 0.1
+# passed to each exec by name, so the values come from the docker cli's environment
+# rather than appearing in its arguments
+AWS_ENV_NAMES = (
+    'AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN',
+    'AWS_DEFAULT_REGION', 'AWS_REGION')
+
+
+class ContainerPoolError(Exception):
+    pass
+
+
+def get_file_stat(path):
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [stat.st_mtime, stat.st_size]
+
+
+def pool_key(args, region):
+    """Containers are only shared between launches which would create the same
+    container, apart from the command and the -e variables given to each exec."""
+    custom_env_file = os.path.abspath(args.custom_env_file) if args.custom_env_file else None
+    return cache_utils.cache_key(
+        args.image, args.profile, args.role, args.role_arn, region,
+        custom_env_file, get_file_stat(custom_env_file),
+        os.path.abspath(args.host_source_path) if args.host_source_path else None,
+        args.container_source_path, args.selinux, args.volumes, args.caps,
+        args.mount_docker, args.network, args.portmaps, args.dns, args.dns_search,
+        args.add_host, args.shm_size)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def start_idle_container(name, image, start_func):
+    """Start a container which idles until commands are exec'd into it, running
+    the first of IDLE_COMMANDS the image has.  start_func(command) starts the
+    container with the command and returns docker run's exit code."""
+    for command in IDLE_COMMANDS:
+        exit_code = start_func(command)
+        if exit_code == 0:
+            return command
+        if exit_code not in COMMAND_ERROR_CODES:
+            raise ContainerPoolError("Error starting container {} (docker exit code {})".format(
+                name, exit_code))
+        # the container was created even though its command couldn't be run
+        docker_cli_utils.force_remove_containers([name])
+    raise ContainerPoolError(
+        "Image {} has neither {} to keep a container idle for commands to be exec'd into".format(
+            image, ' nor '.join(command[0] for command in IDLE_COMMANDS)))
+
+
+class ContainerPool(object):
+    """Long running containers kept for reuse, tracked in a state file in the cache
+    directory shared by every iam-docker-run process of the user.  Each container
+    records its pool key, the command its image runs by default, when it was last
+    used and the pids of the processes running a command in it, if any."""
+
+    def __init__(self, cache_dir=None, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.cache_dir = cache_dir or cache_utils.get_cache_dir('pool')
+        self.idle_timeout = idle_timeout
+
+    def _state_path(self):
+        return os.path.join(self.cache_dir, 'pool.json')
+
+    def _read_state(self):
+        state = cache_utils.read_json(self._state_path()) or {}
+        state.setdefault('containers', {})
+        return state
+
+    def _write_state(self, state):
+        cache_utils.write_json(self._state_path(), state)
+
+    def _reconcile(self, state):
+        """Forget containers which are no longer running, or were abandoned while
+        being started, and the pids of processes which have exited."""
+        running = set(docker_cli_utils.list_containers(POOL_LABEL))
+        gone = []
+        for name, container in list(state['containers'].items()):
+            container['pids'] = [pid for pid in container.get('pids') or [] if pid_alive(pid)]
+            if container.get('starting'):
+                # being started by another launch, unless that launch has exited
+                alive = bool(container['pids'])
+            else:
+                alive = name in running
+            if alive:
+                continue
+            gone.append(name)
+            del state['containers'][name]
+        # a stopped container still holds its name
+        docker_cli_utils.force_remove_containers(gone)
+
+    def _evict(self, state, idle_timeout):
+        """Remove containers idle for longer than idle_timeout seconds."""
+        now = time.time()
+        evicted = [
+            name for name, container in state['containers'].items()
+            if not self.in_use(container) and now - container['last_used'] > idle_timeout]
+        for name in evicted:
+            del state['containers'][name]
+        docker_cli_utils.force_remove_containers(evicted)
+        return evicted
+
+    def in_use(self, container):
+        return any(pid_alive(pid) for pid in container.get('pids') or [])
+
+    def acquire(self, key, size, create_func):
+        """Return (name, container) for a container of the pool key which isn't
+        running a command, creating one with create_func(name) -> container if
+        there are fewer than size.  When all size containers are busy the least
+        recently used one is shared.  Containers are created without holding the
+        pool's lock, so other launches don't wait behind the docker run."""
+        while True:
+            with cache_utils.file_lock(self._state_path()):
+                state = self._read_state()
+                self._reconcile(state)
+                self._evict(state, self.idle_timeout)
+                candidates = sorted(
+                    [(name, container) for name, container in state['containers'].items()
+                     if container['key'] == key],
+                    key=lambda item: item[1]['last_used'])
+                ready = [item for item in candidates if not item[1].get('starting')]
+                idle = [item for item in ready if not self.in_use(item[1])]
+                if idle:
+                    name, container = idle[-1]
+                elif len(candidates) < size:
+                    # reserve the slot, then start the container once unlocked
+                    name = CONTAINER_PREFIX + uuid.uuid4().hex[:12]
+                    container = {'key': key, 'starting': True}
+                    state['containers'][name] = container
+                elif ready:
+                    name, container = ready[0]
+                else:
+                    # every container of the key is still being started by another launch
+                    name, container = None, None
+                if container is not None:
+                    container.setdefault('pids', []).append(os.getpid())
+                    container['last_used'] = time.time()
+                    self._write_state(state)
+            if container is None:
+                time.sleep(STARTING_POLL_INTERVAL)
+            elif container.get('starting'):
+                return name, self._create(key, name, create_func)
+            else:
+                return name, container
+
+    def _create(self, key, name, create_func):
+        try:
+            details = create_func(name)
+        except BaseException:
+            with cache_utils.file_lock(self._state_path()):
+                state = self._read_state()
+                state['containers'].pop(name, None)
+                self._write_state(state)
+            raise
+        with cache_utils.file_lock(self._state_path()):
+            state = self._read_state()
+            container = state['containers'].setdefault(name, {'key': key, 'pids': [os.getpid()]})
+            container.pop('starting', None)
+            container.update(details)
+            container['last_used'] = time.time()
+            self._write_state(state)
+        return container
+
+    def release(self, name):
+        with cache_utils.file_lock(self._state_path()):
+            state = self._read_state()
+            container = state['containers'].get(name)
+            if container:
+                pids = container.get('pids') or []
+                if os.getpid() in pids:
+                    pids.remove(os.getpid())
+                container['last_used'] = time.time()
+                self._write_state(state)
+
+    def containers(self):
+        return self._read_state()['containers']
+
+    def prune(self, remove_all=False):
+        """Remove idle containers (every container with remove_all) and return their names."""
+        with cache_utils.file_lock(self._state_path()):
+            state = self._read_state()
+            self._reconcile(state)
+            if remove_all:
+                removed = list(state['containers'])
+                state['containers'] = {}
+                docker_cli_utils.force_remove_containers(
+                    set(removed) | set(docker_cli_utils.list_containers(POOL_LABEL)))
+            else:
+                removed = self._evict(state, self.idle_timeout)
+            self._write_state(state)
+        return removed
+
+
+def create_pool_container(args, key, aws_creds, region, name):
+    """Start a container which idles until commands are exec'd into it, with the
+    environment a regular launch would give it."""
+    image_entrypoint, image_cmd = docker_cli_utils.get_image_command(args.image)
+    # -e variables are given to each exec instead, they may differ between launches
+    env_file = iam_docker_run.generate_temp_env_file(
+        aws_creds, region, args.custom_env_file, None)
+
+    def start(command):
+        pool_args = copy.copy(args)
+        pool_args.detached = True
+        pool_args.interactive = False
+        pool_args.shell = False
+        pool_args.full_entrypoint = None
+        pool_args.entrypoint = command[0]
+        pool_args.cmd = ' '.join(command[1:])
+        docker_args = iam_docker_run.build_docker_run_args(pool_args, name, env_file, remove=False)
+        docker_args[2:2] = ['--label', '{}={}'.format(POOL_LABEL, key)]
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(
+                docker_args, stdout=devnull, env=iam_docker_run.get_docker_env(args),
+                **env_assembly.popen_kwargs(env_file))
+    try:
+        print("Starting pool container {}".format(name))
+        start_idle_container(name, args.image, start)
+    finally:
+        env_assembly.release_env_file(env_file)
+    return {
+        'image': args.image,
+        'entrypoint': image_entrypoint,
+        'cmd': image_cmd,
+        'created': time.time(),
+    }
+
+
+def get_exec_command(args, container):
+    """The command to exec, following docker run's rules for combining the
+    --entrypoint and command with the image's own."""
+    entrypoint, cmd = iam_docker_run.get_entrypoint_and_cmd(args)
+    if entrypoint:
+        return [entrypoint] + cmd
+    command = container['entrypoint'] + (cmd or container['cmd'])
+    if not command:
+        raise ContainerPoolError("Image {} has no command to run, give --cmd or --entrypoint".format(
+            args.image))
+    return command
+
+
+def build_docker_exec_args(args, name, container, aws_env):
+    docker_args = ['docker', 'exec']
+    if args.shell or args.interactive:
+        docker_args.append('-it')
+    if args.workdir:
+        docker_args.extend(['-w', args.workdir])
+    for env_name in sorted(aws_env):
+        docker_args.extend(['-e', env_name])
+    for envvar in args.envvars or []:
+        docker_args.extend(['-e', envvar])
+    docker_args.append(name)
+    docker_args.extend(get_exec_command(args, container))
+    return docker_args
+
+
+def get_aws_env(aws_creds, region):
+    """The current credentials, given to every exec so a container outliving the
+    credentials it was started with always runs commands with fresh ones."""
+    aws_env = {}
+    if aws_creds:
+        aws_env['AWS_ACCESS_KEY_ID'] = aws_creds['AWS_ACCESS_KEY_ID']
+        aws_env['AWS_SECRET_ACCESS_KEY'] = aws_creds['AWS_SECRET_ACCESS_KEY']
+        if aws_creds.get('AWS_SESSION_TOKEN'):
+            aws_env['AWS_SESSION_TOKEN'] = aws_creds['AWS_SESSION_TOKEN']
+    if region:
+        aws_env['AWS_DEFAULT_REGION'] = region
+        aws_env['AWS_REGION'] = region
+    return aws_env
+
+
+def run_in_pool(args, aws_creds, region):
+    """Run the command in a pooled container and return its exit code."""
+    key = pool_key(args, region)
+    pool = ContainerPool(idle_timeout=args.pool_idle_timeout)
+    name, container = pool.acquire(
+        key, max(1, args.pool_size),
+        lambda name: create_pool_container(args, key, aws_creds, region, name))
+    try:
+        aws_env = get_aws_env(aws_creds, region)
+        docker_args = build_docker_exec_args(args, name, container, aws_env)
+        print(' '.join(docker_args))
+        env = dict(os.environ)
+        for env_name in AWS_ENV_NAMES:
+            env.pop(env_name, None)
+        env.update(aws_env)
+        exit_code = subprocess.call(docker_args, env=env)
+    finally:
+        pool.release(name)
+    print("Command exited with code {}".format(exit_code))
+    return exit_code
+
+
+def create_pool_parser():
+    parser = argparse.ArgumentParser(
+        prog='idr pool',
+        description='Manage the warm containers kept by launches run with --pool')
+    parser.add_argument('action', choices=['ls', 'prune'])
+    parser.add_argument('--all', action='store_true', default=False,
+                        help='With prune, remove every pool container rather than only idle ones')
+    parser.add_argument('--idle-timeout', type=int, default=DEFAULT_IDLE_TIMEOUT,
+                        help='With prune, remove containers idle for longer than this many seconds (default {})'.format(
+                            DEFAULT_IDLE_TIMEOUT))
+    return parser
+
+
+def pool_main(argv):
+    args = create_pool_parser().parse_args(argv)
+    pool = ContainerPool(idle_timeout=args.idle_timeout)
+    try:
+        if args.action == 'prune':
+            for name in pool.prune(remove_all=args.all):
+                print("Removed {}".format(name))
+            return 0
+        now = time.time()
+        for name, container in sorted(pool.containers().items()):
+            print("{}  {:<40} idle {:>6.0f}s{}".format(
+                name, container.get('image', '(starting)'), now - container['last_used'],
+                '  in use by pid {}'.format(', '.join(str(pid) for pid in container['pids']))
+                if pool.in_use(container) else ''))
+    except DockerCliUtilError as e:
+        print(e)
+        return 1
+    return 0
@@ -0,0 +1,121 @@
+import os
+import re
+import time
+import calendar
+from . import cache_utils
+from . import shell_utils
+
+
+# reuse cached credentials only while they have at least this many seconds left
+DEFAULT_MIN_TTL = 900
+EXPIRATION_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+ISO8601_RE = re.compile(
+    r'^(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}:\d{2})(?:\.\d+)?(Z|[+-]\d{2}:?\d{2})?$')
+
+
+def format_expiration(expiration):
+    """Normalize the datetime returned by STS to a UTC ISO 8601 string."""
+    return time.strftime(
+        EXPIRATION_FORMAT,
+        time.gmtime(calendar.timegm(expiration.utctimetuple())))
+
+
+def parse_expiration(expiration):
+    """Convert an expiration string written by format_expiration to epoch seconds."""
+    return calendar.timegm(time.strptime(expiration, EXPIRATION_FORMAT))
+
+
+def normalize_expiration(expiration):
+    """Convert an ISO 8601 timestamp, such as the Expiration a credential_process
+    reports, to the UTC format used by the cache."""
+    match = ISO8601_RE.match(expiration.strip())
+    if not match:
+        raise ValueError("Unrecognized expiration timestamp {}".format(expiration))
+    date, clock, offset = match.groups()
+    seconds = calendar.timegm(time.strptime('{}T{}'.format(date, clock), '%Y-%m-%dT%H:%M:%S'))
+    if offset and offset != 'Z':
+        sign = -1 if offset[0] == '-' else 1
+        digits = offset[1:].replace(':', '')
+        seconds -= sign * (int(digits[:2]) * 3600 + int(digits[2:]) * 60)
+    return time.strftime(EXPIRATION_FORMAT, time.gmtime(seconds))
+
+
+def get_min_ttl(min_ttl=None):
+    if min_ttl is not None:
+        return int(min_ttl)
+    return int(os.environ.get('IAM_DOCKER_RUN_CACHE_MIN_TTL', DEFAULT_MIN_TTL))
+
+
+def cache_disabled():
+    return bool(os.environ.get('IAM_DOCKER_RUN_DISABLE_CREDENTIAL_CACHE', None))
+
+
+class CredentialCache(object):
+    """On-disk cache of STS temporary credentials, one file per assume role hop.
+
+    Entries are keyed by the access key used to make the call, the profile, the
+    role and the region, and are only handed back while they have at least
+    min_ttl seconds of lifetime left."""
+
+    def __init__(self, cache_dir=None, min_ttl=None):
+        self.cache_dir = cache_dir or cache_utils.get_cache_dir('credentials')
+        self.min_ttl = get_min_ttl(min_ttl)
+
+    def key(self, source_access_key, profile_name, role, region):
+        return cache_utils.cache_key(source_access_key, profile_name, role, region)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, '{}.json'.format(key))
+
+    def get(self, key):
+        entry = cache_utils.read_json(self._path(key))
+        if not entry or 'credentials' not in entry:
+            return None
+        try:
+            expires_at = parse_expiration(entry['credentials']['expiration'])
+        except (KeyError, ValueError):
+            return None
+        if expires_at - time.time() < self.min_ttl:
+            return None
+        return entry['credentials']
+
+    def put(self, key, aws_creds):
+        if 'expiration' not in aws_creds:
+            # without an expiration there is no safe way to reuse them
+            return
+        cache_utils.write_json(self._path(key), {'credentials': aws_creds})
+        self.prune()
+
+    def prune(self):
+        """Remove entries which have already expired."""
+        now = time.time()
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            entry = cache_utils.read_json(path)
+            try:
+                expires_at = parse_expiration(entry['credentials']['expiration'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if expires_at < now:
+                shell_utils.delete_file_silently(path)
+
+    def get_or_create(self, key, create_func, verbose=False):
+        """Return cached credentials for key, otherwise call create_func to generate
+        them.  The lock makes concurrent callers wait for the first one's STS call
+        and then pick up its result rather than each calling STS themselves."""
+        aws_creds = self.get(key)
+        if aws_creds:
+            return aws_creds, True
+        with cache_utils.file_lock(self._path(key)):
+            aws_creds = self.get(key)
+            if aws_creds:
+                return aws_creds, True
+            aws_creds = create_func()
+            try:
+                self.put(key, aws_creds)
+            except (IOError, OSError) as e:
+                if verbose:
+                    print("Error writing credential cache: {}".format(e))
+        return aws_creds, False
@@ -0,0 +1,133 @@
+from __future__ import print_function
+import json
+import time
+import uuid
+import threading
+from . import credential_cache
+from . import output_capture
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:  # python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+
+CREDENTIALS_PATH = '/credentials'
+# refresh this many seconds before the credentials expire
+DEFAULT_REFRESH_MARGIN = 600
+# wait this long before trying again after a failed refresh
+REFRESH_RETRY_INTERVAL = 30
+
+
+class CredentialsServerError(Exception):
+    pass
+
+
+class CredentialsRequestHandler(BaseHTTPRequestHandler):
+    """Serves the current credentials in the format of the ECS container credentials
+    endpoint, to callers presenting the authorization token."""
+
+    def log_message(self, format, *args):
+        if self.server.credentials_server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_body(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        credentials_server = self.server.credentials_server
+        if self.path != CREDENTIALS_PATH:
+            self.send_body(404, {'message': 'Not found'})
+            return
+        if self.headers.get('Authorization') != credentials_server.token:
+            self.send_body(401, {'message': 'Unauthorized'})
+            return
+        self.send_body(200, credentials_server.get_ecs_credentials())
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class CredentialsServer(object):
+    """Local emulation of the ECS container credentials endpoint.  Holds the assumed
+    role credentials and refreshes them in the background before they expire, so
+    a container can run for longer than the lifetime of one set of credentials."""
+
+    def __init__(self, refresh_func, aws_creds, bind_host='127.0.0.1', port=0,
+                 refresh_margin=DEFAULT_REFRESH_MARGIN, retry_interval=REFRESH_RETRY_INTERVAL,
+                 verbose=False):
+        self.refresh_func = refresh_func
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.verbose = verbose
+        self.token = uuid.uuid4().hex
+        self._aws_creds = aws_creds
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._server = ThreadingHTTPServer((bind_host, port), CredentialsRequestHandler)
+        self._server.credentials_server = self
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def get_ecs_credentials(self):
+        with self._lock:
+            aws_creds = self._aws_creds
+        return {
+            'AccessKeyId': aws_creds['AWS_ACCESS_KEY_ID'],
+            'SecretAccessKey': aws_creds['AWS_SECRET_ACCESS_KEY'],
+            'Token': aws_creds.get('AWS_SESSION_TOKEN'),
+            'Expiration': aws_creds['expiration'],
+        }
+
+    def seconds_until_refresh(self):
+        with self._lock:
+            expires_at = credential_cache.parse_expiration(self._aws_creds['expiration'])
+        return max(0, expires_at - self.refresh_margin - time.time())
+
+    def refresh(self):
+        # the container's output shares the console, so the progress messages of
+        # generating credentials are only shown when verbose
+        with output_capture.capture() as messages:
+            aws_creds = self.refresh_func()
+        if self.verbose:
+            print(''.join(messages), end='')
+        if 'expiration' not in aws_creds:
+            raise CredentialsServerError("Refreshed credentials have no expiration")
+        with self._lock:
+            self._aws_creds = aws_creds
+        if self.verbose:
+            print("Refreshed container credentials {}, expiring {}".format(
+                aws_creds['AWS_ACCESS_KEY_ID'], aws_creds['expiration']))
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(self.seconds_until_refresh()):
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Error refreshing container credentials: {}".format(e))
+                if self._stopped.wait(self.retry_interval):
+                    break
+
+    def start(self):
+        if 'expiration' not in self._aws_creds:
+            raise CredentialsServerError(
+                "The credentials endpoint requires temporary credentials from an assumed role")
+        for target in (self._server.serve_forever, self._refresh_loop):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
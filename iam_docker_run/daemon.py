@@ -0,0 +1,175 @@
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from . import daemon_client
+from . import iam_docker_run
+from . import output_capture
+from . import timings
+from .aws_util_exceptions import ProfileParsingError
+from .aws_util_exceptions import RoleNotFoundError
+from .aws_util_exceptions import AssumeRoleError
+
+try:
+    import socketserver
+except ImportError:  # python 2
+    import SocketServer as socketserver
+
+
+class DaemonError(Exception):
+    pass
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """Handles one json request per connection, answered with one json response."""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+        except ValueError:
+            response = {'status': 'error', 'message': 'Invalid request'}
+        else:
+            response = self.server.idr_daemon.handle_request(request)
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class UnixDaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def remove_stale_socket(socket_path):
+    """Remove the socket left behind by a daemon which is no longer running."""
+    if not os.path.exists(socket_path):
+        return
+    try:
+        daemon_client.send_request({'command': 'ping'}, socket_path, timeout=2)
+    except daemon_client.DaemonUnavailableError:
+        os.remove(socket_path)
+        return
+    raise DaemonError("An idr daemon is already listening on {}".format(socket_path))
+
+
+class Daemon(object):
+    """A long running process generating credentials for launches.  It keeps boto3
+    imported, its sessions and their connections to STS open, and the parsed
+    profiles in memory, so a launch only pays for a round trip over a unix socket."""
+
+    def __init__(self, socket_path, verbose=False):
+        self.socket_path = socket_path
+        self.verbose = verbose
+        self.started = time.time()
+        self.requests = 0
+        self._server = None
+
+    def handle_request(self, request):
+        command = request.get('command')
+        self.requests += 1
+        if command == 'ping':
+            return {
+                'status': 'ok',
+                'pid': os.getpid(),
+                'uptime': time.time() - self.started,
+                'requests': self.requests,
+            }
+        if command == 'stop':
+            threading.Thread(target=self._server.shutdown).start()
+            return {'status': 'ok'}
+        if command == 'aws_creds':
+            return self.aws_creds(request)
+        return {'status': 'error', 'message': 'Unknown command {}'.format(command)}
+
+    def aws_creds(self, request):
+        """Generate the credentials for a launch.  What generating them prints and
+        the phases it went through are returned for the client to report, each
+        request recording its own as requests are served concurrently."""
+        options = request.get('options') or {}
+        args = argparse.Namespace(**dict(
+            (name, options.get(name)) for name in daemon_client.CREDENTIAL_OPTIONS))
+        region = request.get('region')
+        with timings.recording(timings.Timings()) as request_timings, \
+                output_capture.capture() as messages:
+            response = self.generate_aws_creds(args, region, request.get('env') or {})
+        response['messages'] = ''.join(messages)
+        if self.verbose:
+            sys.stdout.write(response['messages'])
+        response['spans'] = request_timings.spans
+        return response
+
+    def generate_aws_creds(self, args, region, environ):
+        try:
+            aws_creds = iam_docker_run.generate_aws_creds(args, region, environ=environ)
+        except (ProfileParsingError, RoleNotFoundError, AssumeRoleError) as e:
+            return {
+                'status': 'error',
+                'message': iam_docker_run.describe_credential_error(e, args, region),
+            }
+        except Exception as e:
+            return {'status': 'error', 'message': 'Error generating credentials: {}'.format(e)}
+        return {'status': 'ok', 'aws_creds': aws_creds}
+
+    def serve_forever(self):
+        remove_stale_socket(self.socket_path)
+        self._server = UnixDaemonServer(self.socket_path, DaemonRequestHandler)
+        self._server.idr_daemon = self
+        try:
+            os.chmod(self.socket_path, 0o600)
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
+
+def create_daemon_parser():
+    parser = argparse.ArgumentParser(
+        prog='idr daemon',
+        description='Keep AWS sessions warm for launches run with IAM_DOCKER_RUN_USE_DAEMON=1')
+    parser.add_argument('--socket', required=False,
+                        help='The unix socket to listen on (default {})'.format(
+                            os.path.join('<cache dir>', daemon_client.SOCKET_NAME)))
+    parser.add_argument('--status', action='store_true', default=False,
+                        help='Report whether the daemon is running')
+    parser.add_argument('--stop', action='store_true', default=False,
+                        help='Stop the running daemon')
+    parser.add_argument('--verbose', action='store_true', default=False)
+    return parser
+
+
+def daemon_main(argv):
+    args = create_daemon_parser().parse_args(argv)
+    socket_path = args.socket or daemon_client.get_socket_path()
+
+    if args.status or args.stop:
+        command = 'stop' if args.stop else 'ping'
+        try:
+            response = daemon_client.send_request({'command': command}, socket_path, timeout=5)
+        except daemon_client.DaemonUnavailableError:
+            print("No idr daemon is listening on {}".format(socket_path))
+            return 1
+        if args.stop:
+            print("Stopped idr daemon on {}".format(socket_path))
+        else:
+            print("idr daemon (pid {}) listening on {}, up {:.0f}s, {} requests".format(
+                response['pid'], socket_path, response['uptime'], response['requests']))
+        return 0
+
+    if args.verbose:
+        iam_docker_run.VERBOSE_MODE = True
+    # pay for importing boto3 once, up front
+    from . import aws_iam_utils
+    daemon = Daemon(socket_path, verbose=args.verbose)
+    try:
+        print("idr daemon listening on {}".format(socket_path))
+        sys.stdout.flush()
+        daemon.serve_forever()
+    except DaemonError as e:
+        print(e)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
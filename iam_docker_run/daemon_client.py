@@ -0,0 +1,57 @@
+import os
+import json
+import socket
+from . import cache_utils
+
+
+SOCKET_NAME = 'daemon.sock'
+# generating credentials can mean a few STS round trips, or waiting on another
+# launch to finish generating the same credentials
+DEFAULT_TIMEOUT = 120
+# the launch arguments which decide the credentials the daemon generates
+CREDENTIAL_OPTIONS = (
+    'profile', 'role', 'role_arn', 'no_credential_cache', 'credential_cache_min_ttl', 'verbose')
+# without a profile the credentials come from the launching process's environment
+FORWARDED_ENV = ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN')
+
+
+class DaemonUnavailableError(Exception):
+    pass
+
+
+def get_socket_path():
+    """The daemon's unix socket, private to the user as it lives in the cache
+    directory.  Can be overridden with IAM_DOCKER_RUN_DAEMON_SOCKET."""
+    return os.environ.get('IAM_DOCKER_RUN_DAEMON_SOCKET') or \
+        os.path.join(cache_utils.get_cache_dir(), SOCKET_NAME)
+
+
+def send_request(request, socket_path=None, timeout=DEFAULT_TIMEOUT):
+    """Send one request to the daemon and return its response."""
+    socket_path = socket_path or get_socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        chunks = []
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            chunks.append(data)
+        return json.loads(b''.join(chunks).decode('utf-8'))
+    except (socket.error, ValueError) as e:
+        raise DaemonUnavailableError("{}: {}".format(socket_path, e))
+    finally:
+        sock.close()
+
+
+def request_aws_creds(args, region, socket_path=None):
+    """Ask the daemon to generate the credentials for the launch arguments."""
+    return send_request({
+        'command': 'aws_creds',
+        'options': dict((name, getattr(args, name, None)) for name in CREDENTIAL_OPTIONS),
+        'region': region,
+        'env': dict((name, os.environ[name]) for name in FORWARDED_ENV if name in os.environ),
+    }, socket_path)
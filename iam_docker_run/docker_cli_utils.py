@@ -1,8 +1,21 @@
 import os
+import sys
+import json
 import uuid
+import subprocess
+try:
+    from shlex import quote as shlex_quote
+except ImportError:  # python 2
+    from pipes import quote as shlex_quote
 from . import shell_utils
+from . import timings
 
 
+# every container started by iam-docker-run is labelled, and detached ones, which
+# nothing waits on to remove, are also labelled for removal by idr reap once they exit
+LAUNCH_LABEL = 'iam-docker-run'
+REAP_LABEL = 'iam-docker-run.reap'
+
 class ContainerNameTempFileError(Exception):
     pass
 
@@ -16,7 +29,8 @@ def get_docker_inspect_exit_code(container_name):
     than the exit code of Docker itself), given the container name."""
     inspect_command = "docker inspect {} --format='{{{{.State.ExitCode}}}}'".format(
         container_name)
-    returncode, output = shell_utils.exec_command(inspect_command)
+    with timings.phase('docker:inspect'):
+        returncode, output = shell_utils.exec_command(inspect_command)
     if not returncode == 0:
         raise DockerCliUtilError("Error from docker (docker exit code {}) inspect trying to get container exit code, output: {}".format(returncode, output))
 
@@ -29,14 +43,195 @@ def get_docker_inspect_exit_code(container_name):
     return container_exit_code
 
 
+def get_container_state(container_name):
+    """The id and exit code of the container, from a single docker inspect."""
+    try:
+        with timings.phase('docker:inspect'):
+            output = subprocess.check_output(
+                ['docker', 'inspect', '--format', '{{.Id}} {{.State.ExitCode}}', container_name])
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise DockerCliUtilError("Error from docker inspect of container {}: {}".format(container_name, e))
+    try:
+        container_id, exit_code = output.decode('utf-8').split()
+        return container_id, int(exit_code)
+    except ValueError:
+        raise DockerCliUtilError("Error parsing docker inspect output: {}".format(output))
+
+
 def remove_docker_container(container_name):
     """Remove the Docker container given its name."""
     remove_command = "docker rm {}".format(container_name)
-    exit_code = os.system(remove_command)
+    with timings.phase('docker:rm'):
+        exit_code = os.system(remove_command)
     if not exit_code == 0:
         raise DockerCliUtilError("Error removing named container! Run 'docker container prune' to cleanup manually.")
 
 
+def exec_docker(docker_args, env_file=None, env=None):
+    """Replace the current process with the given docker command, run with env if
+    given.  A file backed env file is opened and unlinked first and handed to docker
+    as an inherited file descriptor, so it is consumed by docker and cleaned up by
+    the kernel when docker exits.  Memory backed env files are already inherited
+    descriptors."""
+    if env_file and os.path.isdir('/dev/fd') and not env_file.startswith('/dev/fd/'):
+        fd = os.open(env_file, os.O_RDONLY)
+        if hasattr(os, 'set_inheritable'):
+            os.set_inheritable(fd, True)
+        os.remove(env_file)
+        fd_path = '/dev/fd/{}'.format(fd)
+        docker_args = [fd_path if arg == env_file else arg for arg in docker_args]
+    print(' '.join(shlex_quote(arg) for arg in docker_args))
+    sys.stdout.flush()
+    if env is not None:
+        os.execvpe(docker_args[0], docker_args, env)
+    os.execvp(docker_args[0], docker_args)
+
+
+def image_exists(image):
+    """Whether the image is present locally."""
+    return shell_utils.call_quietly(['docker', 'image', 'inspect', image]) == 0
+
+
+def get_image_id(image):
+    """The id of the local image, or None if it isn't present locally."""
+    with open(os.devnull, 'w') as devnull:
+        try:
+            output = subprocess.check_output(
+                ['docker', 'image', 'inspect', '--format', '{{.Id}}', image],
+                stderr=devnull)
+        except (subprocess.CalledProcessError, OSError):
+            return None
+    return output.decode('utf-8').strip() or None
+
+
+def get_image_repo_digests(image):
+    """The repository@digest references the local image was pulled as."""
+    with open(os.devnull, 'w') as devnull:
+        try:
+            output = subprocess.check_output(
+                ['docker', 'image', 'inspect', '--format', '{{json .RepoDigests}}', image],
+                stderr=devnull)
+        except (subprocess.CalledProcessError, OSError):
+            return []
+    return json.loads(output.decode('utf-8').strip() or '[]') or []
+
+
+def tag_image(image, tag):
+    if shell_utils.call_quietly(['docker', 'tag', image, tag]) != 0:
+        raise DockerCliUtilError("Error tagging image {} as {}".format(image, tag))
+
+
+def get_image_command(image):
+    """The image's default (entrypoint, cmd), each a list of arguments."""
+    try:
+        output = subprocess.check_output(
+            ['docker', 'image', 'inspect', '--format',
+             '{{json .Config.Entrypoint}}\t{{json .Config.Cmd}}', image])
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise DockerCliUtilError("Error inspecting image {}: {}".format(image, e))
+    try:
+        entrypoint, cmd = output.decode('utf-8').strip().split('\t')
+        return json.loads(entrypoint) or [], json.loads(cmd) or []
+    except ValueError:
+        raise DockerCliUtilError("Error parsing docker image inspect output: {}".format(output))
+
+
+def get_launch_labels(detached):
+    """The labels to give a container launched by iam-docker-run."""
+    labels = ['{}=1'.format(LAUNCH_LABEL)]
+    if detached:
+        labels.append('{}=1'.format(REAP_LABEL))
+    return labels
+
+
+def list_containers(label=None, statuses=None, include_stopped=False):
+    """The names of the running containers with the label, or with any of the
+    statuses, e.g. ['exited', 'dead'], given, or of every container with include_stopped."""
+    docker_args = ['docker', 'ps', '--format', '{{.Names}}']
+    if label:
+        docker_args.extend(['--filter', 'label={}'.format(label)])
+    if statuses or include_stopped:
+        docker_args.append('--all')
+    for status in statuses or []:
+        docker_args.extend(['--filter', 'status={}'.format(status)])
+    try:
+        output = subprocess.check_output(docker_args)
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise DockerCliUtilError("Error listing containers: {}".format(e))
+    return output.decode('utf-8').split()
+
+
+def force_remove_containers(container_names, batch_size=200):
+    """Remove the containers, running or not, ignoring any which don't exist.  Many
+    containers are removed a batch per docker rm rather than one at a time."""
+    container_names = list(container_names)
+    for start in range(0, len(container_names), batch_size):
+        shell_utils.call_quietly(
+            ['docker', 'rm', '-f'] + container_names[start:start + batch_size])
+
+
+def get_finished_times(container_names):
+    """Map the names of stopped containers to when they exited, in epoch seconds."""
+    from . import credential_cache
+    finished = {}
+    if not container_names:
+        return finished
+    try:
+        output = subprocess.check_output(
+            ['docker', 'inspect', '--format', '{{.Name}}\t{{.State.FinishedAt}}'] + list(container_names))
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise DockerCliUtilError("Error inspecting containers: {}".format(e))
+    for line in output.decode('utf-8').splitlines():
+        try:
+            name, finished_at = line.split('\t')
+            finished[name.lstrip('/')] = credential_cache.parse_expiration(
+                credential_cache.normalize_expiration(finished_at))
+        except ValueError:
+            continue
+    return finished
+
+
+def pull_image(image, quiet=False, env=None):
+    """Pull the image, letting docker print its progress unless quiet."""
+    exit_code = subprocess.call(['docker', 'pull'] + (['-q'] if quiet else []) + [image], env=env)
+    if exit_code != 0:
+        raise DockerCliUtilError("Error pulling image {} (docker exit code {})".format(image, exit_code))
+
+
+def network_exists(network):
+    return shell_utils.call_quietly(['docker', 'network', 'inspect', network]) == 0
+
+
+def create_network(network, labels=None):
+    docker_args = ['docker', 'network', 'create']
+    for label in labels or []:
+        docker_args.extend(['--label', label])
+    if shell_utils.call_quietly(docker_args + [network]) != 0:
+        raise DockerCliUtilError("Error creating docker network {}".format(network))
+
+
+def get_network_label(network, label):
+    """The value of the network's label, or None if it has none or doesn't exist."""
+    with open(os.devnull, 'w') as devnull:
+        try:
+            output = subprocess.check_output(
+                ['docker', 'network', 'inspect', '--format',
+                 '{{{{index .Labels "{}"}}}}'.format(label), network],
+                stderr=devnull)
+        except (subprocess.CalledProcessError, OSError):
+            return None
+    value = output.decode('utf-8').strip()
+    return value if value and value != '<no value>' else None
+
+
+def remove_network(network):
+    return shell_utils.call_quietly(['docker', 'network', 'rm', network]) == 0
+
+
+def volume_exists(volume):
+    return shell_utils.call_quietly(['docker', 'volume', 'inspect', volume]) == 0
+
+
 def random_container_name():
     """Generate a unique name for the container."""
     return uuid.uuid4().hex
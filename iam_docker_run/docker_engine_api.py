@@ -0,0 +1,286 @@
+import os
+import json
+import base64
+import socket
+import struct
+from . import timings
+
+try:
+    import http.client as httplib
+    from urllib.parse import urlencode, quote
+except ImportError:  # python 2
+    import httplib
+    from urllib import urlencode, quote
+
+
+DEFAULT_DOCKER_SOCKET = '/var/run/docker.sock'
+API_VERSION = 'v1.25'
+SIZE_UNITS = {'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+# stream types used by the multiplexed attach protocol when there is no tty
+STDOUT_STREAM = 1
+STDERR_STREAM = 2
+# requests that can be resent when the keep-alive connection turns out to be closed
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'DELETE')
+
+
+class DockerEngineApiError(Exception):
+    def __init__(self, message, status=None):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def get_docker_socket_path():
+    """Use the unix socket from DOCKER_HOST when it points at one."""
+    docker_host = os.environ.get('DOCKER_HOST', '')
+    if docker_host.startswith('unix://'):
+        return docker_host[len('unix://'):]
+    if docker_host:
+        raise DockerEngineApiError(
+            "DOCKER_HOST {} is not a unix socket, use the docker cli backend".format(docker_host))
+    return DEFAULT_DOCKER_SOCKET
+
+
+def parse_size(size):
+    """Convert a docker size string such as 128m into bytes."""
+    size = str(size).strip().lower()
+    if size.endswith('b') and len(size) > 1 and size[-2] in SIZE_UNITS:
+        size = size[:-1]
+    if size and size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+def parse_portmap(portmap):
+    """Convert a docker -p value ([ip:][host_port:]container_port[/proto]) into
+    (container_port/proto, host_ip, host_port)."""
+    protocol = 'tcp'
+    if '/' in portmap:
+        portmap, protocol = portmap.rsplit('/', 1)
+    parts = portmap.split(':')
+    if len(parts) == 1:
+        host_ip, host_port, container_port = '', '', parts[0]
+    elif len(parts) == 2:
+        host_ip, (host_port, container_port) = '', parts
+    elif len(parts) == 3:
+        host_ip, host_port, container_port = parts
+    else:
+        raise DockerEngineApiError("Unable to parse port mapping {}".format(portmap))
+    return '{}/{}'.format(container_port, protocol), host_ip, host_port
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """An HTTP connection to the Docker Engine over its unix socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class AttachStream(object):
+    """The raw stream of a container attach request, after the connection has been
+    hijacked by the Docker Engine."""
+
+    def __init__(self, sock, initial_data=b''):
+        self._sock = sock
+        self._buffer = initial_data
+
+    def _read_exactly(self, size):
+        while len(self._buffer) < size:
+            data = self._sock.recv(65536)
+            if not data:
+                return None
+            self._buffer += data
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def copy_output(self, stdout, stderr):
+        """Demultiplex the container's stdout and stderr until the container exits."""
+        while True:
+            header = self._read_exactly(8)
+            if header is None:
+                break
+            stream_type, size = struct.unpack('>BxxxL', header)
+            payload = self._read_exactly(size)
+            if payload is None:
+                break
+            out = stderr if stream_type == STDERR_STREAM else stdout
+            out.write(payload)
+            out.flush()
+        self.close()
+
+    def close(self):
+        try:
+            self._sock.close()
+        except socket.error:
+            pass
+
+
+class DockerEngineClient(object):
+    """Minimal Docker Engine API client covering what iam-docker-run needs to run a
+    container.  Requests share one persistent connection; attach, which hijacks its
+    connection, gets its own."""
+
+    def __init__(self, socket_path=None, api_version=API_VERSION):
+        self.socket_path = socket_path or get_docker_socket_path()
+        self.api_version = api_version
+        self._connection = UnixHTTPConnection(self.socket_path)
+
+    def _url(self, path, query=None):
+        url = '/{}{}'.format(self.api_version, path)
+        if query:
+            url += '?' + urlencode(query)
+        return url
+
+    def _send(self, method, path, query=None, body=None, headers=None):
+        """Send the request and return the response, raising DockerEngineApiError for
+        error statuses."""
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        url = self._url(path, query)
+        try:
+            self._connection.request(method, url, payload, headers)
+            response = self._connection.getresponse()
+        except (httplib.HTTPException, socket.error) as e:
+            self._connection.close()
+            # the engine may have closed the idle keep-alive connection, but a POST may
+            # still have reached it, so only retry requests that are safe to repeat
+            if method not in IDEMPOTENT_METHODS:
+                raise DockerEngineApiError("Docker Engine API {} {} failed: {}".format(method, path, e))
+            self._connection.request(method, url, payload, headers)
+            response = self._connection.getresponse()
+        if response.status >= 400:
+            data = response.read()
+            try:
+                message = json.loads(data.decode('utf-8'))['message']
+            except (ValueError, KeyError):
+                message = data.decode('utf-8', 'replace')
+            raise DockerEngineApiError(
+                "Docker Engine API {} {} failed ({}): {}".format(
+                    method, path, response.status, message),
+                status=response.status)
+        return response
+
+    def _request(self, method, path, query=None, body=None, headers=None):
+        response = self._send(method, path, query, body, headers)
+        data = response.read()
+        if data and response.getheader('Content-Type', '').startswith('application/json'):
+            return json.loads(data.decode('utf-8'))
+        return data
+
+    def create_container(self, spec, name=None):
+        query = {'name': name} if name else None
+        with timings.phase('docker:create'):
+            return self._request('POST', '/containers/create', query, spec)['Id']
+
+    def start_container(self, container_id):
+        with timings.phase('docker:start'):
+            self._request('POST', '/containers/{}/start'.format(container_id))
+
+    def wait_container(self, container_id):
+        """Block until the container exits and return its exit code."""
+        with timings.phase('docker:wait'):
+            return self._request('POST', '/containers/{}/wait'.format(container_id))['StatusCode']
+
+    def remove_container(self, container_id, force=False):
+        with timings.phase('docker:rm'):
+            self._request('DELETE', '/containers/{}'.format(container_id),
+                          {'force': '1' if force else '0'})
+
+    def inspect_image(self, image):
+        """Return the image details, or None if it isn't present locally."""
+        try:
+            return self._request('GET', '/images/{}/json'.format(quote(image, safe='')))
+        except DockerEngineApiError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def pull_image(self, image, auth=None):
+        """Pull the image, authenticating with the registry auth config (username,
+        password and serveraddress) when given."""
+        repository, tag = split_image_tag(image)
+        headers = None
+        if auth:
+            encoded = base64.urlsafe_b64encode(json.dumps(auth).encode('utf-8'))
+            headers = {'X-Registry-Auth': encoded.decode('utf-8')}
+        response = self._send(
+            'POST', '/images/create', {'fromImage': repository, 'tag': tag}, headers=headers)
+        # progress is streamed as one json object per line, a pull that fails part way
+        # still answers 200 and reports the failure in an error line
+        error = None
+        for line in iter_lines(response):
+            try:
+                progress = json.loads(line.decode('utf-8'))
+            except ValueError:
+                continue
+            if 'error' in progress and error is None:
+                error = progress['error']
+        if error is not None:
+            raise DockerEngineApiError("Error pulling image {}: {}".format(image, error))
+
+    def attach_container(self, container_id):
+        """Attach to the container's stdout/stderr, call before starting it."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        url = self._url('/containers/{}/attach'.format(container_id), {
+            'stream': '1', 'stdout': '1', 'stderr': '1', 'logs': '1'})
+        request = (
+            'POST {} HTTP/1.1\r\n'
+            'Host: docker\r\n'
+            'Content-Length: 0\r\n'
+            'Connection: Upgrade\r\n'
+            'Upgrade: tcp\r\n\r\n').format(url)
+        sock.sendall(request.encode('utf-8'))
+        response = b''
+        while b'\r\n\r\n' not in response:
+            data = sock.recv(4096)
+            if not data:
+                raise DockerEngineApiError("Connection closed attaching to container {}".format(container_id))
+            response += data
+        headers, initial_data = response.split(b'\r\n\r\n', 1)
+        status = int(headers.split(b' ', 2)[1])
+        if status not in (101, 200):
+            sock.close()
+            raise DockerEngineApiError(
+                "Error attaching to container {} ({})".format(container_id, status), status=status)
+        return AttachStream(sock, initial_data)
+
+    def close(self):
+        self._connection.close()
+
+
+def iter_lines(response, chunk_size=8192):
+    """Yield the non-empty lines of a streamed response body as it arrives."""
+    buffered = b''
+    while True:
+        data = response.read(chunk_size)
+        if not data:
+            break
+        buffered += data
+        lines = buffered.split(b'\n')
+        buffered = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffered.strip():
+        yield buffered
+
+
+def split_image_tag(image):
+    """Split an image reference into repository and tag (or digest)."""
+    if '@' in image:
+        return image.split('@', 1)
+    name = image.rsplit('/', 1)[-1]
+    if ':' in name:
+        return image.rsplit(':', 1)
+    return image, 'latest'
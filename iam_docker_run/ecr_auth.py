@@ -0,0 +1,211 @@
+from __future__ import print_function
+import os
+import re
+import sys
+import json
+import time
+import base64
+import calendar
+from . import cache_utils
+from . import credential_cache
+
+
+ECR_REGISTRY_RE = re.compile(r'^(\d{12})\.dkr\.ecr(-fips)?\.([a-z0-9-]+)\.amazonaws\.com(\.cn)?/')
+# docker runs docker-credential-<name> for the registries listed in credHelpers
+HELPER_NAME = 'idr'
+NOT_FOUND_MESSAGE = 'credentials not found in native keychain'
+
+
+def parse_ecr_image(image):
+    """Return (registry, account id, region) for an ECR image reference, otherwise
+    None."""
+    match = ECR_REGISTRY_RE.match(image or '')
+    if not match:
+        return None
+    return match.group(0).rstrip('/'), match.group(1), match.group(3)
+
+
+def parse_server_url(server_url):
+    """The registry host of the server url docker hands a credential helper, which
+    may have a scheme and path."""
+    host = server_url.strip()
+    if '://' in host:
+        host = host.split('://', 1)[1]
+    return host.split('/', 1)[0]
+
+
+def get_token_path(account_id, region):
+    return os.path.join(cache_utils.get_cache_dir('ecr'), '{}-{}.json'.format(account_id, region))
+
+
+def get_cached_token(account_id, region, min_ttl=0):
+    """The cached authorization token for the registry while it has at least min_ttl
+    seconds left, otherwise None."""
+    token = cache_utils.read_json(get_token_path(account_id, region))
+    if not token or token.get('expires_at', 0) - time.time() < min_ttl:
+        return None
+    return token
+
+
+def fetch_token(account_id, region, aws_creds=None, verbose=False):
+    """Call ecr:GetAuthorizationToken with the launch's credentials (or the default
+    credential chain when there are none)."""
+    from . import aws_retry
+    from . import session_pool
+    from . import timings
+    session = session_pool.get_session(aws_creds or None)
+    client = session_pool.get_client(session, 'ecr', region)
+    with timings.phase('ecr:GetAuthorizationToken', account_id=account_id):
+        data = aws_retry.call(
+            'ecr:GetAuthorizationToken', client.get_authorization_token,
+            verbose=verbose, registryIds=[account_id])['authorizationData'][0]
+    username, password = base64.b64decode(data['authorizationToken']).decode('utf-8').split(':', 1)
+    return {
+        'username': username,
+        'password': password,
+        'expires_at': calendar.timegm(data['expiresAt'].utctimetuple()),
+    }
+
+
+def get_token(registry, account_id, region, aws_creds=None, verbose=False, fetch=fetch_token):
+    """Return the registry's authorization token, from the cache while it has the
+    credential cache's minimum lifetime left.  Tokens last 12 hours, so most
+    launches never call ECR."""
+    min_ttl = credential_cache.get_min_ttl()
+    path = get_token_path(account_id, region)
+    token = get_cached_token(account_id, region, min_ttl)
+    if token is not None and registry in token.get('registries', []):
+        if verbose:
+            print("Using cached ECR authorization token for {}".format(registry))
+        return token
+    with cache_utils.file_lock(path):
+        token = get_cached_token(account_id, region, min_ttl)
+        if token is None:
+            token = fetch(account_id, region, aws_creds, verbose)
+        # the registry hosts (regular, fips) the token has been used for
+        registries = token.setdefault('registries', [])
+        if registry not in registries:
+            registries.append(registry)
+        cache_utils.write_json(path, token)
+    return token
+
+
+def list_cached_tokens():
+    """The unexpired cached tokens of every registry."""
+    cache_dir = cache_utils.get_cache_dir('ecr')
+    tokens = []
+    for filename in sorted(os.listdir(cache_dir)):
+        if not filename.endswith('.json'):
+            continue
+        token = cache_utils.read_json(os.path.join(cache_dir, filename))
+        if token and token.get('expires_at', 0) > time.time():
+            tokens.append(token)
+    return tokens
+
+
+def find_token(server_url):
+    """The cached token for the registry of a server url, or None."""
+    registry = parse_ecr_image(parse_server_url(server_url) + '/')
+    if not registry:
+        return None
+    return get_cached_token(registry[1], registry[2])
+
+
+def get_registry_auth(image):
+    """The Docker Engine API auth config for pulling the image, or None when it
+    isn't an ECR image with a cached token."""
+    registry = parse_ecr_image(image)
+    token = registry and get_cached_token(registry[1], registry[2])
+    if not token:
+        return None
+    return {'username': token['username'], 'password': token['password'], 'serveraddress': registry[0]}
+
+
+def find_helper():
+    """Whether docker can find the credential helper on the PATH."""
+    executable = 'docker-credential-{}'.format(HELPER_NAME)
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        if directory and os.access(os.path.join(directory, executable), os.X_OK):
+            return True
+    return False
+
+
+def get_user_docker_config_dir(overlay_dir):
+    config_dir = os.path.expanduser(os.environ.get('DOCKER_CONFIG') or os.path.join('~', '.docker'))
+    if os.path.realpath(config_dir) == os.path.realpath(overlay_dir):
+        # a launch from within a launch, the overlay is already in place
+        return os.path.expanduser(os.path.join('~', '.docker'))
+    return config_dir
+
+
+def write_docker_config(use_helper=True):
+    """Write a docker config directory which is the user's own with every cached
+    registry added to credHelpers (or to auths when the helper isn't installed),
+    and return its path.  The user's contexts, cli plugins and other files are
+    linked in, so pointing DOCKER_CONFIG at it changes nothing else."""
+    overlay_dir = cache_utils.get_cache_dir('docker-config')
+    user_dir = get_user_docker_config_dir(overlay_dir)
+    config = cache_utils.read_json(os.path.join(user_dir, 'config.json')) or {}
+    with cache_utils.file_lock(os.path.join(overlay_dir, 'config.json')):
+        for token in list_cached_tokens():
+            for registry in token.get('registries', []):
+                if use_helper:
+                    config.setdefault('credHelpers', {})[registry] = HELPER_NAME
+                else:
+                    auth = '{}:{}'.format(token['username'], token['password'])
+                    config.setdefault('auths', {})[registry] = {
+                        'auth': base64.b64encode(auth.encode('utf-8')).decode('utf-8')}
+        if os.path.isdir(user_dir):
+            for name in os.listdir(user_dir):
+                link = os.path.join(overlay_dir, name)
+                if name == 'config.json' or name.startswith('.') or os.path.lexists(link):
+                    continue
+                os.symlink(os.path.join(os.path.abspath(user_dir), name), link)
+        cache_utils.write_json(os.path.join(overlay_dir, 'config.json'), config)
+    return overlay_dir
+
+
+def login(image, aws_creds=None, verbose=False):
+    """Make the image's ECR registry token available to docker, fetching it if it
+    isn't cached, and return a docker config directory using it.  Docker commands
+    run with DOCKER_CONFIG pointing at it pull from the registry without a separate
+    docker login.  Returns None for images which aren't in ECR."""
+    registry = parse_ecr_image(image)
+    if not registry:
+        return None
+    get_token(registry[0], registry[1], registry[2], aws_creds, verbose)
+    use_helper = find_helper()
+    if not use_helper and verbose:
+        print("docker-credential-{} not found on the PATH, adding the token to auths".format(HELPER_NAME))
+    return write_docker_config(use_helper)
+
+
+def credential_helper_main(argv=None):
+    """docker-credential-idr, a docker credential helper handing docker the tokens
+    cached by iam-docker-run.  Tokens are only ever stored by iam-docker-run itself,
+    so store and erase do nothing."""
+    argv = sys.argv[1:] if argv is None else argv
+    action = argv[0] if argv else None
+    if action == 'get':
+        server_url = sys.stdin.read().strip()
+        token = find_token(server_url)
+        if not token:
+            print(NOT_FOUND_MESSAGE)
+            return 1
+        json.dump({'ServerURL': server_url, 'Username': token['username'], 'Secret': token['password']},
+                  sys.stdout)
+        return 0
+    if action == 'list':
+        json.dump(dict(
+            (registry, token['username'])
+            for token in list_cached_tokens() for registry in token.get('registries', [])), sys.stdout)
+        return 0
+    if action in ('store', 'erase'):
+        sys.stdin.read()
+        return 0
+    print("Usage: docker-credential-{} <get|list|store|erase>".format(HELPER_NAME), file=sys.stderr)
+    return 1
+
+
+def main():
+    sys.exit(credential_helper_main())
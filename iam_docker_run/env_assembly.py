@@ -0,0 +1,127 @@
+import os
+import tempfile
+from collections import OrderedDict
+
+
+ENV_FILE_PREFIX = 'idr-env-'
+# layers from lowest to highest precedence, a variable set in a later layer
+# replaces the same variable from an earlier one; required holds the variables
+# iam-docker-run always sets
+LAYERS = ('defaults', 'custom_env_file', 'envvars', 'aws', 'required')
+# shared memory filesystem, so env files holding credentials never touch disk
+TMPFS_DIR = '/dev/shm'
+
+_parsed_env_files = {}
+# memfd backed env files, path -> file descriptor
+_memfd_env_files = {}
+
+
+def parse_env_lines(lines):
+    """Parse lines in docker env file syntax into (name, value) pairs.  Blank lines
+    and comments are skipped, and a bare variable name takes its value from the
+    current environment (or is skipped if it isn't set), as docker does."""
+    pairs = []
+    for line in lines:
+        stripped = line.lstrip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        if '=' in line:
+            name, value = line.split('=', 1)
+            pairs.append((name.strip(), value))
+        else:
+            name = line.strip()
+            if name in os.environ:
+                pairs.append((name, os.environ[name]))
+    return pairs
+
+
+def read_env_file(path):
+    """Return the parsed (name, value) pairs of an env file.  Parsed files are kept
+    by path, mtime and size, so an unchanged file is only parsed once per process."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+    if key not in _parsed_env_files:
+        with open(path, 'r') as f:
+            _parsed_env_files[key] = parse_env_lines(f.read().splitlines())
+    return list(_parsed_env_files[key])
+
+
+class EnvAssembler(object):
+    """Assembles the container environment from layers with explicit precedence,
+    keeping one value per variable."""
+
+    def __init__(self):
+        self._layers = dict((layer, []) for layer in LAYERS)
+
+    def add(self, layer, pairs):
+        self._layers[layer].extend(pairs)
+
+    def add_lines(self, layer, lines):
+        self.add(layer, parse_env_lines(lines))
+
+    def assemble(self, verbose=False):
+        """Return an ordered dict of name -> value."""
+        env = OrderedDict()
+        source = {}
+        for layer in LAYERS:
+            for name, value in self._layers[layer]:
+                if verbose and name in source and source[name] != layer:
+                    print("Environment variable {} from {} overrides {}".format(
+                        name, layer, source[name]))
+                # re-insert so the variable is listed where its winning value came from
+                env.pop(name, None)
+                env[name] = value
+                source[name] = layer
+        return env
+
+    def lines(self, verbose=False):
+        return ['{}={}'.format(name, value) for name, value in self.assemble(verbose).items()]
+
+
+def write_env_file(envs):
+    """Write the env file lines somewhere docker can read them, and return the path.
+    Prefers an anonymous memfd (handed to docker as /dev/fd/N), then the tmpfs
+    /dev/shm, then the regular temp directory.  Release with release_env_file."""
+    content = ''.join('{}\n'.format(item) for item in envs).encode('utf-8')
+    if hasattr(os, 'memfd_create') and os.path.isdir('/dev/fd'):
+        # no MFD_CLOEXEC, the docker cli must inherit it
+        fd = os.memfd_create(ENV_FILE_PREFIX.rstrip('-'), 0)
+        os.write(fd, content)
+        os.lseek(fd, 0, os.SEEK_SET)
+        path = '/dev/fd/{}'.format(fd)
+        _memfd_env_files[path] = fd
+        return path
+    temp_dir = TMPFS_DIR if os.access(TMPFS_DIR, os.W_OK) else None
+    fd, path = tempfile.mkstemp(prefix=ENV_FILE_PREFIX, dir=temp_dir)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def is_memfd_env_file(path):
+    return path in _memfd_env_files
+
+
+def env_file_fds(path):
+    """File descriptors a child process must inherit to read the env file."""
+    if path in _memfd_env_files:
+        return (_memfd_env_files[path],)
+    return ()
+
+
+def popen_kwargs(path):
+    """Extra subprocess.Popen arguments so the child can read the env file."""
+    fds = env_file_fds(path)
+    return {'pass_fds': fds} if fds else {}
+
+
+def release_env_file(path):
+    """Close a memfd env file or delete a file backed one."""
+    fd = _memfd_env_files.pop(path, None)
+    if fd is not None:
+        os.close(fd)
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
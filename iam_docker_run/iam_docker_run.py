@@ -4,35 +4,169 @@ from __future__ import print_function
 import os
 import re
 import sys
+import shlex
+import atexit
 import argparse
-import tempfile
 from string import Template
-from . import aws_iam_utils
 from . import docker_cli_utils
-from . import shell_utils
+from . import credential_cache
+from . import role_index
+from . import launch_pipeline
+from . import image_index
+from . import ecr_auth
+from . import env_assembly
+from . import timings
+from .version import __version__
 from .aws_util_exceptions import RoleNotFoundError
 from .docker_cli_utils import DockerCliUtilError
 from .aws_util_exceptions import ProfileParsingError
 from .aws_util_exceptions import RoleNotFoundError
 from .aws_util_exceptions import AssumeRoleError
+from .image_index import PullPolicyError
 
 
 DEFAULT_CUSTOM_ENV_FILE = 'iam-docker-run.env'
 VERBOSE_MODE = False
 
 
-def get_aws_creds(profile_name=None, role_name=None, verbose=False):
+class LaunchError(Exception):
+    pass
+
+
+def assume_role_cached(cache, source_creds, profile_name, role, region, assume_func, verbose=False):
+    """Run one assume role hop through the credential cache, if one is in use."""
+    if not cache:
+        return assume_func()
+    key = cache.key(source_creds.get('AWS_ACCESS_KEY_ID'), profile_name, role, region)
+    with timings.phase('credential_cache:get_or_create', role=role):
+        aws_creds, cache_hit = cache.get_or_create(key, assume_func, verbose=verbose)
+    if cache_hit:
+        print("Using cached credentials for role {} (expires {})".format(
+            role, aws_creds['expiration']))
+    return aws_creds
+
+
+def assume_role_from_arn(aws_creds, role_arn, verbose=False, region=None):
+    from . import aws_iam_utils
+    print("Assuming role given as argument: {}".format(role_arn))
+    return aws_iam_utils.generate_aws_temp_creds(
+        role_arn=role_arn,
+        aws_creds=aws_creds,
+        verbose=verbose,
+        region=region
+    )
+
+
+def assume_role_from_name(aws_creds, role_name, index=None, verbose=False, region=None):
+    """Assume a role given its name.  With a role index the arn is taken from the
+    index or built from the caller's account id, and only looked up with IAM
+    GetRole if assuming it fails, e.g. because the role lives under a path."""
+    from . import aws_iam_utils
+    if verbose:
+        print("Looking up role arn from role name: {}".format(role_name))
+    if not index:
+        role_arn = aws_iam_utils.get_role_arn_from_name(
+            aws_creds,
+            role_name,
+            verbose=verbose)
+        return assume_role_from_arn(aws_creds, role_arn, verbose, region)
+
+    role_arn, account_id, verified = aws_iam_utils.resolve_role_arn(
+        aws_creds, role_name, index, verbose=verbose, region=region)
+    try:
+        assumed_creds = assume_role_from_arn(aws_creds, role_arn, verbose, region)
+    except AssumeRoleError as e:
+        if verified and account_id:
+            # the indexed arn is stale, e.g. the role was recreated under a path
+            index.remove_role_arn(account_id, role_name)
+        if verbose:
+            print("Unable to assume {}, looking up role with IAM".format(role_arn))
+        actual_role_arn = aws_iam_utils.get_role_arn_from_name(
+            aws_creds,
+            role_name,
+            verbose=verbose,
+            account_id=account_id)
+        if actual_role_arn == role_arn:
+            e.account_id = e.account_id or account_id
+            raise
+        role_arn = actual_role_arn
+        assumed_creds = assume_role_from_arn(aws_creds, role_arn, verbose, region)
+    if account_id:
+        index.put_role_arn(account_id, role_name, role_arn)
+    return assumed_creds
+
+
+def get_profile_source_creds(source, verbose=False, cache=None, environ=None):
+    """The base credentials at the end of a profile's source_profile chain."""
+    from . import aws_iam_utils
+    from . import aws_profiles
+    if source['type'] == 'credential_process':
+        if verbose:
+            print("Running credential_process of profile {}".format(source['profile']))
+        with timings.phase('profile:credential_process', profile=source['profile']):
+            return aws_profiles.get_credential_process_creds(source['command'], cache, verbose)
+    if source['type'] == 'credential_source':
+        if verbose:
+            print("Using credential_source {} of profile {}".format(
+                source['credential_source'], source['profile']))
+        return aws_iam_utils.get_credential_source_creds(source['credential_source'], environ)
+    if verbose:
+        print("Found credentials of profile {}, access key: {}".format(
+            source['profile'], source['AWS_ACCESS_KEY_ID']))
+    return dict((name, source[name]) for name in (
+        'AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN'))
+
+
+def assume_profile_role(hop, source_creds, verbose=False, region=None, cache=None):
+    """Assume the role a profile specifies.  The hop is cached under the profile
+    defining the role, so every profile chained from it shares the cached hop."""
+    from . import aws_iam_utils
+    print("Assuming role specified in profile {}: {}".format(hop['profile'], hop['role_arn']))
+    return assume_role_cached(
+        cache, source_creds, hop['profile'], hop['role_arn'], region,
+        lambda: aws_iam_utils.generate_aws_temp_creds(
+            role_arn=hop['role_arn'],
+            aws_creds=source_creds,
+            verbose=verbose,
+            region=region,
+            external_id=hop.get('external_id'),
+            session_name=hop.get('role_session_name'),
+            duration_seconds=hop.get('duration_seconds')
+        ),
+        verbose=verbose)
+
+
+def get_profile_creds(profile_name, verbose=False, region=None, cache=None, environ=None):
+    """Generate credentials for a profile, following its source_profile chain to
+    static keys, a credential_process or a credential_source and then assuming
+    each role along the chain in turn."""
+    from . import aws_profiles
+    with timings.phase('profile:resolve', profile=profile_name):
+        source, role_hops = aws_profiles.resolve_profile_chain(
+            aws_profiles.ProfileIndex().load(), profile_name)
+    aws_creds = get_profile_source_creds(source, verbose, cache, environ)
+    for hop in role_hops:
+        aws_creds = assume_profile_role(hop, aws_creds, verbose, region, cache)
+    return aws_creds
+
+
+def get_aws_creds(profile_name=None, role_name=None, verbose=False, region=None,
+                  cache=None, index=None, role_arn=None, environ=None):
+    """Generate credentials from the profile, or from the credentials in environ
+    (default os.environ), then assume role_name or role_arn if given."""
+    environ = os.environ if environ is None else environ
+    # boto3 is slow to import, so only pay for it once AWS is actually needed
+    with timings.phase('import:aws_iam_utils'):
+        from . import aws_iam_utils
     aws_creds = {}
-    role_arn = None
 
     if profile_name:
         if verbose:
             print("Reading AWS profile {}".format(profile_name))
-        aws_creds = aws_iam_utils.get_aws_profile_credentials(
-            profile_name, verbose)
+        aws_creds = get_profile_creds(profile_name, verbose, region, cache, environ)
     else:
         # if a profile isn't specified, get the creds from the environment
-        access_key_id = os.environ.get('AWS_ACCESS_KEY_ID', None)
+        access_key_id = environ.get('AWS_ACCESS_KEY_ID', None)
         if not access_key_id:
             msg = "No AWS profile specified and no AWS credentials found in the environment."
             raise ProfileParsingError(msg)
@@ -42,88 +176,93 @@ def get_aws_creds(profile_name=None, role_name=None, verbose=False):
             ))
         aws_creds = {
             'AWS_ACCESS_KEY_ID': access_key_id,
-            'AWS_SECRET_ACCESS_KEY': os.environ.get('AWS_SECRET_ACCESS_KEY', None),
-            'AWS_SESSION_TOKEN': os.environ.get('AWS_SESSION_TOKEN', None)
+            'AWS_SECRET_ACCESS_KEY': environ.get('AWS_SECRET_ACCESS_KEY', None),
+            'AWS_SESSION_TOKEN': environ.get('AWS_SESSION_TOKEN', None)
         }
 
-    # if the profile itself specifies a role, first assume that role
-    if 'role_arn' in aws_creds:
-        print("Assuming role specified in profile {}: {}".format(
-            profile_name, aws_creds['role_arn']
-        ))
-        aws_creds = aws_iam_utils.generate_aws_temp_creds(
-            role_arn=aws_creds['role_arn'],
-            aws_creds=aws_creds,
-            verbose=verbose
-        )
-
     # then if --role argument given here, further assume that role
-    if role_name:
-        if verbose:
-            print("Looking up role arn from role name: {}".format(role_name))
-        role_arn = aws_iam_utils.get_role_arn_from_name(
-            aws_creds,
-            role_name,
-            verbose=verbose)
-        print("Assuming role given as argument: {}".format(role_arn))
-        aws_creds = aws_iam_utils.generate_aws_temp_creds(
-            role_arn=role_arn,
-            aws_creds=aws_creds,
-            verbose=verbose
-        )
+    if role_name or role_arn:
+        source_creds = aws_creds
+
+        def assume_role():
+            if role_arn:
+                return assume_role_from_arn(source_creds, role_arn, verbose, region)
+            return assume_role_from_name(source_creds, role_name, index, verbose, region)
+        aws_creds = assume_role_cached(
+            cache, source_creds, profile_name, role_arn or role_name, region,
+            assume_role, verbose=verbose)
 
     return aws_creds
 
 
-def generate_temp_env_file(
+def read_custom_env_file(custom_env_file):
+    """Return the parsed (name, value) pairs of the custom env file.  Files are only
+    parsed once per process (see env_assembly.read_env_file), so a launch stage can
+    pre-read the file and later readers get the parsed result."""
+    if not custom_env_file:
+        return []
+    if custom_env_file == DEFAULT_CUSTOM_ENV_FILE:
+        if not os.path.isfile(custom_env_file):
+            if VERBOSE_MODE:
+                print("{} does not exist".format(custom_env_file))
+            # silently ignore when default custom env file is missing
+            return []
+    try:
+        return env_assembly.read_env_file(custom_env_file)
+    except Exception as e:
+        print("Error processing custom environment variables file {}: {}".format(
+            custom_env_file, str(e)))
+        return []
+
+
+def build_env_list(
         aws_creds,
         region,
         custom_env_file,
         custom_env_args):
-    """Write out a file with the environment variables for the AWS credentials which can be passed
-    into Docker.  If additional environment variables beyond the AWS creds are desired you can
-    also specify a custom_env_file which contains them."""
-    envs = []
-    if custom_env_file:
-        if custom_env_file == DEFAULT_CUSTOM_ENV_FILE:
-            if not os.path.isfile(custom_env_file):
-                if VERBOSE_MODE:
-                    print("{} does not exist".format(custom_env_file))
-                # silently ignore when default custom env file is missing
-                custom_env_file = None
-    if custom_env_file:
-        try:
-            custom_envs = open(custom_env_file, "r")
-            envs = custom_envs.read().splitlines()
-            custom_envs.close()
-        except Exception as e:
-            print("Error processing custom environment variables file {}: {}".format(
-                custom_env_file, str(e)))
+    """Build the list of environment variables (in docker env file syntax) for the AWS
+    credentials, plus those from the custom_env_file and custom_env_args if given.
+    Each variable appears once: AWS credentials take precedence over -e arguments,
+    which take precedence over the custom env file, and PYTHONUNBUFFERED=1 is
+    always set."""
+    assembler = env_assembly.EnvAssembler()
+    # ensure stdout flows to docker unbuffered
+    assembler.add('required', [('PYTHONUNBUFFERED', '1')])
+    assembler.add('custom_env_file', read_custom_env_file(custom_env_file))
     if custom_env_args:
-        for env_arg in custom_env_args:
-            envs.append(env_arg)
+        assembler.add_lines('envvars', custom_env_args)
     if aws_creds:
-        envs.append('AWS_ACCESS_KEY_ID=' + aws_creds['AWS_ACCESS_KEY_ID'])
-        envs.append('AWS_SECRET_ACCESS_KEY=' +
-                    aws_creds['AWS_SECRET_ACCESS_KEY'])
-        if 'AWS_SESSION_TOKEN' in aws_creds:
-            envs.append('AWS_SESSION_TOKEN=' + aws_creds['AWS_SESSION_TOKEN'])
+        aws_envs = [
+            ('AWS_ACCESS_KEY_ID', aws_creds['AWS_ACCESS_KEY_ID']),
+            ('AWS_SECRET_ACCESS_KEY', aws_creds['AWS_SECRET_ACCESS_KEY']),
+        ]
+        if aws_creds.get('AWS_SESSION_TOKEN'):
+            aws_envs.append(('AWS_SESSION_TOKEN', aws_creds['AWS_SESSION_TOKEN']))
         if region:
-            envs.append('AWS_DEFAULT_REGION=' + region)
-            envs.append('AWS_REGION=' + region)
-    # ensure stdout flows to docker unbuffered
-    envs.append('PYTHONUNBUFFERED=1')
+            aws_envs.append(('AWS_DEFAULT_REGION', region))
+            aws_envs.append(('AWS_REGION', region))
+        assembler.add('aws', aws_envs)
+    return assembler.lines(verbose=VERBOSE_MODE)
 
+
+def generate_temp_env_file(
+        aws_creds,
+        region,
+        custom_env_file,
+        custom_env_args):
+    """Write out a file with the environment variables for the AWS credentials which can be passed
+    into Docker.  If additional environment variables beyond the AWS creds are desired you can
+    also specify a custom_env_file which contains them.  The file is memory backed where
+    possible and must be released with env_assembly.release_env_file."""
+    envs = build_env_list(aws_creds, region, custom_env_file, custom_env_args)
     try:
-        temp_env_file = tempfile.NamedTemporaryFile(delete=False, mode='w')
-        for item in envs:
-            temp_env_file.write('{}\n'.format(item))
-        temp_env_file.close()
-        print('Temp env file: {}'.format(temp_env_file.name))
+        with timings.phase('env_file:write', variables=len(envs)):
+            env_file = env_assembly.write_env_file(envs)
+        print('Temp env file: {}'.format(env_file))
     except Exception as e:
         print("Error writing temp env file: {}".format(str(e)))
         raise
-    return temp_env_file.name
+    return env_file
 
 
 def single_line_string(string):
@@ -183,7 +322,10 @@ def build_docker_run_command(args, container_name, env_tmpfile):
     else:
         dns_search = None
 
-    add_host = "--add-host {}".format(args.add_host) if args.add_host else None
+    if args.add_host:
+        add_host = ' '.join("--add-host {}".format(host) for host in args.add_host)
+    else:
+        add_host = None
     shm_size = "--shm-size {}".format(args.shm_size) if args.shm_size else None
     docker_volume = '-v /var/run/docker.sock:/var/run/docker.sock'
     additional_volume_mounts = ''
@@ -200,6 +342,7 @@ def build_docker_run_command(args, container_name, env_tmpfile):
         docker run
             $runmode
             --name $container_name
+            $labels
             $p
             $env_file
             $sourcecode_volume
@@ -219,6 +362,9 @@ def build_docker_run_command(args, container_name, env_tmpfile):
         .substitute({
             'runmode': runmode,
             'container_name': container_name,
+            'labels': ' '.join(
+                '--label {}'.format(label)
+                for label in docker_cli_utils.get_launch_labels(args.detached)),
             'p': p,
             'env_file': "--env-file {}".format(env_tmpfile) if env_tmpfile else '',
             'sourcecode_volume': sourcecode_volume_mount if sourcecode_volume_mount else '',
@@ -238,12 +384,213 @@ def build_docker_run_command(args, container_name, env_tmpfile):
     return command
 
 
+def get_entrypoint_and_cmd(args):
+    """Return the entrypoint (or None) and the cmd as a list of arguments."""
+    if args.shell:
+        return os.environ.get('IAM_DOCKER_RUN_SHELL_COMMAND', '/bin/bash'), []
+    if args.full_entrypoint:
+        full_entrypoint = shlex.split(args.full_entrypoint)
+        return full_entrypoint[0], full_entrypoint[1:]
+    return args.entrypoint, shlex.split(args.cmd) if args.cmd else []
+
+
+def build_docker_run_args(args, container_name, env_file, remove=True):
+    """Build the docker run command as an argument list rather than a shell command
+    string, so it can be exec'd or spawned without going through /bin/sh."""
+    entrypoint, cmd = get_entrypoint_and_cmd(args)
+    docker_args = ['docker', 'run']
+    if remove:
+        docker_args.append('--rm')
+    if args.shell or (args.interactive and not args.detached):
+        if args.shell and (args.detached or args.interactive):
+            print('WARNING: --shell specified, overriding runmode to -it')
+        docker_args.append('-it')
+    elif args.detached:
+        docker_args.append('-d')
+    docker_args.extend(['--name', container_name])
+    for label in docker_cli_utils.get_launch_labels(args.detached):
+        docker_args.extend(['--label', label])
+    for portmap in args.portmaps or []:
+        docker_args.extend(['-p', portmap])
+    if env_file:
+        docker_args.extend(['--env-file', env_file])
+    if args.host_source_path and args.container_source_path:
+        sourcecode_volume_mount = '{}:{}'.format(
+            os.path.abspath(args.host_source_path),
+            args.container_source_path)
+        if args.selinux:
+            sourcecode_volume_mount += ':Z'
+        docker_args.extend(['-v', sourcecode_volume_mount])
+    for volume in args.volumes or []:
+        docker_args.extend(['-v', volume])
+    for cap in args.caps or []:
+        docker_args.extend(['--cap-add', cap])
+    if args.mount_docker:
+        docker_args.extend(['-v', '/var/run/docker.sock:/var/run/docker.sock'])
+    if entrypoint:
+        docker_args.extend(['--entrypoint', entrypoint])
+    if args.dns:
+        docker_args.extend(['--dns', args.dns])
+    for domain in args.dns_search or []:
+        docker_args.extend(['--dns-search', domain])
+    for host in args.add_host or []:
+        docker_args.extend(['--add-host', host])
+    if args.shm_size:
+        docker_args.extend(['--shm-size', args.shm_size])
+    if args.network:
+        docker_args.extend(['--network', args.network])
+    if args.workdir:
+        docker_args.extend(['--workdir', args.workdir])
+    docker_args.append(args.image)
+    docker_args.extend(cmd)
+    return docker_args
+
+
+def env_file_lines_to_env(envs):
+    """Apply docker env file semantics to a list of lines: skip blanks and comments,
+    and take the value of a bare variable name from the current environment."""
+    env = []
+    for line in envs:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if '=' not in line:
+            if line not in os.environ:
+                continue
+            line = '{}={}'.format(line, os.environ[line])
+        env.append(line)
+    return env
+
+
+def build_container_create_spec(args, envs):
+    """Translate the command line options into a Docker Engine API container create
+    request, the equivalent of build_docker_run_command."""
+    from . import docker_engine_api
+    entrypoint, cmd = get_entrypoint_and_cmd(args)
+
+    binds = []
+    if args.host_source_path and args.container_source_path:
+        sourcecode_volume_mount = '{}:{}'.format(
+            os.path.abspath(args.host_source_path),
+            args.container_source_path)
+        if args.selinux:
+            sourcecode_volume_mount += ':Z'
+        binds.append(sourcecode_volume_mount)
+    binds.extend(args.volumes or [])
+    if args.mount_docker:
+        binds.append('/var/run/docker.sock:/var/run/docker.sock')
+
+    exposed_ports = {}
+    port_bindings = {}
+    for portmap in args.portmaps or []:
+        container_port, host_ip, host_port = docker_engine_api.parse_portmap(portmap)
+        exposed_ports[container_port] = {}
+        port_bindings.setdefault(container_port, []).append(
+            {'HostIp': host_ip, 'HostPort': host_port})
+
+    host_config = {
+        'Binds': binds,
+        'PortBindings': port_bindings,
+        'CapAdd': args.caps or [],
+        'Dns': [args.dns] if args.dns else [],
+        'DnsSearch': args.dns_search or [],
+        'ExtraHosts': args.add_host or [],
+    }
+    if args.shm_size:
+        host_config['ShmSize'] = docker_engine_api.parse_size(args.shm_size)
+    if args.network:
+        host_config['NetworkMode'] = args.network
+
+    spec = {
+        'Image': args.image,
+        'Env': env_file_lines_to_env(envs),
+        'AttachStdout': not args.detached,
+        'AttachStderr': not args.detached,
+        'Tty': False,
+        'ExposedPorts': exposed_ports,
+        'HostConfig': host_config,
+        'Labels': dict(
+            label.split('=', 1) for label in docker_cli_utils.get_launch_labels(args.detached)),
+    }
+    if entrypoint:
+        spec['Entrypoint'] = [entrypoint]
+    if cmd:
+        spec['Cmd'] = cmd
+    if args.workdir:
+        spec['WorkingDir'] = args.workdir
+    return spec
+
+
+def run_container_api(args, container_name, envs):
+    """Run the container through the Docker Engine API rather than the docker cli,
+    returning the container's exit code (or None when detached)."""
+    from . import docker_engine_api
+    client = docker_engine_api.DockerEngineClient()
+    spec = build_container_create_spec(args, envs)
+    try:
+        container_id = client.create_container(spec, container_name)
+    except docker_engine_api.DockerEngineApiError as e:
+        if e.status != 404:
+            raise
+        print("Unable to find image '{}' locally, pulling".format(args.image))
+        client.pull_image(args.image, auth=ecr_auth.get_registry_auth(args.image))
+        container_id = client.create_container(spec, container_name)
+
+    if args.detached:
+        client.start_container(container_id)
+        print(container_id)
+        client.close()
+        return None
+
+    try:
+        attach_stream = client.attach_container(container_id)
+        client.start_container(container_id)
+        attach_stream.copy_output(
+            getattr(sys.stdout, 'buffer', sys.stdout),
+            getattr(sys.stderr, 'buffer', sys.stderr))
+        exit_code = client.wait_container(container_id)
+        print("Container exited with code {}".format(exit_code))
+    finally:
+        print("Removing container: {}".format(container_name))
+        client.remove_container(container_id, force=True)
+        client.close()
+    return exit_code
+
+
+def get_docker_backend(args):
+    backend = args.docker_backend or \
+        os.environ.get('IAM_DOCKER_RUN_DOCKER_BACKEND', 'cli')
+    if backend == 'api' and (args.shell or args.interactive):
+        print('WARNING: the api docker backend does not support a terminal, using the cli backend')
+        backend = 'cli'
+    return backend
+
+
+def positive_int(value):
+    """argparse type for counts which must be at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid int value: {!r}".format(value))
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got {}".format(number))
+    return number
+
+
 def create_parser():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--image', required=True,
-                        help='The full name of the docker repo/image')
+    parser.add_argument('--image', required=False,
+                        help='The full name of the docker repo/image, required unless --build is given')
+    parser.add_argument('--build', required=False, metavar='CONTEXT',
+                        help='Build the image from this context first, skipping the build when nothing in the context has changed')
+    parser.add_argument('--dockerfile', required=False,
+                        help='With --build, the Dockerfile to build (default CONTEXT/Dockerfile)')
+    parser.add_argument('--build-arg', required=False, action='append', dest='build_args',
+                        help='With --build, passthrough to docker build --build-arg')
     parser.add_argument('--role', '--aws-role-name', dest='role',
                         help='The AWS IAM role name to assume when running this container')
+    parser.add_argument('--role-arn', required=False,
+                        help='The AWS IAM role arn to assume, skips resolving the arn from --role')
     parser.add_argument('--profile',
                         help='The AWS creds used on your laptop to generate the STS temp credentials')
     parser.add_argument('--custom-env-file', default=DEFAULT_CUSTOM_ENV_FILE,
@@ -277,7 +624,7 @@ def create_parser():
                         help='Passthrough to docker --dns')
     parser.add_argument('--dns-search',nargs='+', required=False,
                         help='Passthrough to docker --dns-search')
-    parser.add_argument('--add-host', required=False,
+    parser.add_argument('--add-host', required=False, action='append',
                         help='Passthrough to docker --add-host')
     parser.add_argument('-p', '--portmap', required=False,
                         action="append", dest="portmaps",
@@ -294,84 +641,554 @@ def create_parser():
     parser.add_argument('-w', '--workdir', required=False, dest='workdir',
                         help='Passthrough to dcoker --workdir argument')
     parser.add_argument('--shell', action='store_true', default=False)
+    parser.add_argument('--docker-backend', choices=['cli', 'api'], required=False,
+                        help='Run the container with the docker cli (default) or directly through the Docker Engine API socket')
+    parser.add_argument('--shards', type=positive_int, required=False,
+                        help='Run this many copies of the container concurrently, each given SHARD_INDEX and SHARD_COUNT')
+    parser.add_argument('--shard-manifest', required=False,
+                        help='File with one line per shard, passed to each shard container as SHARD_SPEC')
+    parser.add_argument('--shard-parallelism', type=positive_int, required=False,
+                        help='Maximum number of shard containers running at once (default: number of cpus)')
+    parser.add_argument('--credentials-endpoint', action='store_true', default=False,
+                        help='Serve refreshing credentials to the container from a local ECS style endpoint instead of static keys')
+    parser.add_argument('--credentials-endpoint-port', type=int, default=0,
+                        help='Port for the credentials endpoint (default: any free port)')
+    parser.add_argument('--pool', action='store_true', default=False,
+                        help='Run the command with docker exec in a warm container kept for reuse by launches with the same image, credentials and mounts')
+    parser.add_argument('--pool-size', type=int, default=1,
+                        help='With --pool, the most containers kept for the same launch, used by concurrent launches (default 1)')
+    parser.add_argument('--pool-idle-timeout', type=int, default=600,
+                        help='With --pool, remove containers unused for this many seconds (default 600)')
+    parser.add_argument('--log-dir', required=False,
+                        help='Also write the container output, each line timestamped, to <container name>.log in this directory')
+    parser.add_argument('--log-max-bytes', required=False, default='100m',
+                        help='With --log-dir, rotate the log file once it reaches this size, e.g. 10m (default 100m)')
+    parser.add_argument('--log-backups', type=int, default=5,
+                        help='With --log-dir, the number of rotated log files to keep (default 5)')
+    parser.add_argument('--log-compress', action='store_true', default=False,
+                        help='With --log-dir, gzip rotated log files')
+    parser.add_argument('--pull', required=False, default='missing',
+                        help='When to pull --image: missing (default), always, never or if-stale:<ttl> e.g. if-stale:1h')
+    parser.add_argument('--exec-docker', action='store_true', default=False,
+                        help='Replace this process with docker run --rm rather than waiting to inspect and remove the container')
     parser.add_argument('--region', required=False)
     parser.add_argument('--verbose', action='store_true', default=False)
+    parser.add_argument('--timings', action='store_true', default=False,
+                        help='Print how long each phase of the launch took')
+    parser.add_argument('--timings-file', required=False,
+                        help='Write the launch phase timings to this file as json, or as json lines if it ends in .ndjson or .jsonl')
+    parser.add_argument('--timings-otlp-endpoint', required=False,
+                        help='Export the launch phase timings as an OpenTelemetry trace to this OTLP/HTTP endpoint, e.g. {}'.format(
+                            timings.DEFAULT_OTLP_ENDPOINT))
     parser.add_argument('--shm-size', required=False,
                         help='Passthrough to docker --shm-size')
+    parser.add_argument('--no-credential-cache', action='store_true', default=False,
+                        help='Always call STS rather than reusing cached temporary credentials')
+    parser.add_argument('--credential-cache-min-ttl', required=False, type=int,
+                        help='Minimum remaining lifetime in seconds for cached credentials to be reused (default {})'.format(
+                            credential_cache.DEFAULT_MIN_TTL))
     return parser
 
 
-def main():
-    here = os.path.abspath(os.path.dirname(__file__))
-    about = {}
-    with open(os.path.join(here, 'version.py'), 'r') as f:
-        exec(f.read(), about)
+def start_credentials_server(args, aws_creds, region):
+    """Start the local credentials endpoint and return the credentials to give the
+    container in place of aws_creds: the endpoint url and its authorization token."""
+    from . import credentials_server
 
-    print('IAM-Docker-Run version {}'.format(about['__version__']))
+    def refresh_aws_creds():
+        # cached credentials close to expiry must not be handed back on refresh
+        cache = None
+        index = None
+        if not args.no_credential_cache and not credential_cache.cache_disabled():
+            cache = credential_cache.CredentialCache(
+                min_ttl=2 * credentials_server.DEFAULT_REFRESH_MARGIN)
+            index = role_index.RoleIndex()
+        return get_aws_creds(
+            args.profile, args.role, verbose=VERBOSE_MODE, region=region,
+            cache=cache, index=index, role_arn=args.role_arn)
 
-    parser = create_parser()
-    args = parser.parse_args()
+    # only reachable from the host, and so from containers sharing its network
+    server = credentials_server.CredentialsServer(
+        refresh_aws_creds, aws_creds, bind_host='127.0.0.1',
+        port=args.credentials_endpoint_port, verbose=VERBOSE_MODE)
+    try:
+        server.start()
+    except credentials_server.CredentialsServerError as e:
+        raise LaunchError(str(e))
+    endpoint = 'http://127.0.0.1:{}{}'.format(server.port, credentials_server.CREDENTIALS_PATH)
+    print("Serving container credentials from {}".format(endpoint))
+    args.envvars = (args.envvars or []) + [
+        'AWS_CONTAINER_CREDENTIALS_FULL_URI={}'.format(endpoint),
+        'AWS_CONTAINER_AUTHORIZATION_TOKEN={}'.format(server.token),
+    ]
+    if region:
+        args.envvars += ['AWS_DEFAULT_REGION={}'.format(region), 'AWS_REGION={}'.format(region)]
+    # the container gets no static keys
+    return {}
 
-    if args.verbose:
-        global VERBOSE_MODE
-        VERBOSE_MODE = True
 
-    # if not args.profile and not args.role:
-    #     parser.print_help()
-    #     print('You must specify --profile and/or --role')
-    #     sys.exit(1)
+def run_shards(args, container_name, aws_creds, region):
+    """Run the sharded containers and return the aggregate exit code."""
+    from . import sharding
+    if args.detached or args.interactive or args.shell or args.exec_docker:
+        print('--shards cannot be combined with --detached, --interactive, --shell or --exec-docker')
+        return 1
+    try:
+        shard_specs = sharding.get_shard_specs(args)
+    except sharding.ShardManifestError as e:
+        print(e)
+        return 1
+    runner = sharding.ShardRunner(
+        args, container_name, aws_creds, region, shard_specs,
+        max_workers=args.shard_parallelism)
+    exit_codes = runner.run()
+    for index, exit_code in enumerate(exit_codes):
+        print("Shard {} exited with code {}".format(index, exit_code))
+    return sharding.aggregate_exit_code(exit_codes)
+
+
+def run_pool(args, aws_creds, region):
+    """Run the command in a warm pooled container and return its exit code."""
+    from . import container_pool
+    if args.detached or args.exec_docker or args.shards or args.shard_manifest \
+            or args.credentials_endpoint or args.name:
+        print('--pool cannot be combined with --detached, --exec-docker, --shards, '
+              '--credentials-endpoint or --name')
+        return 1
+    try:
+        return container_pool.run_in_pool(args, aws_creds, region)
+    except (container_pool.ContainerPoolError, DockerCliUtilError) as e:
+        print(e)
+        return 1
+
+
+def run_container_captured(args, container_name, env_file, echo=True):
+    """Run the container with its output written to a rotating log file under
+    --log-dir, and passed through to the console if echo.  Returns the log path."""
+    from . import log_capture
+    from .docker_engine_api import parse_size
+    if not os.path.isdir(args.log_dir):
+        os.makedirs(args.log_dir)
+    log_path = os.path.join(args.log_dir, '{}.log'.format(container_name))
+    if echo:
+        print("Writing container output to {}".format(log_path))
+    writer = log_capture.RotatingLogWriter(
+        log_path, max_bytes=parse_size(args.log_max_bytes),
+        backups=args.log_backups, compress=args.log_compress)
+    try:
+        log_capture.run_captured(
+            build_docker_run_args(args, container_name, env_file, remove=False),
+            writer, echo=echo, env=get_docker_env(args), **env_assembly.popen_kwargs(env_file))
+    finally:
+        writer.close()
+    return log_path
+
+
+def generate_aws_creds(args, region, environ=None):
+    """Generate the credentials for the container from the profile and/or role
+    arguments, through the credential cache unless it is disabled."""
+    cache = None
+    index = None
+    if not args.no_credential_cache and not credential_cache.cache_disabled():
+        try:
+            cache = credential_cache.CredentialCache(
+                min_ttl=args.credential_cache_min_ttl)
+            index = role_index.RoleIndex()
+        except (IOError, OSError) as e:
+            print("WARNING: credential cache unavailable: {}".format(e))
+    return get_aws_creds(
+        args.profile, args.role, verbose=True, region=region,
+        cache=cache, index=index, role_arn=args.role_arn, environ=environ)
+
+
+def describe_credential_error(e, args, region):
+    """Explain why generate_aws_creds failed, for the user."""
+    if isinstance(e, RoleNotFoundError):
+        if args.verbose:
+            print(str(e))
+        account_id = e.account_id or get_account_id_for_error(args.profile, region)
+        return "IAM role '{}' not found in account id {}, credential method: {}".format(
+            args.role,
+            account_id,
+            e.credential_method)
+    if isinstance(e, AssumeRoleError):
+        if args.verbose:
+            print(str(e))
+        account_id = e.account_id or get_account_id_for_error(args.profile, region)
+        credential_method = e.credential_method if hasattr(
+            e, 'credential_method') else '(unknown)'
+        return "Error assuming IAM role '{}' from account id {}, credential method: {}, error: {}".format(
+            args.role or args.role_arn,
+            account_id,
+            credential_method,
+            e
+        )
+    return str(e)
+
+
+def resolve_aws_creds(args, region):
+    """Generate the credentials for the container, from the idr daemon when one is
+    in use, raising LaunchError with a helpful message if that isn't possible."""
+    aws_creds = {}
+    if not args.profile and not args.role and not args.role_arn:
+        print('WARNING: No profile or role specified')
+        return aws_creds
+    if os.environ.get('IAM_DOCKER_RUN_USE_DAEMON'):
+        aws_creds = resolve_aws_creds_from_daemon(args, region)
+        if aws_creds is not None:
+            return aws_creds
+    try:
+        aws_creds = generate_aws_creds(args, region)
+        print("Generated temporary AWS credentials: {}".format(
+            aws_creds['AWS_ACCESS_KEY_ID']))
+    except (ProfileParsingError, RoleNotFoundError, AssumeRoleError) as e:
+        raise LaunchError(describe_credential_error(e, args, region))
+
+    return aws_creds
+
+
+def resolve_aws_creds_from_daemon(args, region):
+    """Ask the idr daemon for the credentials, returning None (to generate them in
+    this process instead) if no daemon is listening."""
+    from . import daemon_client
+    try:
+        response = daemon_client.request_aws_creds(args, region)
+    except daemon_client.DaemonUnavailableError as e:
+        if VERBOSE_MODE:
+            print("idr daemon unavailable, generating credentials here: {}".format(e))
+        return None
+    sys.stdout.write(response.get('messages') or '')
+    for span in response.get('spans') or []:
+        timings.current().record(
+            'daemon:' + span['name'], span['start'], span['end'], error=span.get('error'),
+            **span['attributes'])
+    if response.get('status') != 'ok':
+        raise LaunchError(response.get('message'))
+    aws_creds = response['aws_creds']
+    print("Generated temporary AWS credentials: {} (from idr daemon)".format(
+        aws_creds['AWS_ACCESS_KEY_ID']))
+    return aws_creds
+
+
+def ensure_image(args):
+    """Apply the --pull policy to the image up front rather than leaving the pull to
+    docker run, so it overlaps with generating credentials.  Pull failures are left
+    for docker run itself to report."""
+    try:
+        pull_image_if_missing(args)
+    except PullPolicyError:
+        raise
+    except Exception as e:
+        print("WARNING: unable to pull image {}: {}".format(args.image, e))
+
+
+def login_image_registry(args, aws_creds):
+    """Log docker in to the image's ECR registry with the launch's credentials,
+    reusing the registry's cached authorization token, for the launch's docker
+    commands (see get_docker_env).  Failures are left for the pull to report."""
+    if os.environ.get('IAM_DOCKER_RUN_DISABLE_ECR_LOGIN', None):
+        return
+    try:
+        with timings.phase('ecr:login'):
+            args.docker_config = ecr_auth.login(args.image, aws_creds, verbose=VERBOSE_MODE)
+    except Exception as e:
+        print("WARNING: unable to log in to the registry of {}: {}".format(args.image, e))
+
+
+def get_docker_env(args):
+    """The environment for the launch's docker commands, pointing DOCKER_CONFIG at
+    the config logged in to the image's registry, if any.  None inherits this
+    process's environment, which is never changed as other launches may share it."""
+    docker_config = getattr(args, 'docker_config', None)
+    if not docker_config:
+        return None
+    env = dict(os.environ)
+    env['DOCKER_CONFIG'] = docker_config
+    return env
+
+
+def ensure_registry_image(args, get_aws_creds):
+    """ensure_image for an image in ECR, which waits for the launch's credentials
+    to log in to the registry first."""
+    login_image_registry(args, get_aws_creds())
+    ensure_image(args)
+
+
+def build_image(args):
+    """Build --build's context, unless an image built from the same content is
+    still present, and launch the image built."""
+    from . import image_build
+    try:
+        args.image = image_build.ensure_built(
+            args.build, args.dockerfile, args.image, args.build_args, verbose=VERBOSE_MODE)
+    except (image_build.BuildError, DockerCliUtilError, IOError, OSError) as e:
+        raise LaunchError(str(e))
+
+
+def get_image_handlers(backend, quiet=False, env=None):
+    """Return (get_image_id, pull_image, get_repo_digest) functions for the docker
+    backend, the cli's docker pull run with env if given."""
+    if backend == 'api':
+        from . import docker_engine_api
+
+        def inspect_image(image):
+            client = docker_engine_api.DockerEngineClient()
+            try:
+                return client.inspect_image(image)
+            finally:
+                client.close()
+
+        def get_image_id(image):
+            details = inspect_image(image)
+            return details['Id'] if details else None
+
+        def pull_image(image):
+            client = docker_engine_api.DockerEngineClient()
+            try:
+                client.pull_image(image, auth=ecr_auth.get_registry_auth(image))
+            finally:
+                client.close()
+
+        def get_repo_digest(image):
+            details = inspect_image(image)
+            return image_index.select_repo_digest(image, details and details.get('RepoDigests'))
+        return get_image_id, pull_image, get_repo_digest
+    return docker_cli_utils.get_image_id, \
+        lambda image: docker_cli_utils.pull_image(image, quiet=quiet, env=env), \
+        lambda image: image_index.select_repo_digest(image, docker_cli_utils.get_image_repo_digests(image))
+
+
+def get_registry_digest(image):
+    """The digest the image's registry serves for its tag, authenticating to ECR
+    with the registry's cached token."""
+    from . import registry_manifest
+    return registry_manifest.get_manifest_digest(image, auth=ecr_auth.get_registry_auth(image))
+
+
+def pull_image_if_missing(args):
+    policy, ttl = image_index.parse_pull_policy(args.pull)
+    index = None
+    if policy in ('always', 'if-stale', 'missing'):
+        try:
+            index = image_index.ImageIndex()
+        except (IOError, OSError) as e:
+            print("WARNING: image index unavailable: {}".format(e))
+    get_image_id, pull_image, get_repo_digest = get_image_handlers(
+        get_docker_backend(args), env=get_docker_env(args))
+    image_index.ensure_image(
+        args.image, policy, ttl, get_image_id, pull_image,
+        index=index, verbose=VERBOSE_MODE,
+        get_repo_digest=get_repo_digest, get_registry_digest=get_registry_digest)
+
+
+def needs_image_check(args):
+    """Whether the image stage has anything to do.  With the default missing
+    policy docker run pulls a missing image itself, so --exec-docker, which is
+    about starting as few processes as possible, leaves it to docker run rather
+    than inspecting the image first."""
+    policy, _ = image_index.parse_pull_policy(args.pull)
+    return policy != 'missing' or not args.exec_docker
+
+
+def is_builtin_network(network):
+    return network in ('host', 'bridge', 'none', 'default') or network.startswith('container:')
+
+
+def needs_docker_resource_check(args):
+    """Only custom networks are checked, and named volumes only when verbose."""
+    return bool(args.network and not is_builtin_network(args.network)) or \
+        bool(VERBOSE_MODE and args.volumes)
+
+
+def check_docker_resources(args):
+    """Fail before doing anything else if the network doesn't exist, and point out
+    named volumes which docker will create empty."""
+    if args.network and not is_builtin_network(args.network):
+        if not docker_cli_utils.network_exists(args.network):
+            raise DockerCliUtilError("Docker network {} not found".format(args.network))
+    if not VERBOSE_MODE:
+        return
+    for volume in args.volumes or []:
+        source = volume.split(':', 1)[0]
+        if source and not source.startswith(('/', '.', '~')) and ':' in volume:
+            if not docker_cli_utils.volume_exists(source):
+                print("Docker volume {} does not exist and will be created".format(source))
+
+
+def get_account_id_for_error(profile_name, region=None):
+    """Look up the account id for an error message, never raising."""
+    try:
+        from . import aws_iam_utils
+        return aws_iam_utils.get_aws_account_id(profile_name, region)
+    except Exception as e:
+        if VERBOSE_MODE:
+            print("Error retrieving AWS Account ID: {}".format(str(e)))
+        return 'error'
+
+
+def report_timings(args):
+    """Print and/or export the launch phase timings as requested, never raising."""
+    recorder = timings.recorder
+    if args.timings:
+        print(recorder.format_table())
+    if args.timings_file:
+        try:
+            recorder.write_file(args.timings_file)
+        except (IOError, OSError) as e:
+            print("WARNING: unable to write timings file {}: {}".format(args.timings_file, e))
+    if args.timings_otlp_endpoint:
+        try:
+            recorder.export_otlp(args.timings_otlp_endpoint)
+        except Exception as e:
+            print("WARNING: unable to export timings to {}: {}".format(args.timings_otlp_endpoint, e))
+
+
+def wants_timings(args):
+    return args.timings or args.timings_file or args.timings_otlp_endpoint
+
+
+def prefetch_images_main(argv):
+    from . import prefetch
+    return prefetch.prefetch_images_main(argv)
+
+
+def prefetch_main(argv):
+    from . import prefetch
+    return prefetch.prefetch_main(argv)
+
+
+def pool_main(argv):
+    from . import container_pool
+    return container_pool.pool_main(argv)
+
+
+def daemon_main(argv):
+    from . import daemon
+    return daemon.daemon_main(argv)
+
+
+def reap_main(argv):
+    from . import reaper
+    return reaper.reap_main(argv)
+
 
-    region = args.region or \
+def up_main(argv):
+    from . import stack
+    return stack.up_main(argv)
+
+
+def down_main(argv):
+    from . import stack
+    return stack.down_main(argv)
+
+
+def get_region(args):
+    return args.region or \
         os.environ.get('AWS_REGION',
                        os.environ.get('AWS_DEFAULT_REGION', None))
 
+
+def prepare_launch(args, region, resolve_creds=resolve_aws_creds):
+    """Run the independent launch stages concurrently and return the credentials
+    for the container, raising LaunchError if a stage fails."""
+    pipeline = launch_pipeline.LaunchPipeline()
+    pipeline.add_stage('credentials', resolve_creds, args, region)
+    if args.build:
+        pipeline.add_stage('image', build_image, args)
+    elif ecr_auth.parse_ecr_image(args.image):
+        pipeline.add_stage(
+            'image', ensure_registry_image, args, lambda: pipeline.result('credentials'))
+    elif needs_image_check(args):
+        pipeline.add_stage('image', ensure_image, args)
+    pipeline.add_stage('custom_env_file', read_custom_env_file, args.custom_env_file)
+    if needs_docker_resource_check(args):
+        pipeline.add_stage('docker_resources', check_docker_resources, args)
+
+    try:
+        aws_creds = pipeline.result('credentials')
+        pipeline.join()
+    except (DockerCliUtilError, PullPolicyError) as e:
+        raise LaunchError(str(e))
+    if VERBOSE_MODE:
+        print(pipeline.format_timings())
+    return aws_creds
+
+
+def write_container_name_file(container_name):
+    if os.environ.get('IAM_DOCKER_RUN_DISABLE_CONTAINER_NAME_TEMPFILE', None):
+        print('Container name temp file writing is disabled')
+        return
+    try:
+        path_prefix = os.environ.get(
+            'IAM_DOCKER_RUN_CONTAINER_NAME_PATH_PREFIX', 'temp')
+        container_name_file = \
+            docker_cli_utils.write_container_name_temp_file(
+                container_name, path_prefix)
+        print("Container name file: {}".format(container_name_file))
+    except docker_cli_utils.ContainerNameTempFileError as e:
+        if VERBOSE_MODE:
+            print("Error writing container name temporary file")
+
+
+def wait_for_container(container_name):
+    """Return the exit code of the container docker run has finished running, and
+    remove it."""
+    try:
+        exit_code = docker_cli_utils.get_docker_inspect_exit_code(
+            container_name)
+    except DockerCliUtilError as e:
+        raise LaunchError(str(e))
+    print("Container exited with code {}".format(exit_code))
+    print("Removing container: {}".format(container_name))
+    docker_cli_utils.remove_docker_container(container_name)
+    return exit_code
+
+
+def launch(args):
+    """Launch the container the parsed command line options describe and return
+    the exit code to exit with, raising LaunchError if the launch fails."""
+    region = get_region(args)
+
     if args.no_volume:
         print("WARNING: --no-volume is deprecated, there is no longer any default volume mount")
 
-    env_tmpfile = ''
-    aws_creds = {}
-    if not args.profile and not args.role:
-        print('WARNING: No profile or role specified')
-    else:
+    if args.credentials_endpoint:
+        if args.exec_docker or args.detached:
+            raise LaunchError('--credentials-endpoint cannot be combined with --exec-docker or --detached')
+        if args.network != 'host':
+            # AWS SDKs only accept a plain http credentials endpoint on a loopback
+            # address, which the container only shares with the host on its network
+            raise LaunchError('--credentials-endpoint requires --network host')
+
+    if args.log_dir and (args.detached or args.interactive or args.shell or args.exec_docker
+                         or args.shards or args.shard_manifest or get_docker_backend(args) == 'api'):
+        raise LaunchError('--log-dir cannot be combined with --detached, --interactive, --shell, '
+                          '--exec-docker, --shards, --shard-manifest or --docker-backend api')
+
+    aws_creds = prepare_launch(args, region)
+
+    if args.pool:
+        return run_pool(args, aws_creds, region)
+
+    container_name = args.name or docker_cli_utils.random_container_name()
+    write_container_name_file(container_name)
+
+    if args.credentials_endpoint:
+        aws_creds = start_credentials_server(args, aws_creds, region)
+
+    if args.shards or args.shard_manifest:
+        return run_shards(args, container_name, aws_creds, region)
+
+    if get_docker_backend(args) == 'api':
+        # the environment is passed in the create request, so no env file is needed
+        from .docker_engine_api import DockerEngineApiError
         try:
-            aws_creds = get_aws_creds(args.profile, args.role, verbose=True)
-            print("Generated temporary AWS credentials: {}".format(
-                aws_creds['AWS_ACCESS_KEY_ID']))
-        except ProfileParsingError as e:
-            print(e)
-            sys.exit(1)
-        except RoleNotFoundError as e:
-            if VERBOSE_MODE:
-                print(str(e))
-            try:
-                account_id = aws_iam_utils.get_aws_account_id(args.profile)
-            except Exception as e:
-                if VERBOSE_MODE:
-                    print("Error retrieving AWS Account ID: {}".format(str(e)))
-                account_id = 'error'
-            print("IAM role '{}' not found in account id {}, credential method: {}".format(
-                args.role,
-                account_id,
-                e.credential_method))
-            sys.exit(1)
-        except AssumeRoleError as e:
-            if args.verbose:
-                print(str(e))
-            try:
-                account_id = aws_iam_utils.get_aws_account_id(args.profile)
-            except Exception as e:
-                if args.verbose:
-                    print("Error retrieving AWS Account ID: {}".format(str(e)))
-                account_id = 'error'
-            credential_method = e.credential_method if hasattr(
-                e, 'credential_method') else '(unknown)'
-            print("Error assuming IAM role '{}' from account id {}, credential method: {}, error: {}".format(
-                args.role,
-                account_id,
-                credential_method,
-                e
-            ))
-            sys.exit(1)
+            return run_container_api(
+                args,
+                container_name,
+                build_env_list(aws_creds, region, args.custom_env_file, args.envvars))
+        except (DockerEngineApiError, IOError, OSError) as e:
+            raise LaunchError(str(e))
 
     env_tmpfile = generate_temp_env_file(
         aws_creds,
@@ -379,42 +1196,87 @@ def main():
         args.custom_env_file,
         args.envvars)
 
-    container_name = args.name or docker_cli_utils.random_container_name()
-    if os.environ.get('IAM_DOCKER_RUN_DISABLE_CONTAINER_NAME_TEMPFILE', None):
-        print('Container name temp file writing is disabled')
-    else:
-        try:
-            path_prefix = os.environ.get(
-                'IAM_DOCKER_RUN_CONTAINER_NAME_PATH_PREFIX', 'temp')
-            container_name_file = \
-                docker_cli_utils.write_container_name_temp_file(
-                    container_name, path_prefix)
-            print("Container name file: {}".format(container_name_file))
-        except docker_cli_utils.ContainerNameTempFileError as e:
-            if VERBOSE_MODE:
-                print("Error writing container name temporary file")
+    try:
+        if args.exec_docker:
+            docker_run_args = build_docker_run_args(
+                args,
+                container_name,
+                env_tmpfile)
+            # docker run --rm removes the container and returns its exit code itself
+            if wants_timings(args):
+                report_timings(args)
+            docker_cli_utils.exec_docker(docker_run_args, env_tmpfile, env=get_docker_env(args))
 
-    docker_run_command = build_docker_run_command(
-        args,
-        container_name,
-        env_tmpfile if env_tmpfile else args.custom_env_file)
+        docker_run_command = build_docker_run_command(
+            args,
+            container_name,
+            env_tmpfile if env_tmpfile else args.custom_env_file)
 
-    print(docker_run_command)
-    os.system(docker_run_command)
+        print(docker_run_command)
+        with timings.phase('docker:run', detached=args.detached):
+            if args.log_dir:
+                try:
+                    run_container_captured(
+                        args, container_name, env_tmpfile if env_tmpfile else args.custom_env_file)
+                except (IOError, OSError, ValueError) as e:
+                    raise LaunchError("Error capturing container output: {}".format(e))
+            else:
+                if getattr(args, 'docker_config', None):
+                    docker_run_command = 'DOCKER_CONFIG={} {}'.format(
+                        docker_cli_utils.shlex_quote(args.docker_config), docker_run_command)
+                os.system(docker_run_command)
 
-    exit_code = None
-    if not args.detached:
-        try:
-            exit_code = docker_cli_utils.get_docker_inspect_exit_code(
-                container_name)
-            print("Container exited with code {}".format(exit_code))
-        except DockerCliUtilError as e:
-            print(e)
-            sys.exit(1)
-        print("Removing container: {}".format(container_name))
-        docker_cli_utils.remove_docker_container(container_name)
+        if args.detached:
+            return 0
+        return wait_for_container(container_name)
+    finally:
+        if env_tmpfile:
+            env_assembly.release_env_file(env_tmpfile)
+
+
+# subcommands, given as the first argument in place of the usual options
+COMMANDS = {
+    'prefetch': prefetch_main,
+    'prefetch-images': prefetch_images_main,
+    'daemon': daemon_main,
+    'pool': pool_main,
+    'reap': reap_main,
+    'up': up_main,
+    'down': down_main,
+}
 
-    if env_tmpfile:
-        shell_utils.delete_file_silently(env_tmpfile)
 
+def main():
+    print('IAM-Docker-Run version {}'.format(__version__))
+
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
+
+    with timings.phase('args:parse'):
+        parser = create_parser()
+        args = parser.parse_args()
+    if wants_timings(args):
+        # exec_docker replaces the process, so it reports before the handoff instead
+        atexit.register(report_timings, args)
+    try:
+        image_index.parse_pull_policy(args.pull)
+    except PullPolicyError as e:
+        parser.error(str(e))
+    if not args.image and not args.build:
+        parser.error('--image is required unless --build is given')
+
+    if args.verbose:
+        global VERBOSE_MODE
+        VERBOSE_MODE = True
+
+    # if not args.profile and not args.role:
+    #     parser.print_help()
+    #     print('You must specify --profile and/or --role')
+    #     sys.exit(1)
+
+    try:
+        exit_code = launch(args)
+    except LaunchError as e:
+        print(e)
+        sys.exit(1)
     sys.exit(exit_code if exit_code else 0)
@@ -0,0 +1,239 @@
+from __future__ import print_function
+import os
+import re
+import stat
+import time
+import hashlib
+import subprocess
+from . import cache_utils
+from . import docker_cli_utils
+from . import timings
+
+
+BUILD_DIGEST_LABEL = 'iam-docker-run.build-digest'
+HASH_CHUNK_SIZE = 1024 * 1024
+# files modified this recently may change again within the mtime's resolution, so
+# their hashes aren't cached
+RACY_SECONDS = 2
+
+
+class BuildError(Exception):
+    pass
+
+
+def read_dockerignore(context):
+    """The (pattern, excluded) rules of the context's .dockerignore, in order."""
+    rules = []
+    try:
+        with open(os.path.join(context, '.dockerignore')) as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        return rules
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        excluded = not line.startswith('!')
+        pattern = line if excluded else line[1:].strip()
+        pattern = os.path.normpath(pattern).replace(os.sep, '/').lstrip('/')
+        if pattern and pattern != '.':
+            rules.append((compile_pattern(pattern), excluded))
+    return rules
+
+
+def compile_pattern(pattern):
+    """Compile a .dockerignore pattern, which matches a path or any directory
+    above it, to a regex.  ** matches any number of directories."""
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                regex += '[' + pattern[i + 1:end].replace('\\', '\\\\') + ']'
+                i = end
+        elif char == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(char)
+        i += 1
+    return re.compile('^{}(?:/.*)?$'.format(regex))
+
+
+def is_ignored(path, rules):
+    """Whether the context relative path is excluded, the last matching rule
+    deciding as docker does."""
+    ignored = False
+    for regex, excluded in rules:
+        if regex.match(path):
+            ignored = excluded
+    return ignored
+
+
+def list_context_files(context, rules):
+    """The context relative paths of the files docker would send for the build."""
+    # without exceptions nothing below an ignored directory can be included
+    prune = all(excluded for _, excluded in rules)
+    paths = []
+    for root, dirs, files in os.walk(context):
+        relative_root = os.path.relpath(root, context).replace(os.sep, '/')
+        relative_root = '' if relative_root == '.' else relative_root + '/'
+        if prune:
+            dirs[:] = [d for d in dirs if not is_ignored(relative_root + d, rules)]
+        dirs.sort()
+        for name in files:
+            path = relative_root + name
+            if not is_ignored(path, rules):
+                paths.append(path)
+        # symlinked directories are sent as links rather than followed
+        for name in dirs:
+            if os.path.islink(os.path.join(root, name)) and not is_ignored(relative_root + name, rules):
+                paths.append(relative_root + name)
+    return sorted(paths)
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileHashCache(object):
+    """Hashes of a context's files keyed by path, reused while the file's mtime and
+    size are unchanged, so only edited files are read again."""
+
+    def __init__(self, context, cache_dir=None):
+        self.cache_dir = cache_dir or cache_utils.get_cache_dir('builds')
+        self._path = os.path.join(
+            self.cache_dir, 'files-{}.json'.format(cache_utils.cache_key(os.path.abspath(context))))
+        self._entries = cache_utils.read_json(self._path) or {}
+        self._updated = {}
+
+    def get_hash(self, full_path, path):
+        st = os.lstat(full_path)
+        if stat.S_ISLNK(st.st_mode):
+            return hashlib.sha256(os.readlink(full_path).encode('utf-8')).hexdigest()
+        entry = self._entries.get(path)
+        if entry and entry['mtime'] == st.st_mtime and entry['size'] == st.st_size:
+            self._updated[path] = entry
+            return entry['hash']
+        file_hash = hash_file(full_path)
+        if time.time() - st.st_mtime > RACY_SECONDS:
+            self._updated[path] = {'mtime': st.st_mtime, 'size': st.st_size, 'hash': file_hash}
+        return file_hash
+
+    def save(self):
+        """Write the entries used by this digest, dropping files no longer present."""
+        cache_utils.write_json(self._path, self._updated)
+
+
+def compute_context_digest(context, dockerfile, build_args=None, hash_cache=None):
+    """A content digest of everything the build depends on: the Dockerfile, the
+    build args and the path, permissions and content of every file in the context
+    which .dockerignore doesn't exclude."""
+    digest = hashlib.sha256()
+    with open(dockerfile, 'rb') as f:
+        digest.update(b'dockerfile\0' + f.read() + b'\0')
+    for build_arg in sorted(build_args or []):
+        digest.update('arg\0{}\0'.format(build_arg).encode('utf-8'))
+    hash_cache = hash_cache or FileHashCache(context)
+    for path in list_context_files(context, read_dockerignore(context)):
+        full_path = os.path.join(context, path)
+        mode = stat.S_IMODE(os.lstat(full_path).st_mode)
+        digest.update('file\0{}\0{:o}\0{}\0'.format(
+            path, mode, hash_cache.get_hash(full_path, path)).encode('utf-8'))
+    try:
+        hash_cache.save()
+    except (IOError, OSError):
+        pass
+    return digest.hexdigest()
+
+
+def get_default_tag(context, digest):
+    name = re.sub(r'[^a-z0-9._-]+', '-', os.path.basename(os.path.abspath(context)).lower()).strip('.-_')
+    return 'idr-build/{}:{}'.format(name or 'context', digest[:16])
+
+
+class BuildIndex(object):
+    """Local index of build digest -> the id of the image built from it."""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or cache_utils.get_cache_dir('builds')
+        self._path = os.path.join(self.cache_dir, 'index.json')
+
+    def get(self, digest):
+        return (cache_utils.read_json(self._path) or {}).get(digest)
+
+    def put(self, digest, image_id):
+        with cache_utils.file_lock(self._path):
+            index = cache_utils.read_json(self._path) or {}
+            index[digest] = {'image_id': image_id, 'built_at': time.time()}
+            cache_utils.write_json(self._path, index)
+
+    def lock(self, digest):
+        """Held while building a digest, so concurrent launches wait for one build."""
+        return cache_utils.file_lock(os.path.join(self.cache_dir, digest))
+
+
+def docker_build(context, dockerfile, tag, digest, build_args=None):
+    docker_args = ['docker', 'build', '-f', dockerfile, '-t', tag,
+                   '--label', '{}={}'.format(BUILD_DIGEST_LABEL, digest)]
+    for build_arg in build_args or []:
+        docker_args.extend(['--build-arg', build_arg])
+    env = dict(os.environ)
+    env['DOCKER_BUILDKIT'] = '1'
+    exit_code = subprocess.call(docker_args + [context], env=env)
+    if exit_code != 0:
+        raise BuildError("Error building {} (docker exit code {})".format(context, exit_code))
+
+
+def ensure_built(context, dockerfile=None, tag=None, build_args=None, index=None, verbose=False):
+    """Build the context unless an image built from the same content is still
+    present locally, and return the image tag to run.  The tag is --image when
+    given, otherwise one derived from the context's name and digest."""
+    if not os.path.isdir(context):
+        raise BuildError("Build context {} is not a directory".format(context))
+    dockerfile = dockerfile or os.path.join(context, 'Dockerfile')
+    if not os.path.isfile(dockerfile):
+        raise BuildError("Dockerfile {} not found".format(dockerfile))
+    with timings.phase('build:digest'):
+        digest = compute_context_digest(context, dockerfile, build_args)
+    tag = tag or get_default_tag(context, digest)
+    index = index or BuildIndex()
+
+    with index.lock(digest):
+        entry = index.get(digest)
+        image_id = entry and docker_cli_utils.get_image_id(entry['image_id'])
+        if image_id:
+            if verbose:
+                print("Build context {} is unchanged ({}), reusing image {}".format(
+                    context, digest[:16], image_id))
+            if docker_cli_utils.get_image_id(tag) != image_id:
+                docker_cli_utils.tag_image(image_id, tag)
+            return tag
+        print("Building {} as {}".format(context, tag))
+        with timings.phase('build:docker', digest=digest[:16]):
+            docker_build(context, dockerfile, tag, digest, build_args)
+        image_id = docker_cli_utils.get_image_id(tag)
+        if not image_id:
+            raise BuildError("Built image {} not found".format(tag))
+        index.put(digest, image_id)
+    return tag
@@ -0,0 +1,123 @@
+import os
+import re
+import time
+from . import cache_utils
+
+
+PULL_POLICIES = ('missing', 'always', 'never', 'if-stale')
+DEFAULT_PULL_POLICY = 'missing'
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class PullPolicyError(Exception):
+    pass
+
+
+def parse_duration(duration):
+    """Convert a duration such as 90, 30m, 12h or 1d into seconds."""
+    match = re.match(r'^(\d+)([smhd]?)$', duration.strip())
+    if not match:
+        raise PullPolicyError("Unable to parse duration {}".format(duration))
+    return int(match.group(1)) * DURATION_UNITS[match.group(2) or 's']
+
+
+def parse_pull_policy(value):
+    """Parse missing|always|never|if-stale:<ttl> into (policy, ttl seconds)."""
+    value = value or DEFAULT_PULL_POLICY
+    policy, _, ttl = value.partition(':')
+    if policy not in PULL_POLICIES:
+        raise PullPolicyError("Unknown pull policy {}, expected one of {}".format(
+            value, ', '.join(PULL_POLICIES)))
+    if policy == 'if-stale':
+        if not ttl:
+            raise PullPolicyError("The if-stale pull policy needs a ttl, e.g. if-stale:1h")
+        return policy, parse_duration(ttl)
+    if ttl:
+        raise PullPolicyError("Only the if-stale pull policy takes a ttl")
+    return policy, None
+
+
+def select_repo_digest(image, repo_digests):
+    """The digest among an image's RepoDigests (repository@digest) that belongs to
+    the image reference's repository, or None."""
+    if '@' in image:
+        repository = image.split('@', 1)[0]
+    elif ':' in image.rsplit('/', 1)[-1]:
+        repository = image.rsplit(':', 1)[0]
+    else:
+        repository = image
+    for repo_digest in repo_digests or []:
+        name, _, digest = repo_digest.partition('@')
+        if name == repository:
+            return digest
+    return None
+
+
+class ImageIndex(object):
+    """Local index of image reference -> image id, registry digest and the last time
+    the reference was checked against its registry, so fresh images skip the
+    registry check and stale ones need only compare digests."""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or cache_utils.get_cache_dir('images')
+        self._path = os.path.join(self.cache_dir, 'index.json')
+
+    def get(self, image):
+        return (cache_utils.read_json(self._path) or {}).get(image)
+
+    def put(self, image, image_id, digest=None):
+        with cache_utils.file_lock(self._path):
+            index = cache_utils.read_json(self._path) or {}
+            index[image] = {'image_id': image_id, 'digest': digest, 'checked_at': time.time()}
+            cache_utils.write_json(self._path, index)
+
+
+def is_current(image, digest, get_registry_digest, verbose=False):
+    """Whether the registry still serves the digest for the image's tag.  Any
+    failure to ask counts as not current, leaving the pull to decide."""
+    try:
+        registry_digest = get_registry_digest(image)
+    except Exception as e:
+        if verbose:
+            print("Unable to check the registry digest of {}: {}".format(image, e))
+        return False
+    if verbose:
+        print("Image {} registry digest {} {} the local image".format(
+            image, registry_digest, 'matches' if registry_digest == digest else 'differs from'))
+    return registry_digest == digest
+
+
+def ensure_image(image, policy, ttl, get_image_id, pull_image, index=None, verbose=False,
+                 get_repo_digest=None, get_registry_digest=None):
+    """Apply the pull policy to the image.  get_image_id returns the local image id or
+    None when it isn't present, pull_image pulls it.  With get_repo_digest, returning
+    the local image's registry digest, and get_registry_digest, returning the digest
+    the registry serves, a stale image is only pulled if the two differ.  Returns
+    True if it was pulled."""
+    image_id = get_image_id(image)
+    if policy == 'never':
+        if image_id is None:
+            raise PullPolicyError(
+                "Image {} is not present locally and the pull policy is never".format(image))
+        return False
+    if policy == 'missing' and image_id is not None:
+        return False
+    if policy == 'if-stale' and image_id is not None and index:
+        entry = index.get(image)
+        if entry and entry.get('image_id') == image_id:
+            if time.time() - entry.get('checked_at', 0) < ttl:
+                if verbose:
+                    print("Image {} was checked {}s ago, skipping pull".format(
+                        image, int(time.time() - entry['checked_at'])))
+                return False
+            if entry.get('digest') and get_registry_digest \
+                    and is_current(image, entry['digest'], get_registry_digest, verbose):
+                index.put(image, image_id, entry['digest'])
+                return False
+    print("Pulling image {} (pull policy {})".format(image, policy))
+    pull_image(image)
+    if index:
+        image_id = get_image_id(image)
+        digest = get_repo_digest(image) if get_repo_digest and image_id else None
+        index.put(image, image_id, digest)
+    return True
@@ -0,0 +1,89 @@
+import time
+import threading
+from . import timings
+
+
+class LaunchStage(object):
+    def __init__(self, name, func, args, kwargs):
+        self.name = name
+        self.started = None
+        self.finished = None
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._result = None
+        self._error = None
+        self._done = threading.Event()
+        # stages record their phases with the launch that added them
+        self._recorder = timings.thread_recorder()
+
+    def run(self):
+        self.started = time.time()
+        try:
+            with timings.recording(self._recorder), timings.phase('stage:{}'.format(self.name)):
+                self._result = self._func(*self._args, **self._kwargs)
+        except BaseException as e:
+            self._error = e
+        finally:
+            self.finished = time.time()
+            self._done.set()
+
+    def result(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    @property
+    def duration(self):
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+
+class LaunchPipeline(object):
+    """Runs the independent stages of a launch (credentials, image, env file, docker
+    resource checks) concurrently, so the launch takes about as long as its slowest
+    stage instead of the sum of all of them.  Results are only collected, and errors
+    re-raised, when the caller asks for a stage's result."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = []
+        self._stages_by_name = {}
+
+    def add_stage(self, name, func, *args, **kwargs):
+        stage = LaunchStage(name, func, args, kwargs)
+        self.stages.append(stage)
+        self._stages_by_name[name] = stage
+        # daemon threads so a stage still running (e.g. a slow image pull) never
+        # holds up exiting when another stage fails
+        thread = threading.Thread(target=stage.run, name='idr-{}'.format(name))
+        thread.daemon = True
+        thread.start()
+        return stage
+
+    def has_stage(self, name):
+        return name in self._stages_by_name
+
+    def result(self, name):
+        return self._stages_by_name[name].result()
+
+    def join(self):
+        """Wait for every stage, re-raising the first error in stage order."""
+        for stage in self.stages:
+            stage.result()
+
+    def timings(self):
+        """Return (name, start offset, duration) in seconds for each finished stage."""
+        return [
+            (stage.name, stage.started - self.started, stage.duration)
+            for stage in self.stages if stage.duration is not None
+        ]
+
+    def format_timings(self):
+        lines = ['Launch stage timings:']
+        for name, offset, duration in self.timings():
+            lines.append('  {:<20} started +{:.3f}s took {:.3f}s'.format(name, offset, duration))
+        lines.append('  {:<20} {:.3f}s'.format('total', time.time() - self.started))
+        return '\n'.join(lines)
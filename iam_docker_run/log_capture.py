@@ -0,0 +1,140 @@
+import os
+import sys
+import gzip
+import time
+import shutil
+import threading
+import subprocess
+
+
+# container output is read and written in chunks of at most this many bytes, so
+# memory use doesn't depend on how much the container logs or how long its lines are
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+
+
+def utc_timestamp(now=None):
+    now = time.time() if now is None else now
+    return '{}.{:03d}Z'.format(
+        time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)), int(now * 1000) % 1000)
+
+
+class RotatingLogWriter(object):
+    """Writes container output to a log file with every line prefixed by a UTC
+    timestamp and the stream it came from.  When the file grows past max_bytes it
+    is rotated to <path>.1 (gzipped with compress), keeping at most backups files.
+    A line still being written is split there, and carries on in the new file."""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS, compress=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self._lock = threading.Lock()
+        # the stream which wrote last, if its line hasn't ended yet
+        self._open_line_stream = None
+        self._file = open(path, 'ab')
+        self._size = self._file.tell()
+
+    def _backup_path(self, index):
+        return '{}.{}{}'.format(self.path, index, '.gz' if self.compress else '')
+
+    def _rotate(self):
+        self._file.close()
+        if self.backups > 0:
+            oldest = self._backup_path(self.backups)
+            if os.path.exists(oldest):
+                os.remove(oldest)
+            for index in range(self.backups - 1, 0, -1):
+                if os.path.exists(self._backup_path(index)):
+                    os.rename(self._backup_path(index), self._backup_path(index + 1))
+            if self.compress:
+                with open(self.path, 'rb') as source:
+                    with gzip.open(self._backup_path(1), 'wb') as target:
+                        shutil.copyfileobj(source, target, CHUNK_SIZE)
+                os.remove(self.path)
+            else:
+                os.rename(self.path, self._backup_path(1))
+        self._file = open(self.path, 'wb')
+        self._size = 0
+
+    def _write(self, data):
+        self._file.write(data)
+        self._size += len(data)
+
+    def write(self, stream_name, data):
+        """Write a chunk of a stream's output, which may end part way through a line."""
+        with self._lock:
+            if self._open_line_stream not in (None, stream_name):
+                # another stream is part way through a line, end it there
+                self._write(b'\n')
+                self._open_line_stream = None
+            prefix = '{} {} | '.format(utc_timestamp(), stream_name).encode('utf-8')
+            start = 0
+            while start < len(data):
+                if self._open_line_stream is None:
+                    self._write(prefix)
+                end = data.find(b'\n', start)
+                if end == -1:
+                    self._write(data[start:])
+                    self._open_line_stream = stream_name
+                    break
+                self._write(data[start:end + 1])
+                self._open_line_stream = None
+                start = end + 1
+            if self._size >= self.max_bytes:
+                # output without line ends (progress bars, binary data) would otherwise
+                # grow the log without limit
+                if self._open_line_stream is not None:
+                    self._write(b'\n')
+                    self._open_line_stream = None
+                self._rotate()
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._open_line_stream is not None:
+                self._file.write(b'\n')
+            self._file.close()
+
+
+def copy_stream(source, console, writer, stream_name):
+    """Copy a pipe to the log, and the console unless it is None, until it closes."""
+    fd = source.fileno()
+    while True:
+        data = os.read(fd, CHUNK_SIZE)
+        if not data:
+            break
+        if console is not None:
+            console.write(data)
+            console.flush()
+        writer.write(stream_name, data)
+    source.close()
+
+
+def run_captured(args, writer, echo=True, **popen_kwargs):
+    """Run a command, writing its stdout and stderr to the log writer and, if echo,
+    passing them through to the console, and return its exit code."""
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen_kwargs)
+    threads = [
+        threading.Thread(target=copy_stream, args=(
+            p.stdout, getattr(sys.stdout, 'buffer', sys.stdout) if echo else None, writer, 'stdout')),
+        threading.Thread(target=copy_stream, args=(
+            p.stderr, getattr(sys.stderr, 'buffer', sys.stderr) if echo else None, writer, 'stderr')),
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        exit_code = p.wait()
+    except KeyboardInterrupt:
+        p.terminate()
+        exit_code = p.wait()
+    for thread in threads:
+        thread.join()
+    writer.flush()
+    return exit_code
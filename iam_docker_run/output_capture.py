@@ -0,0 +1,44 @@
+import sys
+import threading
+import contextlib
+
+
+_local = threading.local()
+_install_lock = threading.Lock()
+
+
+class ThreadRoutedStream(object):
+    """Stands in for sys.stdout, sending what a thread capturing its output prints
+    to that thread's buffer and everything else to the original stream."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, data):
+        buffer = getattr(_local, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(data)
+        buffer.append(data)
+
+    def flush(self):
+        if getattr(_local, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+@contextlib.contextmanager
+def capture():
+    """Collect what the current thread prints into the list yielded rather than
+    writing it to stdout, e.g. the progress messages of get_aws_creds when it runs
+    on a background or request thread.  Other threads print as usual."""
+    with _install_lock:
+        if not isinstance(sys.stdout, ThreadRoutedStream):
+            sys.stdout = ThreadRoutedStream(sys.stdout)
+    previous = getattr(_local, 'buffer', None)
+    _local.buffer = []
+    try:
+        yield _local.buffer
+    finally:
+        _local.buffer = previous
@@ -0,0 +1,143 @@
+from __future__ import print_function
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from . import image_index
+from . import credential_cache
+from . import role_index
+from . import iam_docker_run
+
+
+DEFAULT_PARALLELISM = 4
+
+
+def read_list_file(path):
+    """Read one entry per line, skipping blank lines and # comments."""
+    with open(path, 'r') as f:
+        lines = [line.strip() for line in f.read().splitlines()]
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def create_prefetch_images_parser():
+    parser = argparse.ArgumentParser(
+        prog='idr prefetch-images',
+        description='Warm the local docker image cache by pulling images in parallel')
+    parser.add_argument('images', nargs='*',
+                        help='The images to pull')
+    parser.add_argument('-f', '--file', required=False,
+                        help='File listing images to pull, one per line')
+    parser.add_argument('--pull', default='if-stale:1h',
+                        help='Pull policy for each image: missing, always or if-stale:<ttl> (default if-stale:1h)')
+    parser.add_argument('--parallelism', type=int, default=DEFAULT_PARALLELISM,
+                        help='Maximum number of images pulled at once (default {})'.format(DEFAULT_PARALLELISM))
+    parser.add_argument('--docker-backend', choices=['cli', 'api'], default='cli')
+    parser.add_argument('--verbose', action='store_true', default=False)
+    return parser
+
+
+def prefetch_images_main(argv):
+    parser = create_prefetch_images_parser()
+    args = parser.parse_args(argv)
+    images = list(args.images)
+    if args.file:
+        images.extend(read_list_file(args.file))
+    if not images:
+        parser.error('no images given')
+    try:
+        policy, ttl = image_index.parse_pull_policy(args.pull)
+    except image_index.PullPolicyError as e:
+        parser.error(str(e))
+    index = image_index.ImageIndex()
+    get_image_id, pull_image, get_repo_digest = iam_docker_run.get_image_handlers(
+        args.docker_backend, quiet=True)
+
+    def prefetch_image(image):
+        started = time.time()
+        pulled = image_index.ensure_image(
+            image, policy, ttl, get_image_id, pull_image, index=index, verbose=args.verbose,
+            get_repo_digest=get_repo_digest, get_registry_digest=iam_docker_run.get_registry_digest)
+        return pulled, time.time() - started
+
+    failures = 0
+    executor = ThreadPoolExecutor(max_workers=max(1, args.parallelism))
+    try:
+        futures = [(image, executor.submit(prefetch_image, image)) for image in images]
+        for image, future in futures:
+            try:
+                pulled, duration = future.result()
+                print("{}: {} in {:.2f}s".format(
+                    image, 'pulled' if pulled else 'up to date', duration))
+            except Exception as e:
+                failures += 1
+                print("{}: failed: {}".format(image, e))
+    finally:
+        executor.shutdown(wait=True)
+    return 1 if failures else 0
+
+
+def create_prefetch_parser():
+    parser = argparse.ArgumentParser(
+        prog='idr prefetch',
+        description='Warm the credential cache by assuming roles in parallel, so later launches make no STS calls')
+    parser.add_argument('--role', action='append', dest='roles', default=[],
+                        help='A role name to assume, may be repeated')
+    parser.add_argument('--role-arn', action='append', dest='role_arns', default=[],
+                        help='A role arn to assume, may be repeated')
+    parser.add_argument('-f', '--file', required=False,
+                        help='File listing role names (or arns) to assume, one per line')
+    parser.add_argument('--profile', required=False,
+                        help='The AWS profile providing the credentials to assume the roles with')
+    parser.add_argument('--region', required=False)
+    parser.add_argument('--parallelism', type=int, default=DEFAULT_PARALLELISM,
+                        help='Maximum number of roles assumed at once (default {})'.format(DEFAULT_PARALLELISM))
+    parser.add_argument('--credential-cache-min-ttl', required=False, type=int,
+                        help='Reassume roles whose cached credentials have less than this many seconds left (default {})'.format(
+                            credential_cache.DEFAULT_MIN_TTL))
+    parser.add_argument('--verbose', action='store_true', default=False)
+    return parser
+
+
+def prefetch_main(argv):
+    parser = create_prefetch_parser()
+    args = parser.parse_args(argv)
+    # (role name, role arn) pairs, as a launch given --role or --role-arn keys its cache entry
+    roles = [(role, None) for role in args.roles] + [(None, arn) for arn in args.role_arns]
+    if args.file:
+        roles.extend(
+            (None, role) if role.startswith('arn:') else (role, None)
+            for role in read_list_file(args.file))
+    if not roles:
+        parser.error('no roles given')
+    if credential_cache.cache_disabled():
+        parser.error('the credential cache is disabled, there is nothing to prefetch into')
+    region = args.region or \
+        os.environ.get('AWS_REGION',
+                       os.environ.get('AWS_DEFAULT_REGION', None))
+    cache = credential_cache.CredentialCache(min_ttl=args.credential_cache_min_ttl)
+    index = role_index.RoleIndex()
+
+    def prefetch_role(role_name, role_arn):
+        started = time.time()
+        aws_creds = iam_docker_run.get_aws_creds(
+            args.profile, role_name, verbose=args.verbose, region=region,
+            cache=cache, index=index, role_arn=role_arn)
+        return aws_creds, time.time() - started
+
+    failures = 0
+    executor = ThreadPoolExecutor(max_workers=max(1, args.parallelism))
+    try:
+        futures = [
+            (role_name or role_arn, executor.submit(prefetch_role, role_name, role_arn))
+            for role_name, role_arn in roles]
+        for role, future in futures:
+            try:
+                aws_creds, duration = future.result()
+                print("{}: {} in {:.2f}s, expires {}".format(
+                    role, aws_creds['AWS_ACCESS_KEY_ID'], duration, aws_creds.get('expiration')))
+            except Exception as e:
+                failures += 1
+                print("{}: failed: {}".format(role, e))
+    finally:
+        executor.shutdown(wait=True)
+    return 1 if failures else 0
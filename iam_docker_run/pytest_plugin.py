@@ -0,0 +1,171 @@
+import os
+import shlex
+import uuid
+import subprocess
+import pytest
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('iam-docker-run')
+    group.addoption('--idr-profile', default=None,
+                    help='AWS profile for the idr_credentials fixture and idr containers')
+    group.addoption('--idr-role', default=None,
+                    help='IAM role name to assume for the idr_credentials fixture and idr containers')
+    group.addoption('--idr-region', default=None,
+                    help='AWS region for the idr_credentials fixture and idr containers')
+
+
+class ExecResult(object):
+    def __init__(self, exit_code, stdout, stderr):
+        self.exit_code = exit_code
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+    def __repr__(self):
+        return 'ExecResult(exit_code={!r})'.format(self.exit_code)
+
+
+class IdrContainer(object):
+    """A container started detached and kept idle, for tests to run commands in."""
+
+    def __init__(self, runner, spec):
+        self.runner = runner
+        self.spec = spec
+        self.name = None
+        self.container_id = None
+
+    def start(self):
+        """Start the container idling, as pool containers do (see
+        container_pool.start_idle_container)."""
+        from . import container_pool
+        from .runner import ContainerStartError
+        worker = os.environ.get('PYTEST_XDIST_WORKER', 'main')
+        self.name = self.spec.name or 'idr-pytest-{}-{}'.format(worker, uuid.uuid4().hex[:8])
+
+        def start_idle(command):
+            idle_spec = self.spec.replace(
+                name=self.name, detached=True, entrypoint=command[0], cmd=' '.join(command[1:]),
+                full_entrypoint=None)
+            try:
+                self.container_id = self.runner.run(idle_spec).container_id
+            except ContainerStartError as e:
+                if e.exit_code not in container_pool.COMMAND_ERROR_CODES:
+                    raise
+                return e.exit_code
+            return 0
+        container_pool.start_idle_container(self.name, self.spec.image, start_idle)
+        return self
+
+    def exec_command(self, command, envvars=None, workdir=None):
+        """Run a command (a string or argument list) in the container and return an
+        ExecResult.  The current credentials are given to every exec, so they are
+        refreshed before they expire however long the session runs."""
+        from . import container_pool
+        from . import iam_docker_run
+        args = self.spec.to_args()
+        region = iam_docker_run.get_region(args)
+        aws_creds = {}
+        if args.profile or args.role or args.role_arn:
+            aws_creds = self.runner.resolve_aws_creds(args, region)
+        aws_env = container_pool.get_aws_env(aws_creds, region)
+        docker_args = ['docker', 'exec']
+        if workdir or args.workdir:
+            docker_args.extend(['-w', workdir or args.workdir])
+        # passed by name, so the values come from the environment rather than the arguments
+        for env_name in sorted(aws_env):
+            docker_args.extend(['-e', env_name])
+        for envvar in envvars or []:
+            docker_args.extend(['-e', envvar])
+        docker_args.append(self.name)
+        docker_args.extend(list(command) if isinstance(command, (list, tuple)) else shlex.split(command))
+        env = dict(os.environ)
+        for env_name in container_pool.AWS_ENV_NAMES:
+            env.pop(env_name, None)
+        env.update(aws_env)
+        p = subprocess.Popen(docker_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        stdout, stderr = p.communicate()
+        return ExecResult(p.returncode, stdout.decode('utf-8', 'replace'), stderr.decode('utf-8', 'replace'))
+
+    def remove(self):
+        from . import docker_cli_utils
+        if self.name:
+            docker_cli_utils.force_remove_containers([self.name])
+
+
+class ContainerFactory(object):
+    """Starts containers from iam-docker-run launch options, reusing the one already
+    started with the same options, and removes them all on close."""
+
+    def __init__(self, runner, defaults=None):
+        self.runner = runner
+        self.defaults = defaults or {}
+        self._containers = {}
+
+    def start(self, image, **options):
+        from .runner import LaunchSpec
+        merged = dict(self.defaults)
+        merged.update(options)
+        key = (image, repr(sorted(merged.items())))
+        if key not in self._containers:
+            self._containers[key] = IdrContainer(self.runner, LaunchSpec(image, **merged)).start()
+        return self._containers[key]
+
+    def close(self):
+        for container in self._containers.values():
+            container.remove()
+        self._containers.clear()
+
+
+def get_default_options(config):
+    options = {}
+    for name in ('profile', 'role', 'region'):
+        value = config.getoption('idr_{}'.format(name))
+        if value:
+            options[name] = value
+    return options
+
+
+@pytest.fixture(scope='session')
+def idr_runner(tmp_path_factory):
+    """A Runner shared by the session, writing container logs to a temp directory."""
+    from .runner import Runner
+    return Runner(log_dir=str(tmp_path_factory.mktemp('idr-logs')))
+
+
+@pytest.fixture(scope='session')
+def idr_credentials(request, idr_runner):
+    """Returns AWS credentials for a profile and/or role, by default those given by
+    --idr-profile, --idr-role and --idr-region, e.g. idr_credentials(role='role-ci')."""
+    from . import iam_docker_run
+    from .runner import LaunchSpec
+    defaults = get_default_options(request.config)
+
+    def get_credentials(**options):
+        # credentials come through the credential cache, whose lock file makes
+        # pytest-xdist workers asking for the same role wait for a single STS call
+        merged = dict(defaults)
+        merged.update(options)
+        args = LaunchSpec(None, **merged).to_args()
+        return idr_runner.resolve_aws_creds(args, iam_docker_run.get_region(args))
+    return get_credentials
+
+
+@pytest.fixture(scope='session')
+def idr_containers(request, idr_runner):
+    """Starts containers kept for the whole session, e.g.
+    idr_containers.start('mycompany/app', role='role-ci').exec_command('make test')."""
+    factory = ContainerFactory(idr_runner, get_default_options(request.config))
+    yield factory
+    factory.close()
+
+
+@pytest.fixture(scope='module')
+def idr_module_containers(request, idr_runner):
+    """Like idr_containers, but the containers are removed after each test module."""
+    factory = ContainerFactory(idr_runner, get_default_options(request.config))
+    yield factory
+    factory.close()
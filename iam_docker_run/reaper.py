@@ -0,0 +1,170 @@
+from __future__ import print_function
+import os
+import glob
+import time
+import argparse
+import tempfile
+import subprocess
+from . import docker_cli_utils
+from . import env_assembly
+from .docker_cli_utils import DockerCliUtilError, LAUNCH_LABEL, REAP_LABEL
+
+
+# a foreground container is removed by its own launch once it exits, so it is only
+# treated as orphaned when it has been stopped for longer than this
+DEFAULT_GRACE = 300
+# docker reads the env file when the container starts, so older ones are leftovers
+DEFAULT_MAX_AGE = 3600
+STOPPED_STATUSES = ['exited', 'dead']
+CONTAINER_NAME_FILE = '_container_name.txt'
+
+
+def find_stopped_containers(grace=DEFAULT_GRACE):
+    """The names of the stopped containers launched by iam-docker-run which nothing
+    will remove: detached ones, and foreground ones stopped for longer than grace
+    seconds, whose launch must have been interrupted."""
+    detached = set(docker_cli_utils.list_containers(REAP_LABEL, STOPPED_STATUSES))
+    foreground = [
+        name for name in docker_cli_utils.list_containers(LAUNCH_LABEL, STOPPED_STATUSES)
+        if name not in detached]
+    now = time.time()
+    orphaned = [
+        name for name, finished in docker_cli_utils.get_finished_times(foreground).items()
+        if now - finished > grace]
+    return sorted(detached) + sorted(orphaned)
+
+
+def get_env_file_dirs():
+    """The directories env_assembly.write_env_file may leave file backed env files in."""
+    dirs = [env_assembly.TMPFS_DIR, tempfile.gettempdir()]
+    return [path for index, path in enumerate(dirs) if os.path.isdir(path) and path not in dirs[:index]]
+
+
+def find_stale_env_files(max_age=DEFAULT_MAX_AGE):
+    now = time.time()
+    stale = []
+    for directory in get_env_file_dirs():
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            if not name.startswith(env_assembly.ENV_FILE_PREFIX):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                if now - os.lstat(path).st_mtime > max_age:
+                    stale.append(path)
+            except OSError:
+                pass
+    return stale
+
+
+def find_stale_container_name_files(path_prefix, grace=DEFAULT_GRACE):
+    """Container name files (see write_container_name_temp_file) naming containers
+    which no longer exist."""
+    paths = glob.glob(os.path.join(os.sep, path_prefix, '*', CONTAINER_NAME_FILE))
+    if not paths:
+        return []
+    existing = set(docker_cli_utils.list_containers(include_stopped=True))
+    now = time.time()
+    stale = []
+    for path in paths:
+        try:
+            if now - os.path.getmtime(path) <= grace:
+                continue
+            with open(path) as f:
+                container_name = f.read().strip()
+        except (IOError, OSError):
+            continue
+        if container_name not in existing:
+            stale.append(path)
+    return stale
+
+
+def remove_files(paths):
+    removed = []
+    for path in paths:
+        try:
+            os.remove(path)
+            removed.append(path)
+        except OSError:
+            pass
+    return removed
+
+
+def reap(grace=DEFAULT_GRACE, max_age=DEFAULT_MAX_AGE, path_prefix='temp', dry_run=False, verbose=False):
+    """Remove stopped containers, env files and container name files left behind
+    by iam-docker-run, and return (containers, env files, name files) removed."""
+    containers = find_stopped_containers(grace)
+    env_files = find_stale_env_files(max_age)
+    name_files = find_stale_container_name_files(path_prefix, grace)
+    if verbose or dry_run:
+        for item in containers + env_files + name_files:
+            print("{} {}".format('Would remove' if dry_run else 'Removing', item))
+    if not dry_run:
+        docker_cli_utils.force_remove_containers(containers)
+        env_files = remove_files(env_files)
+        name_files = remove_files(name_files)
+    return containers, env_files, name_files
+
+
+def watch(verbose=False):
+    """Remove detached containers as they exit, as reported by the docker events
+    stream, until interrupted."""
+    p = subprocess.Popen(
+        ['docker', 'events',
+         '--filter', 'type=container',
+         '--filter', 'event=die',
+         '--filter', 'label={}=1'.format(REAP_LABEL),
+         '--format', '{{.Actor.Attributes.name}}'],
+        stdout=subprocess.PIPE)
+    try:
+        for line in iter(p.stdout.readline, b''):
+            container_name = line.decode('utf-8').strip()
+            if not container_name:
+                continue
+            docker_cli_utils.force_remove_containers([container_name])
+            if verbose:
+                print("Removed {}".format(container_name))
+    except KeyboardInterrupt:
+        p.terminate()
+        p.wait()
+        return 0
+    # docker events only ends by itself when it fails
+    return p.wait()
+
+
+def create_reap_parser():
+    parser = argparse.ArgumentParser(
+        prog='idr reap',
+        description='Remove stopped containers and temp files left behind by iam-docker-run')
+    parser.add_argument('--watch', action='store_true', default=False,
+                        help='After reaping, keep running and remove detached containers as soon as they exit')
+    parser.add_argument('--grace', type=int, default=DEFAULT_GRACE,
+                        help='Only remove foreground containers and container name files older than this many seconds (default {})'.format(
+                            DEFAULT_GRACE))
+    parser.add_argument('--max-age', type=int, default=DEFAULT_MAX_AGE,
+                        help='Remove env files older than this many seconds (default {})'.format(DEFAULT_MAX_AGE))
+    parser.add_argument('--dry-run', action='store_true', default=False,
+                        help='List what would be removed without removing it')
+    parser.add_argument('--verbose', action='store_true', default=False)
+    return parser
+
+
+def reap_main(argv):
+    args = create_reap_parser().parse_args(argv)
+    path_prefix = os.environ.get('IAM_DOCKER_RUN_CONTAINER_NAME_PATH_PREFIX', 'temp')
+    try:
+        containers, env_files, name_files = reap(
+            args.grace, args.max_age, path_prefix, dry_run=args.dry_run, verbose=args.verbose)
+    except DockerCliUtilError as e:
+        print(e)
+        return 1
+    print("{} {} containers, {} env files and {} container name files".format(
+        'Would remove' if args.dry_run else 'Removed',
+        len(containers), len(env_files), len(name_files)))
+    if args.watch and not args.dry_run:
+        print("Watching for detached containers to exit")
+        return watch(args.verbose)
+    return 0
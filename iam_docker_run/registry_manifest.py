@@ -0,0 +1,105 @@
+import re
+import json
+import base64
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+    from urllib.parse import urlencode
+except ImportError:  # python 2
+    from urllib2 import Request, urlopen, HTTPError
+    from urllib import urlencode
+
+
+DOCKER_HUB_REGISTRY = 'registry-1.docker.io'
+DOCKER_HUB_ALIASES = ('docker.io', 'index.docker.io', DOCKER_HUB_REGISTRY)
+# the manifest list / image index types first, as docker pull records their
+# digest for multi platform images
+MANIFEST_MEDIA_TYPES = (
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+)
+CHALLENGE_PARAM_RE = re.compile(r'(\w+)="([^"]*)"')
+DEFAULT_TIMEOUT = 5
+
+
+class RegistryError(Exception):
+    pass
+
+
+def parse_image_reference(image):
+    """Split an image reference into (registry host, repository, tag or digest)."""
+    if '@' in image:
+        name, reference = image.split('@', 1)
+    elif ':' in image.rsplit('/', 1)[-1]:
+        name, reference = image.rsplit(':', 1)
+    else:
+        name, reference = image, 'latest'
+    first, _, rest = name.partition('/')
+    if rest and ('.' in first or ':' in first or first == 'localhost'):
+        registry, repository = first, rest
+    else:
+        registry, repository = DOCKER_HUB_REGISTRY, name
+    if registry in DOCKER_HUB_ALIASES:
+        registry = DOCKER_HUB_REGISTRY
+        if '/' not in repository:
+            repository = 'library/' + repository
+    return registry, repository, reference
+
+
+def basic_auth_header(auth):
+    credentials = '{}:{}'.format(auth['username'], auth['password']).encode('utf-8')
+    return 'Basic ' + base64.b64encode(credentials).decode('ascii')
+
+
+def head(url, headers, timeout):
+    request = Request(url, headers=headers)
+    request.get_method = lambda: 'HEAD'
+    return urlopen(request, timeout=timeout)
+
+
+def get_bearer_token(challenge, repository, auth=None, timeout=DEFAULT_TIMEOUT):
+    """Fetch a pull token from the token service named by a registry's Bearer
+    challenge, anonymously unless auth is given."""
+    params = dict(CHALLENGE_PARAM_RE.findall(challenge))
+    realm = params.pop('realm', None)
+    if not realm:
+        raise RegistryError("Registry challenge without a realm: {}".format(challenge))
+    params.setdefault('scope', 'repository:{}:pull'.format(repository))
+    request = Request('{}?{}'.format(realm, urlencode(sorted(params.items()))))
+    if auth:
+        request.add_header('Authorization', basic_auth_header(auth))
+    body = json.loads(urlopen(request, timeout=timeout).read().decode('utf-8'))
+    token = body.get('token') or body.get('access_token')
+    if not token:
+        raise RegistryError("No token from {}".format(realm))
+    return token
+
+
+def get_manifest_digest(image, auth=None, timeout=DEFAULT_TIMEOUT):
+    """The digest the registry currently serves for the image's tag, from a HEAD
+    request for its manifest, which is much cheaper than a pull and doesn't count
+    against registry pull limits.  auth is a dict with a username and password."""
+    registry, repository, reference = parse_image_reference(image)
+    if reference.startswith('sha256:'):
+        return reference
+    url = 'https://{}/v2/{}/manifests/{}'.format(registry, repository, reference)
+    headers = {'Accept': ', '.join(MANIFEST_MEDIA_TYPES)}
+    try:
+        response = head(url, headers, timeout)
+    except HTTPError as e:
+        challenge = e.headers.get('WWW-Authenticate') or ''
+        scheme = challenge.split(' ', 1)[0].lower()
+        if e.code != 401 or scheme not in ('bearer', 'basic') or (scheme == 'basic' and not auth):
+            raise RegistryError("Manifest request for {} failed: HTTP {}".format(image, e.code))
+        if scheme == 'bearer':
+            headers['Authorization'] = 'Bearer ' + get_bearer_token(challenge, repository, auth, timeout)
+        else:
+            headers['Authorization'] = basic_auth_header(auth)
+        response = head(url, headers, timeout)
+    digest = response.headers.get('Docker-Content-Digest')
+    if not digest:
+        raise RegistryError("Registry returned no digest for {}".format(image))
+    return digest
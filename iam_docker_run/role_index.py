@@ -0,0 +1,80 @@
+import os
+import time
+from . import cache_utils
+
+
+# an access key's account is looked up again after this long, and at most this many
+# access keys are kept
+ACCOUNT_MAX_AGE = 86400
+MAX_ACCOUNTS = 500
+
+
+def build_role_arn(account_id, role_name, partition='aws'):
+    """Construct the arn of a role at the root path from its name."""
+    return 'arn:{}:iam::{}:role/{}'.format(partition, account_id, role_name)
+
+
+class RoleIndex(object):
+    """Persistent index of the account each access key belongs to and of role
+    name -> role arn per account, so role names can be resolved to arns without
+    calling IAM GetRole on every run."""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or cache_utils.get_cache_dir('roles')
+
+    def _accounts_path(self):
+        return os.path.join(self.cache_dir, 'accounts.json')
+
+    def _roles_path(self, account_id):
+        return os.path.join(self.cache_dir, 'roles-{}.json'.format(account_id))
+
+    def _update(self, path, update_func):
+        with cache_utils.file_lock(path):
+            index = cache_utils.read_json(path) or {}
+            update_func(index)
+            cache_utils.write_json(path, index)
+
+    def get_account(self, access_key_id):
+        """Return a dict with the account_id and partition of an access key, if known."""
+        if not access_key_id:
+            return None
+        index = cache_utils.read_json(self._accounts_path()) or {}
+        account = index.get(cache_utils.cache_key(access_key_id))
+        if account and time.time() - account.get('added_at', 0) > ACCOUNT_MAX_AGE:
+            return None
+        return account
+
+    def put_account(self, access_key_id, account_id, partition):
+        """Add an access key's account, dropping entries older than ACCOUNT_MAX_AGE
+        and the oldest beyond MAX_ACCOUNTS, as temporary access keys change with
+        every assumed role and would otherwise pile up."""
+        now = time.time()
+
+        def update(index):
+            index[cache_utils.cache_key(access_key_id)] = {
+                'account_id': account_id, 'partition': partition, 'added_at': now}
+            for key, account in list(index.items()):
+                if now - account.get('added_at', 0) > ACCOUNT_MAX_AGE:
+                    del index[key]
+            newest = sorted(index, key=lambda key: index[key]['added_at'], reverse=True)
+            for key in newest[MAX_ACCOUNTS:]:
+                del index[key]
+        self._update(self._accounts_path(), update)
+
+    def get_role_arn(self, account_id, role_name):
+        index = cache_utils.read_json(self._roles_path(account_id)) or {}
+        return index.get(role_name)
+
+    def put_role_arn(self, account_id, role_name, role_arn):
+        if self.get_role_arn(account_id, role_name) == role_arn:
+            return
+
+        def update(index):
+            index[role_name] = role_arn
+        self._update(self._roles_path(account_id), update)
+
+    def remove_role_arn(self, account_id, role_name):
+        """Forget a role arn which could no longer be assumed."""
+        if self.get_role_arn(account_id, role_name) is None:
+            return
+        self._update(self._roles_path(account_id), lambda index: index.pop(role_name, None))
@@ -0,0 +1,193 @@
+import copy
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+from . import credential_cache
+from . import docker_cli_utils
+from . import env_assembly
+from . import iam_docker_run
+from . import timings
+from .docker_cli_utils import DockerCliUtilError
+from .iam_docker_run import LaunchError
+
+
+# options which need a terminal, replace the process or outlive the launch
+UNSUPPORTED_OPTIONS = (
+    'interactive', 'shell', 'exec_docker', 'credentials_endpoint', 'shards', 'shard_manifest')
+
+_parser_actions = None
+
+
+class ContainerStartError(LaunchError):
+    def __init__(self, message, exit_code):
+        LaunchError.__init__(self, message)
+        # docker run's exit code
+        self.exit_code = exit_code
+
+
+def get_parser_actions():
+    """The options of create_parser by dest, parsed once per process."""
+    global _parser_actions
+    if _parser_actions is None:
+        parser = iam_docker_run.create_parser()
+        _parser_actions = dict(
+            (action.dest, action) for action in parser._actions if action.dest != 'help')
+    return _parser_actions
+
+
+class LaunchSpec(object):
+    """The options of one launch, named like the destinations of the command line
+    options, e.g. LaunchSpec('busybox', role='role-ci', envvars=['A=1'], cmd='env').
+    Options which aren't given take the command line defaults."""
+
+    def __init__(self, image, **options):
+        actions = get_parser_actions()
+        unknown = sorted(set(options) - set(actions))
+        if unknown:
+            raise TypeError("Unknown launch options: {}".format(', '.join(unknown)))
+        self.options = dict((dest, copy.copy(action.default)) for dest, action in actions.items())
+        self.options.update(options)
+        self.options['image'] = image
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['options'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def replace(self, **options):
+        """A copy of the spec with the given options changed."""
+        merged = dict(self.options)
+        merged.update(options)
+        return LaunchSpec(**merged)
+
+    def to_args(self):
+        """The spec as the argparse namespace main() would have parsed, with values
+        converted to the option's type as the command line would."""
+        args = {}
+        for dest, value in self.options.items():
+            action = get_parser_actions()[dest]
+            if action.type is not None and value is not None and not isinstance(value, list):
+                value = action.type(value)
+            args[dest] = copy.copy(value)
+        return argparse.Namespace(**args)
+
+
+class RunResult(object):
+    """The outcome of Runner.run.  For a detached launch the exit code is 0 once the
+    container has started, and there is no log."""
+
+    def __init__(self, exit_code, container_name=None, container_id=None, log_path=None, spans=None):
+        self.exit_code = exit_code
+        self.container_name = container_name
+        self.container_id = container_id
+        self.log_path = log_path
+        # the timings spans recorded during the launch, see the timings module
+        self.timings = spans or []
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+    def open_log(self):
+        """Open the container's output log, each line prefixed with a timestamp and
+        the stream it was written to."""
+        if not self.log_path:
+            raise ValueError("The launch has no log")
+        return open(self.log_path, 'rb')
+
+    def __repr__(self):
+        return 'RunResult(exit_code={!r}, container_name={!r}, container_id={!r})'.format(
+            self.exit_code, self.container_name, self.container_id)
+
+
+class Runner(object):
+    """Launches containers from within a Python process, such as a test harness.
+    AWS sessions, parsed profiles and generated credentials are kept between runs,
+    so only the first launch pays for importing boto3 and calling STS.  Containers
+    are run with the docker cli, their output written to a log file per run (in
+    log_dir, by default a new temp directory) and passed through to the console
+    with echo.  run can be called from several threads at once."""
+
+    def __init__(self, log_dir=None, echo=False, verbose=False):
+        self.log_dir = log_dir or tempfile.mkdtemp(prefix='idr-runner-')
+        self.echo = echo
+        if verbose:
+            iam_docker_run.VERBOSE_MODE = True
+        self._aws_creds = {}
+        self._lock = threading.Lock()
+
+    def resolve_aws_creds(self, args, region):
+        """Credentials for the launch, reusing ones generated by an earlier run while
+        they have the minimum remaining lifetime of the credential cache."""
+        key = (args.profile, args.role, args.role_arn, region)
+        min_ttl = credential_cache.get_min_ttl(args.credential_cache_min_ttl)
+        with self._lock:
+            aws_creds = self._aws_creds.get(key)
+        if aws_creds and not args.no_credential_cache and \
+                credential_cache.parse_expiration(aws_creds['expiration']) - time.time() >= min_ttl:
+            return aws_creds
+        aws_creds = iam_docker_run.resolve_aws_creds(args, region)
+        if aws_creds.get('expiration'):
+            with self._lock:
+                self._aws_creds[key] = aws_creds
+        return aws_creds
+
+    def run(self, spec=None, **options):
+        """Launch a container, given a LaunchSpec or its options, and return a
+        RunResult once it has exited (or started, when detached).  Raises
+        LaunchError if the container can't be launched."""
+        # each run records its own timings, as runs can be made concurrently
+        with timings.recording(timings.Timings()) as run_timings:
+            result = self._run(spec if spec is not None else LaunchSpec(**options))
+        result.timings = run_timings.spans
+        return result
+
+    def _run(self, spec):
+        args = spec.to_args()
+        unsupported = [option for option in UNSUPPORTED_OPTIONS if getattr(args, option)]
+        if unsupported:
+            raise LaunchError("Runner does not support {}".format(', '.join(unsupported)))
+        region = iam_docker_run.get_region(args)
+        aws_creds = iam_docker_run.prepare_launch(args, region, self.resolve_aws_creds)
+        if args.pool:
+            exit_code = iam_docker_run.run_pool(args, aws_creds, region)
+            return RunResult(exit_code)
+
+        container_name = args.name or docker_cli_utils.random_container_name()
+        env_file = iam_docker_run.generate_temp_env_file(
+            aws_creds, region, args.custom_env_file, args.envvars)
+        try:
+            if args.detached:
+                container_id = self.start_detached(args, container_name, env_file)
+                return RunResult(0, container_name, container_id)
+            args.log_dir = args.log_dir or self.log_dir
+            with timings.phase('docker:run', detached=False):
+                try:
+                    log_path = iam_docker_run.run_container_captured(
+                        args, container_name, env_file, echo=self.echo)
+                except (IOError, OSError, ValueError) as e:
+                    raise LaunchError("Error capturing container output: {}".format(e))
+        finally:
+            env_assembly.release_env_file(env_file)
+        try:
+            container_id, exit_code = docker_cli_utils.get_container_state(container_name)
+            docker_cli_utils.remove_docker_container(container_name)
+        except DockerCliUtilError as e:
+            raise LaunchError(str(e))
+        return RunResult(exit_code, container_name, container_id, log_path)
+
+    def start_detached(self, args, container_name, env_file):
+        """Start the container detached and return its id."""
+        docker_args = iam_docker_run.build_docker_run_args(args, container_name, env_file, remove=False)
+        with timings.phase('docker:run', detached=True):
+            p = subprocess.Popen(
+                docker_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                env=iam_docker_run.get_docker_env(args), **env_assembly.popen_kwargs(env_file))
+            output, error = p.communicate()
+        if p.returncode != 0:
+            raise ContainerStartError("Error starting container {} (docker exit code {}): {}".format(
+                container_name, p.returncode, error.decode('utf-8').strip()), p.returncode)
+        return output.decode('utf-8').strip()
@@ -0,0 +1,124 @@
+import os
+import threading
+from collections import OrderedDict
+import boto3
+import botocore.config
+import botocore.loaders
+import botocore.session
+
+
+# a long running idr daemon sees new credentials for every CI job and every
+# refreshed role, so only the most recently used sessions are kept
+MAX_SESSIONS = 32
+
+_lock = threading.RLock()
+_loader = None
+_sessions = OrderedDict()
+# clients per (id of a pooled session, service, region), dropped with their session
+_clients = {}
+# botocore http sessions (and so their keep-alive connection pools) per endpoint
+_http_sessions = {}
+# retries are made by aws_retry, which backs off across every process on the host
+_client_config = botocore.config.Config(retries={'max_attempts': 0})
+
+
+def get_sts_endpoint_url(region):
+    """The regional STS endpoint, which is faster to reach than the global one from
+    outside us-east-1.  Can be overridden with IAM_DOCKER_RUN_STS_ENDPOINT_URL."""
+    endpoint_url = os.environ.get('IAM_DOCKER_RUN_STS_ENDPOINT_URL', None)
+    if endpoint_url or not region:
+        return endpoint_url
+    suffix = 'amazonaws.com.cn' if region.startswith('cn-') else 'amazonaws.com'
+    return 'https://sts.{}.{}'.format(region, suffix)
+
+
+def get_endpoint_url(service_name, region):
+    if service_name == 'sts':
+        return get_sts_endpoint_url(region)
+    return os.environ.get('IAM_DOCKER_RUN_{}_ENDPOINT_URL'.format(service_name.upper()), None)
+
+
+def _get_loader():
+    """One botocore loader for every session, so service models are read and parsed
+    from disk once per process rather than once per session."""
+    global _loader
+    if _loader is None:
+        _loader = botocore.loaders.create_loader()
+    return _loader
+
+
+def _new_botocore_session():
+    botocore_session = botocore.session.get_session()
+    botocore_session.register_component('data_loader', _get_loader())
+    return botocore_session
+
+
+def get_session(aws_creds=None, profile_name=None):
+    """Return a boto3 session for the given credentials or profile (or the default
+    credential chain when neither is given), reusing one created earlier."""
+    if aws_creds:
+        key = ('creds', aws_creds['AWS_ACCESS_KEY_ID'],
+               aws_creds['AWS_SECRET_ACCESS_KEY'], aws_creds.get('AWS_SESSION_TOKEN'))
+    else:
+        key = ('profile', profile_name)
+    with _lock:
+        session = _sessions.pop(key, None)
+        if session is None:
+            if aws_creds:
+                session = boto3.Session(
+                    aws_access_key_id=aws_creds['AWS_ACCESS_KEY_ID'],
+                    aws_secret_access_key=aws_creds['AWS_SECRET_ACCESS_KEY'],
+                    aws_session_token=aws_creds.get('AWS_SESSION_TOKEN'),
+                    botocore_session=_new_botocore_session(),
+                )
+            else:
+                session = boto3.Session(
+                    profile_name=profile_name,
+                    botocore_session=_new_botocore_session(),
+                )
+        _sessions[key] = session
+        while len(_sessions) > MAX_SESSIONS:
+            _evict(_sessions.popitem(last=False)[1])
+    return session
+
+
+def _evict(session):
+    """Drop the session's clients.  Their connection pools are shared per endpoint
+    and stay open for the other clients."""
+    for key in [key for key in _clients if key[0] == id(session)]:
+        del _clients[key]
+
+
+def _share_http_session(client, endpoint_url):
+    """Point the client at the http session already used for this endpoint, so each
+    hop of a chain of assume role calls reuses the same keep-alive connection even
+    though every hop signs with different credentials.  botocore has no public way
+    to share connections between clients with different credentials, so this
+    relies on its endpoint's http_session, and does nothing if that changes."""
+    endpoint = getattr(client, '_endpoint', None)
+    http_session = getattr(endpoint, 'http_session', None)
+    if http_session is None or not hasattr(http_session, 'close'):
+        return
+    shared = _http_sessions.setdefault(endpoint_url, http_session)
+    if shared is not http_session:
+        # the client's own pool has never been used, close it rather than leave it open
+        http_session.close()
+        endpoint.http_session = shared
+
+
+def get_client(session, service_name, region=None):
+    """Return a client for the service from the session, creating it only once
+    while the session is pooled."""
+    key = (id(session), service_name, region)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            endpoint_url = get_endpoint_url(service_name, region)
+            client = session.client(
+                service_name, region_name=region, endpoint_url=endpoint_url,
+                config=_client_config)
+            _share_http_session(client, client.meta.endpoint_url)
+            # an evicted session's id could be reused by a new one, so don't cache its clients
+            if any(pooled is session for pooled in _sessions.values()):
+                _clients[key] = client
+    return client
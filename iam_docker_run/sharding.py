@@ -0,0 +1,130 @@
+from __future__ import print_function
+import os
+import sys
+import threading
+import multiprocessing
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from . import env_assembly
+from . import iam_docker_run
+
+
+class ShardManifestError(Exception):
+    pass
+
+
+def read_shard_manifest(path):
+    """Each non-blank, non-comment line of the manifest describes one shard and is
+    passed to that shard's container as SHARD_SPEC."""
+    try:
+        with open(path, 'r') as f:
+            lines = [line.strip() for line in f.read().splitlines()]
+    except (IOError, OSError) as e:
+        raise ShardManifestError("Error reading shard manifest {}: {}".format(path, e))
+    specs = [line for line in lines if line and not line.startswith('#')]
+    if not specs:
+        raise ShardManifestError("Shard manifest {} does not list any shards".format(path))
+    return specs
+
+
+def get_shard_specs(args):
+    """Return a list with one entry per shard, the manifest line or None."""
+    if args.shard_manifest:
+        return read_shard_manifest(args.shard_manifest)
+    return [None] * args.shards
+
+
+class ShardRunner(object):
+    """Runs one container per shard from a bounded pool of workers, all sharing the
+    credentials fetched once by the caller."""
+
+    def __init__(self, args, container_name, aws_creds, region, shard_specs, max_workers=None):
+        self.args = args
+        self.container_name = container_name
+        self.aws_creds = aws_creds
+        self.region = region
+        self.shard_specs = shard_specs
+        self.max_workers = max_workers or min(len(shard_specs), multiprocessing.cpu_count())
+        self._output_lock = threading.Lock()
+        self._container_names = []
+
+    def shard_container_name(self, index):
+        return '{}-shard-{}'.format(self.container_name, index)
+
+    def write(self, index, line):
+        with self._output_lock:
+            sys.stdout.write('[shard {}] {}\n'.format(index, line))
+            sys.stdout.flush()
+
+    def run_shard(self, index):
+        shard_count = len(self.shard_specs)
+        shard_envs = [
+            'SHARD_INDEX={}'.format(index),
+            'SHARD_COUNT={}'.format(shard_count),
+        ]
+        if self.shard_specs[index] is not None:
+            shard_envs.append('SHARD_SPEC={}'.format(self.shard_specs[index]))
+        env_tmpfile = iam_docker_run.generate_temp_env_file(
+            self.aws_creds,
+            self.region,
+            self.args.custom_env_file,
+            (self.args.envvars or []) + shard_envs)
+        container_name = self.shard_container_name(index)
+        self._container_names.append(container_name)
+        try:
+            docker_run_args = iam_docker_run.build_docker_run_args(
+                self.args, container_name, env_tmpfile)
+            self.write(index, ' '.join(docker_run_args))
+            p = subprocess.Popen(
+                docker_run_args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                env=iam_docker_run.get_docker_env(self.args), **env_assembly.popen_kwargs(env_tmpfile))
+            for line in iter(p.stdout.readline, b''):
+                self.write(index, line.decode('utf-8', 'replace').rstrip('\n'))
+            p.stdout.close()
+            exit_code = p.wait()
+            self.write(index, 'Container exited with code {}'.format(exit_code))
+            return exit_code
+        finally:
+            env_assembly.release_env_file(env_tmpfile)
+
+    def remove_containers(self):
+        """Force remove any shard container still around, e.g. after ctrl-c."""
+        if not self._container_names:
+            return
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(
+                ['docker', 'rm', '-f'] + self._container_names,
+                stdout=devnull, stderr=devnull)
+
+    def run(self):
+        """Run every shard, returning the list of exit codes in shard order."""
+        print("Running {} shards, {} at a time".format(
+            len(self.shard_specs), self.max_workers))
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = []
+        try:
+            futures = [executor.submit(self.run_shard, index)
+                       for index in range(len(self.shard_specs))]
+            exit_codes = []
+            for index, future in enumerate(futures):
+                try:
+                    exit_codes.append(future.result())
+                except Exception as e:
+                    self.write(index, 'Error running shard: {}'.format(e))
+                    exit_codes.append(1)
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            self.remove_containers()
+            raise
+        finally:
+            executor.shutdown(wait=True)
+        return exit_codes
+
+
+def aggregate_exit_code(exit_codes):
+    """The first failing shard's exit code, or 0 if every shard passed."""
+    for exit_code in exit_codes:
+        if exit_code:
+            return exit_code
+    return 0
@@ -33,3 +33,13 @@ def exec_command(command):
             stoutdata, sterrdata, str(e)))
         return 1, stoutdata
     return p.returncode, stoutdata
+
+
+def call_quietly(args):
+    """Run a command (given as an argument list) discarding its output, and return
+    its exit code."""
+    with open(os.devnull, 'w') as devnull:
+        try:
+            return subprocess.call(args, stdout=devnull, stderr=devnull)
+        except OSError:
+            return 127
@@ -0,0 +1,324 @@
+from __future__ import print_function
+import os
+import json
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from . import docker_cli_utils
+from . import ecr_auth
+from . import env_assembly
+from . import iam_docker_run
+from .docker_cli_utils import DockerCliUtilError
+from .image_index import PullPolicyError
+from .aws_util_exceptions import ProfileParsingError, RoleNotFoundError, AssumeRoleError
+
+
+STACK_LABEL = 'iam-docker-run.stack'
+SERVICE_LABEL = 'iam-docker-run.service'
+DEFAULT_SPEC_FILE = 'stack.yml'
+DEFAULT_PARALLELISM = 8
+BUILTIN_NETWORKS = ('host', 'bridge', 'none', 'default')
+# options set by the stack itself, which services can't give
+STACK_OPTIONS = (
+    'name', 'network', 'detached', 'interactive', 'shell', 'exec-docker', 'pool',
+    'shards', 'shard-manifest', 'credentials-endpoint', 'log-dir')
+
+
+class StackError(Exception):
+    pass
+
+
+def load_spec(path):
+    """Read a stack spec from a YAML or JSON file."""
+    try:
+        with open(path, 'r') as f:
+            content = f.read()
+    except (IOError, OSError) as e:
+        raise StackError("Error reading stack spec {}: {}".format(path, e))
+    try:
+        if path.endswith('.json'):
+            spec = json.loads(content)
+        else:
+            try:
+                import yaml
+            except ImportError:
+                # json is also valid yaml
+                try:
+                    spec = json.loads(content)
+                except ValueError:
+                    raise StackError("Reading {} needs PyYAML (pip install pyyaml), or write the stack spec as json".format(path))
+            else:
+                spec = yaml.safe_load(content)
+    except StackError:
+        raise
+    except Exception as e:
+        raise StackError("Error parsing stack spec {}: {}".format(path, e))
+    if not isinstance(spec, dict) or not isinstance(spec.get('services'), dict) or not spec['services']:
+        raise StackError("Stack spec {} has no services".format(path))
+    return spec
+
+
+def get_stack_name(spec, path):
+    """The stack's name, from the spec or else the directory holding the spec file."""
+    return spec.get('name') or os.path.basename(os.path.dirname(os.path.abspath(path)))
+
+
+def get_start_order(services):
+    """Group the services into waves, each wave only depending on earlier ones, so
+    the services of a wave can be started at the same time."""
+    remaining = {}
+    for name, service in services.items():
+        depends_on = set((service or {}).get('depends_on') or [])
+        unknown = depends_on - set(services)
+        if unknown:
+            raise StackError("Service {} depends on unknown services {}".format(
+                name, ', '.join(sorted(unknown))))
+        remaining[name] = depends_on
+    waves = []
+    started = set()
+    while remaining:
+        wave = sorted(name for name, depends_on in remaining.items() if depends_on <= started)
+        if not wave:
+            raise StackError("Services {} have a depends_on cycle".format(', '.join(sorted(remaining))))
+        waves.append(wave)
+        started.update(wave)
+        for name in wave:
+            del remaining[name]
+    return waves
+
+
+def service_argv(service_name, service):
+    """Translate a service's options, named like the iam-docker-run command line
+    options, into command line arguments."""
+    argv = []
+    for key, value in sorted(service.items()):
+        option = key.replace('_', '-')
+        if option == 'depends-on':
+            continue
+        if option in STACK_OPTIONS:
+            raise StackError("Service {} can't set {}, it is set by the stack".format(service_name, key))
+        if option == 'env':
+            # a mapping of name -> value, in addition to envvar
+            if isinstance(value, dict):
+                value = ['{}={}'.format(name, env_value) for name, env_value in sorted(value.items())]
+            option = 'envvar'
+        if value is True:
+            argv.append('--' + option)
+        elif value is False or value is None:
+            continue
+        else:
+            # --option=value, so values starting with - aren't taken for options
+            for item in value if isinstance(value, list) else [value]:
+                argv.append('--{}={}'.format(option, item))
+    return argv
+
+
+def parse_service_args(stack_name, network, service_name, service, defaults=None):
+    """The parsed iam-docker-run arguments for a service, which is started detached
+    on the stack's network."""
+    if not isinstance(service, dict) or not service.get('image'):
+        raise StackError("Service {} has no image".format(service_name))
+    options = dict(defaults or {})
+    options.update(service)
+    parser = iam_docker_run.create_parser()
+    known = set(option for action in parser._actions for option in action.option_strings)
+    argv = service_argv(service_name, options)
+    unknown = [arg.split('=', 1)[0][2:] for arg in argv if arg.split('=', 1)[0] not in known]
+    if unknown:
+        raise StackError("Service {} has unknown options {}".format(service_name, ', '.join(unknown)))
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit:
+        # argparse has printed the problem
+        raise StackError("Service {} has invalid options".format(service_name))
+    if args.build:
+        raise StackError("Service {} uses build, which idr up doesn't support".format(service_name))
+    args.detached = True
+    args.network = network
+    args.name = get_container_name(stack_name, service_name)
+    return args
+
+
+def get_container_name(stack_name, service_name):
+    return '{}-{}'.format(stack_name, service_name)
+
+
+def credentials_key(args):
+    return (args.profile, args.role, args.role_arn, iam_docker_run.get_region(args))
+
+
+def resolve_credentials(args):
+    """Generate the credentials for the services sharing the args' profile and role."""
+    if not args.profile and not args.role and not args.role_arn:
+        return {}
+    region = iam_docker_run.get_region(args)
+    try:
+        return iam_docker_run.generate_aws_creds(args, region)
+    except (ProfileParsingError, RoleNotFoundError, AssumeRoleError) as e:
+        raise StackError(iam_docker_run.describe_credential_error(e, args, region))
+
+
+def start_service(stack_name, service_name, args, aws_creds):
+    """Start the service's container, detached, returning how long it took."""
+    started = time.time()
+    env_file = iam_docker_run.generate_temp_env_file(
+        aws_creds, iam_docker_run.get_region(args), args.custom_env_file, args.envvars)
+    try:
+        docker_args = iam_docker_run.build_docker_run_args(args, args.name, env_file, remove=False)
+        docker_args[2:2] = [
+            '--label', '{}={}'.format(STACK_LABEL, stack_name),
+            '--label', '{}={}'.format(SERVICE_LABEL, service_name),
+        ]
+        if args.network not in BUILTIN_NETWORKS:
+            # services reach each other by service name
+            docker_args[2:2] = ['--network-alias', service_name]
+        with open(os.devnull, 'w') as devnull:
+            p = subprocess.Popen(
+                docker_args, stdout=devnull, stderr=subprocess.PIPE,
+                env=iam_docker_run.get_docker_env(args), **env_assembly.popen_kwargs(env_file))
+            _, error = p.communicate()
+    finally:
+        env_assembly.release_env_file(env_file)
+    if p.returncode != 0:
+        raise StackError("Error starting service {} (docker exit code {}): {}".format(
+            service_name, p.returncode, error.decode('utf-8').strip()))
+    return time.time() - started
+
+
+def run_concurrently(executor, func, items):
+    """Call func(item) for each item on the executor, returning [(item, result or
+    exception)] in the order of items."""
+    futures = [(item, executor.submit(func, item)) for item in items]
+    results = []
+    for item, future in futures:
+        try:
+            results.append((item, future.result()))
+        except Exception as e:
+            results.append((item, e))
+    return results
+
+
+def remove_stack_containers(executor, stack_name):
+    """Remove the stack's containers in parallel and return their names."""
+    names = docker_cli_utils.list_containers(
+        '{}={}'.format(STACK_LABEL, stack_name), include_stopped=True)
+    run_concurrently(executor, lambda name: docker_cli_utils.force_remove_containers([name]), names)
+    return names
+
+
+def stack_up(spec, stack_name, parallelism=DEFAULT_PARALLELISM):
+    """Start the stack's services, returning the exit code."""
+    network = spec.get('network') or stack_name
+    waves = get_start_order(spec['services'])
+    services = dict(
+        (service_name, parse_service_args(
+            stack_name, network, service_name, service, spec.get('defaults')))
+        for service_name, service in spec['services'].items())
+
+    executor = ThreadPoolExecutor(max_workers=max(1, parallelism))
+    try:
+        # each distinct role is only resolved once, at the same time as the images are pulled
+        credentials_args = dict((credentials_key(args), args) for args in services.values())
+        image_args = dict((args.image, args) for args in services.values())
+        credential_futures = dict(
+            (key, executor.submit(resolve_credentials, args))
+            for key, args in credentials_args.items())
+
+        def ensure_image(args):
+            # images in ECR wait for their credentials to log in to the registry, which
+            # can't deadlock as the credentials were submitted to the executor first
+            if ecr_auth.parse_ecr_image(args.image):
+                return iam_docker_run.ensure_registry_image(
+                    args, credential_futures[credentials_key(args)].result)
+            return iam_docker_run.ensure_image(args)
+
+        for _, result in run_concurrently(executor, ensure_image, list(image_args.values())):
+            if isinstance(result, PullPolicyError):
+                raise StackError(str(result))
+        # services sharing an image start with the docker config its registry login gave
+        for args in services.values():
+            args.docker_config = getattr(image_args[args.image], 'docker_config', None)
+        aws_creds = {}
+        for key, future in credential_futures.items():
+            aws_creds[key] = future.result()
+
+        removed = remove_stack_containers(executor, stack_name)
+        if removed:
+            print("Removed {} existing containers of stack {}".format(len(removed), stack_name))
+        if network not in BUILTIN_NETWORKS and not docker_cli_utils.network_exists(network):
+            docker_cli_utils.create_network(network, ['{}={}'.format(STACK_LABEL, stack_name)])
+            print("Created network {}".format(network))
+
+        for wave in waves:
+            results = run_concurrently(
+                executor,
+                lambda service_name: start_service(
+                    stack_name, service_name, services[service_name],
+                    aws_creds[credentials_key(services[service_name])]),
+                wave)
+            failed = False
+            for service_name, result in results:
+                if isinstance(result, Exception):
+                    failed = True
+                    print(result)
+                else:
+                    print("Started {} ({}) in {:.2f}s".format(
+                        services[service_name].name, service_name, result))
+            if failed:
+                print("Not starting the remaining services, run idr down to remove the stack")
+                return 1
+    finally:
+        executor.shutdown(wait=True)
+    return 0
+
+
+def stack_down(spec, stack_name, parallelism=DEFAULT_PARALLELISM):
+    """Remove the stack's containers in parallel, then its network if the stack created it."""
+    executor = ThreadPoolExecutor(max_workers=max(1, parallelism))
+    try:
+        removed = remove_stack_containers(executor, stack_name)
+    finally:
+        executor.shutdown(wait=True)
+    for name in sorted(removed):
+        print("Removed {}".format(name))
+    network = spec.get('network') or stack_name
+    if docker_cli_utils.get_network_label(network, STACK_LABEL) == stack_name:
+        if docker_cli_utils.remove_network(network):
+            print("Removed network {}".format(network))
+    return 0
+
+
+def create_stack_parser(command, description):
+    parser = argparse.ArgumentParser(prog='idr {}'.format(command), description=description)
+    parser.add_argument('-f', '--file', default=DEFAULT_SPEC_FILE,
+                        help='The stack spec, YAML or JSON (default {})'.format(DEFAULT_SPEC_FILE))
+    parser.add_argument('--name', required=False,
+                        help='The stack name, overriding the spec (default: the name in the spec, or its directory name)')
+    parser.add_argument('--parallelism', type=int, default=DEFAULT_PARALLELISM,
+                        help='Maximum number of containers started or removed at once (default {})'.format(
+                            DEFAULT_PARALLELISM))
+    parser.add_argument('--verbose', action='store_true', default=False)
+    return parser
+
+
+def run_stack_command(command, description, func, argv):
+    args = create_stack_parser(command, description).parse_args(argv)
+    if args.verbose:
+        iam_docker_run.VERBOSE_MODE = True
+    try:
+        spec = load_spec(args.file)
+        return func(spec, args.name or get_stack_name(spec, args.file), args.parallelism)
+    except (StackError, DockerCliUtilError) as e:
+        print(e)
+        return 1
+
+
+def up_main(argv):
+    return run_stack_command(
+        'up', 'Start the services of a stack spec, sharing resolved credentials', stack_up, argv)
+
+
+def down_main(argv):
+    return run_stack_command(
+        'down', 'Remove the containers and network of a stack', stack_down, argv)
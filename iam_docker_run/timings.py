@@ -0,0 +1,167 @@
+import os
+import json
+import binascii
+import time
+import threading
+import contextlib
+
+
+SERVICE_NAME = 'iam-docker-run'
+DEFAULT_OTLP_ENDPOINT = 'http://localhost:4318/v1/traces'
+
+
+def random_hex(size):
+    return binascii.hexlify(os.urandom(size)).decode('ascii')
+
+
+class Timings(object):
+    """Records how long each phase of a launch takes, for the --timings report."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, name, start, end, error=None, **attributes):
+        span = {
+            'name': name,
+            'start': start,
+            'end': end,
+            'duration': end - start,
+            'thread': threading.current_thread().name,
+            'attributes': attributes,
+        }
+        if error is not None:
+            span['error'] = error
+        with self._lock:
+            self.spans.append(span)
+
+    @contextlib.contextmanager
+    def phase(self, name, **attributes):
+        start = time.time()
+        try:
+            yield
+        except BaseException as e:
+            self.record(name, start, time.time(), error=type(e).__name__, **attributes)
+            raise
+        self.record(name, start, time.time(), **attributes)
+
+    def format_table(self):
+        total = time.time() - self.started
+        lines = ['{:<32} {:>10} {:>10}'.format('phase', 'start (s)', 'took (s)')]
+        for span in sorted(self.spans, key=lambda s: s['start']):
+            name = span['name']
+            if 'error' in span:
+                name += ' ({})'.format(span['error'])
+            lines.append('{:<32} {:>10.3f} {:>10.3f}'.format(
+                name, span['start'] - self.started, span['duration']))
+        lines.append('{:<32} {:>10} {:>10.3f}'.format('total', '', total))
+        return '\n'.join(lines)
+
+    def write_file(self, path):
+        """Write the spans as one json document, or as newline delimited json when
+        the file name ends in .ndjson or .jsonl."""
+        if path.endswith(('.ndjson', '.jsonl')):
+            with open(path, 'a') as f:
+                for span in self.spans:
+                    f.write(json.dumps(span) + '\n')
+        else:
+            with open(path, 'w') as f:
+                json.dump({
+                    'started': self.started,
+                    'total': time.time() - self.started,
+                    'spans': self.spans,
+                }, f, indent=2)
+
+    def to_otlp(self):
+        """Convert the spans to an OTLP/HTTP json trace export request, as children
+        of one root span covering the whole launch."""
+        trace_id = random_hex(16)
+
+        def nanos(seconds):
+            return str(int(seconds * 1e9))
+
+        root_id = random_hex(8)
+        spans = [{
+            'traceId': trace_id,
+            'spanId': root_id,
+            'name': 'launch',
+            'kind': 1,
+            'startTimeUnixNano': nanos(self.started),
+            'endTimeUnixNano': nanos(time.time()),
+        }]
+        for span in self.spans:
+            otlp_span = {
+                'traceId': trace_id,
+                'spanId': random_hex(8),
+                'parentSpanId': root_id,
+                'name': span['name'],
+                'kind': 1,
+                'startTimeUnixNano': nanos(span['start']),
+                'endTimeUnixNano': nanos(span['end']),
+                'attributes': [
+                    {'key': key, 'value': {'stringValue': str(value)}}
+                    for key, value in sorted(span['attributes'].items())
+                ],
+            }
+            if 'error' in span:
+                otlp_span['status'] = {'code': 2, 'message': span['error']}
+            spans.append(otlp_span)
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': [
+                    {'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+                'scopeSpans': [{'scope': {'name': SERVICE_NAME}, 'spans': spans}],
+            }]
+        }
+
+    def export_otlp(self, endpoint=DEFAULT_OTLP_ENDPOINT, timeout=2):
+        try:
+            from urllib.request import Request, urlopen
+        except ImportError:  # python 2
+            from urllib2 import Request, urlopen
+        request = Request(
+            endpoint,
+            data=json.dumps(self.to_otlp()).encode('utf-8'),
+            headers={'Content-Type': 'application/json'})
+        urlopen(request, timeout=timeout).read()
+
+
+# the timings of the current launch
+recorder = Timings()
+_local = threading.local()
+
+
+def thread_recorder():
+    """The Timings given to recording() on this thread, if any."""
+    return getattr(_local, 'recorder', None)
+
+
+def current():
+    """The Timings phases run on this thread are recorded in: the one given to
+    recording(), otherwise the process wide recorder."""
+    return thread_recorder() or recorder
+
+
+@contextlib.contextmanager
+def recording(timings):
+    """Record the phases run on this thread in timings rather than the process wide
+    recorder, for callers timing one of several concurrent launches or requests.
+    None records in the process wide recorder again."""
+    previous = getattr(_local, 'recorder', None)
+    _local.recorder = timings
+    try:
+        yield timings
+    finally:
+        _local.recorder = previous
+
+
+def phase(name, **attributes):
+    """Time a block of code as a phase of the current launch."""
+    return current().phase(name, **attributes)
+
+
+def reset():
+    global recorder
+    recorder = Timings()
+    return recorder
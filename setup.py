@@ -6,7 +6,8 @@ from setuptools import setup, find_packages
 
 requires = [
     'boto3>=1.7.20, <2.0',
-    'botocore>=1.10.20, <2.0'
+    'botocore>=1.10.20, <2.0',
+    'futures>=3.0; python_version < "3"'
 ]
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -36,7 +37,11 @@ setup(name=about['__title__'],
       entry_points={
         "console_scripts": [
             'iam-docker-run = iam_docker_run.iam_docker_run:main',
-            'idr = iam_docker_run.iam_docker_run:main'
+            'idr = iam_docker_run.iam_docker_run:main',
+            'docker-credential-idr = iam_docker_run.ecr_auth:main'
+        ],
+        "pytest11": [
+            'iam_docker_run = iam_docker_run.pytest_plugin'
         ]
         },
       license='MIT',
@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from iam_docker_run import aws_profiles
+from iam_docker_run import credential_cache
+from iam_docker_run.aws_util_exceptions import ProfileParsingError
+
+
+AWS_CONFIG = """[default]
+region = us-east-1
+
+[profile base]
+role_arn = arn:aws:iam::111111111111:role/base
+source_profile = keys
+
+[profile app]
+role_arn = arn:aws:iam::222222222222:role/app
+source_profile = base
+external_id = app-external-id
+
+[profile process]
+credential_process = {python} {script}
+
+[profile session]
+aws_access_key_id = ASIASESSION
+aws_secret_access_key = session-secret
+aws_session_token = session-token
+
+[profile loop-a]
+role_arn = arn:aws:iam::111111111111:role/a
+source_profile = loop-b
+
+[profile loop-b]
+role_arn = arn:aws:iam::111111111111:role/b
+source_profile = loop-a
+"""
+AWS_CREDENTIALS = """[keys]
+aws_access_key_id = AKIAKEYS
+aws_secret_access_key = keys-secret
+"""
+CREDENTIAL_PROCESS = """import json, os
+count_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'count')
+count = int(open(count_path).read()) if os.path.exists(count_path) else 0
+open(count_path, 'w').write(str(count + 1))
+print(json.dumps({
+    'Version': 1,
+    'AccessKeyId': 'ASIAPROCESS',
+    'SecretAccessKey': 'process-secret',
+    'SessionToken': 'process-token',
+    'Expiration': '2099-01-01T00:00:00.000+00:00',
+}))
+"""
+
+
+class TestAwsProfiles(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._script = os.path.join(self._temp_dir, 'credential_process.py')
+        with open(self._script, 'w') as f:
+            f.write(CREDENTIAL_PROCESS)
+        self._config_path = os.path.join(self._temp_dir, 'config')
+        with open(self._config_path, 'w') as f:
+            f.write(AWS_CONFIG.format(python=sys.executable, script=self._script))
+        self._credentials_path = os.path.join(self._temp_dir, 'credentials')
+        with open(self._credentials_path, 'w') as f:
+            f.write(AWS_CREDENTIALS)
+        self._environ = dict(os.environ)
+        os.environ['AWS_CONFIG_FILE'] = self._config_path
+        os.environ['AWS_SHARED_CREDENTIALS_FILE'] = self._credentials_path
+        self._profiles = aws_profiles.ProfileIndex(self._temp_dir).load()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environ)
+        shutil.rmtree(self._temp_dir)
+
+    def test_resolves_multi_hop_chain(self):
+        source, role_hops = aws_profiles.resolve_profile_chain(self._profiles, 'app')
+        self.assertEqual(source['type'], 'static')
+        self.assertEqual(source['AWS_ACCESS_KEY_ID'], 'AKIAKEYS')
+        self.assertEqual(source['AWS_SECRET_ACCESS_KEY'], 'keys-secret')
+        self.assertIsNone(source['AWS_SESSION_TOKEN'])
+        self.assertEqual([hop['profile'] for hop in role_hops], ['base', 'app'])
+        self.assertEqual(role_hops[1]['external_id'], 'app-external-id')
+
+    def test_reads_secrets_from_the_config_file(self):
+        source, _ = aws_profiles.resolve_profile_chain(self._profiles, 'session')
+        self.assertEqual(
+            (source['AWS_SECRET_ACCESS_KEY'], source['AWS_SESSION_TOKEN']), ('session-secret', 'session-token'))
+        self.assertNotIn('aws_session_token', self._profiles['session'])
+
+    def test_secrets_are_parsed_again_only_once_their_file_changes(self):
+        parsed = []
+        read_config_file = aws_profiles.read_config_file
+        aws_profiles.read_config_file = lambda path: parsed.append(path) or read_config_file(path)
+        try:
+            for _ in range(2):
+                source, _ = aws_profiles.resolve_profile_chain(self._profiles, 'keys')
+                self.assertEqual(source['AWS_SECRET_ACCESS_KEY'], 'keys-secret')
+            self.assertEqual(parsed, [self._credentials_path])
+            with open(self._credentials_path, 'w') as f:
+                f.write(AWS_CREDENTIALS.replace('keys-secret', 'rotated-secret'))
+            profiles = aws_profiles.ProfileIndex(self._temp_dir).load()
+            source, _ = aws_profiles.resolve_profile_chain(profiles, 'keys')
+            self.assertEqual(source['AWS_SECRET_ACCESS_KEY'], 'rotated-secret')
+        finally:
+            aws_profiles.read_config_file = read_config_file
+
+    def test_detects_source_profile_cycle(self):
+        with self.assertRaises(ProfileParsingError):
+            aws_profiles.resolve_profile_chain(self._profiles, 'loop-a')
+
+    def test_index_is_reused_until_a_file_changes(self):
+        aws_profiles._profiles.clear()
+        index = aws_profiles.ProfileIndex(self._temp_dir)
+        with open(index._index_path()) as f:
+            indexed = f.read()
+        self.assertIn('app', json.loads(indexed)['profiles'])
+        # secrets are read from the credentials file, never copied to the index
+        self.assertIn('AKIAKEYS', indexed)
+        self.assertNotIn('keys-secret', indexed)
+        with open(self._credentials_path, 'a') as f:
+            f.write('\n[more]\naws_access_key_id = AKIAMORE\n')
+        self.assertIn('more', index.load())
+
+    def test_credential_process_output_is_cached_until_expiration(self):
+        source, role_hops = aws_profiles.resolve_profile_chain(self._profiles, 'process')
+        self.assertEqual(role_hops, [])
+        cache = credential_cache.CredentialCache(tempfile.mkdtemp(dir=self._temp_dir))
+        for _ in range(2):
+            aws_creds = aws_profiles.get_credential_process_creds(source['command'], cache)
+            self.assertEqual(aws_creds['AWS_ACCESS_KEY_ID'], 'ASIAPROCESS')
+            self.assertEqual(aws_creds['expiration'], '2099-01-01T00:00:00Z')
+        with open(os.path.join(self._temp_dir, 'count')) as f:
+            self.assertEqual(f.read(), '1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import shutil
+import tempfile
+import unittest
+from botocore.exceptions import ClientError
+from iam_docker_run import aws_retry
+
+
+def client_error(code, status=400):
+    return ClientError(
+        {'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status}},
+        'AssumeRole')
+
+
+class FlakyApi(object):
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return kwargs
+
+
+class TestAwsRetry(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._bucket = aws_retry.TokenBucket(self._temp_dir, rate=10.0, burst=2.0)
+        self._policy = aws_retry.RetryPolicy(max_attempts=3, base_delay=0)
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_retries_throttling_and_transient_errors(self):
+        api = FlakyApi([client_error('Throttling'), client_error('InternalError', 500)])
+        result = aws_retry.call(
+            'sts:AssumeRole', api, policy=self._policy, bucket=self._bucket, RoleArn='arn')
+        self.assertEqual((result, api.calls), ({'RoleArn': 'arn'}, 3))
+        # throttling halved the host-wide rate
+        self.assertLess(self._bucket._last_rate, 10.0)
+
+    def test_raises_other_errors_and_when_attempts_run_out(self):
+        api = FlakyApi([client_error('AccessDenied', 403)])
+        with self.assertRaises(ClientError):
+            aws_retry.call('sts:AssumeRole', api, policy=self._policy, bucket=self._bucket)
+        self.assertEqual(api.calls, 1)
+        api = FlakyApi([client_error('Throttling')] * 3)
+        with self.assertRaises(ClientError):
+            aws_retry.call('sts:AssumeRole', api, policy=self._policy, bucket=self._bucket)
+        self.assertEqual(api.calls, 3)
+
+    def test_token_bucket_is_shared_through_the_cache_dir(self):
+        other = aws_retry.TokenBucket(self._temp_dir, rate=10.0, burst=2.0)
+        self.assertEqual(self._bucket.reserve(), 0)
+        self.assertEqual(other.reserve(), 0)
+        # the burst is used up, the next token arrives in 1 / rate seconds
+        self.assertAlmostEqual(self._bucket.reserve(), 0.1, delta=0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import unittest
+import threading
+from fake_docker import FakeDockerTestCase
+from iam_docker_run import cache_utils
+from iam_docker_run import container_pool
+
+
+# keeps the names of "running" containers as files in $FAKE_DOCKER_STATE
+FAKE_DOCKER = """#!/bin/sh
+case "$1" in
+  ps) ls "$FAKE_DOCKER_STATE" ;;
+  rm) shift; shift; for name in "$@"; do rm -f "$FAKE_DOCKER_STATE/$name"; done ;;
+esac
+exit 0
+"""
+
+
+class TestContainerPool(FakeDockerTestCase):
+    fake_docker = FAKE_DOCKER
+
+    def setUp(self):
+        FakeDockerTestCase.setUp(self)
+        self._pool = container_pool.ContainerPool(self._temp_dir, idle_timeout=600)
+        self._created = []
+
+    def create(self, name):
+        open(os.path.join(self._state_dir, name), 'w').close()
+        self._created.append(name)
+        return {'image': 'busybox', 'entrypoint': [], 'cmd': ['sh']}
+
+    def test_reuses_released_container_and_grows_to_size_when_busy(self):
+        name, _ = self._pool.acquire('key', 2, self.create)
+        self._pool.release(name)
+        self.assertEqual(self._pool.acquire('key', 2, self.create)[0], name)
+        # still held by this process, so a second container is started
+        second, _ = self._pool.acquire('key', 2, self.create)
+        self.assertNotEqual(second, name)
+        # at the size limit the busy containers are shared
+        shared, _ = self._pool.acquire('key', 2, self.create)
+        self.assertEqual(shared, name)
+        self.assertEqual(len(self._created), 2)
+        # still in use by the other holder once one releases it
+        self._pool.release(shared)
+        self.assertTrue(self._pool.in_use(self._pool.containers()[name]))
+        self._pool.release(shared)
+        self.assertFalse(self._pool.in_use(self._pool.containers()[name]))
+
+    def test_containers_are_started_without_holding_the_lock(self):
+        locked = []
+
+        def create(name):
+            # another launch can take the pool's lock meanwhile
+            def lock():
+                with cache_utils.file_lock(self._pool._state_path()):
+                    locked.append(True)
+            thread = threading.Thread(target=lock)
+            thread.start()
+            thread.join(5)
+            self.assertEqual(self._pool.containers()[name]['starting'], True)
+            return self.create(name)
+        name, container = self._pool.acquire('key', 1, create)
+        self.assertEqual(locked, [True])
+        self.assertNotIn('starting', container)
+        self.assertEqual(self._pool.containers()[name]['image'], 'busybox')
+
+    def test_failed_start_frees_the_slot(self):
+        def fail(name):
+            raise container_pool.ContainerPoolError('no')
+        with self.assertRaises(container_pool.ContainerPoolError):
+            self._pool.acquire('key', 1, fail)
+        self.assertEqual(self._pool.containers(), {})
+
+    def test_idle_command_falls_back_then_fails_clearly(self):
+        started = []
+
+        def start(exit_codes):
+            def start_func(command):
+                started.append(command[0])
+                return exit_codes[len(started) - 1]
+            return start_func
+        self.assertEqual(
+            container_pool.start_idle_container('idr-pool-a', 'busybox', start([0])), ['tail', '-f', '/dev/null'])
+        del started[:]
+        self.assertEqual(
+            container_pool.start_idle_container('idr-pool-a', 'slim', start([127, 0]))[0], 'sleep')
+        self.assertEqual(started, ['tail', 'sleep'])
+        del started[:]
+        with self.assertRaises(container_pool.ContainerPoolError) as raised:
+            container_pool.start_idle_container('idr-pool-a', 'distroless', start([127, 127]))
+        self.assertIn('distroless has neither tail nor sleep', str(raised.exception))
+        del started[:]
+        with self.assertRaises(container_pool.ContainerPoolError):
+            container_pool.start_idle_container('idr-pool-a', 'busybox', start([125]))
+        self.assertEqual(started, ['tail'])
+
+    def test_evicts_idle_and_vanished_containers(self):
+        name, _ = self._pool.acquire('key', 1, self.create)
+        self._pool.release(name)
+        os.remove(os.path.join(self._state_dir, name))
+        self.assertNotEqual(self._pool.acquire('key', 1, self.create)[0], name)
+        self._pool.release(self._created[-1])
+        self.assertEqual(self._pool.prune(), [])
+        self._pool.idle_timeout = -1
+        self.assertEqual(self._pool.prune(), [self._created[-1]])
+        self.assertEqual(os.listdir(self._state_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
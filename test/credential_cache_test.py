@@ -0,0 +1,69 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from iam_docker_run import credential_cache
+
+
+def make_creds(seconds_left):
+    return {
+        'AWS_ACCESS_KEY_ID': 'ASIATEST',
+        'AWS_SECRET_ACCESS_KEY': 'secret',
+        'AWS_SESSION_TOKEN': 'token',
+        'expiration': time.strftime(
+            credential_cache.EXPIRATION_FORMAT,
+            time.gmtime(time.time() + seconds_left))
+    }
+
+
+class TestCredentialCache(unittest.TestCase):
+    def setUp(self):
+        self._cache_dir = tempfile.mkdtemp()
+        self._cache = credential_cache.CredentialCache(
+            cache_dir=self._cache_dir, min_ttl=300)
+        self._key = self._cache.key('AKIASOURCE', 'dev', 'role-test', 'us-east-1')
+
+    def tearDown(self):
+        shutil.rmtree(self._cache_dir)
+
+    def test_returns_fresh_credentials(self):
+        self._cache.put(self._key, make_creds(3600))
+        self.assertEqual(self._cache.get(self._key)['AWS_ACCESS_KEY_ID'], 'ASIATEST')
+
+    def test_ignores_credentials_below_min_ttl(self):
+        self._cache.put(self._key, make_creds(60))
+        self.assertIsNone(self._cache.get(self._key))
+
+    def test_key_includes_region(self):
+        other_key = self._cache.key('AKIASOURCE', 'dev', 'role-test', 'us-west-2')
+        self._cache.put(self._key, make_creds(3600))
+        self.assertIsNone(self._cache.get(other_key))
+
+    def test_prunes_expired_entries(self):
+        self._cache.put(self._key, make_creds(-10))
+        self.assertFalse(os.path.exists(
+            os.path.join(self._cache_dir, '{}.json'.format(self._key))))
+
+    def test_concurrent_callers_share_one_call(self):
+        calls = []
+
+        def create():
+            calls.append(1)
+            time.sleep(0.2)
+            return make_creds(3600)
+
+        threads = [
+            threading.Thread(target=self._cache.get_or_create, args=(self._key, create))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+from __future__ import print_function
+import sys
+import json
+import time
+import unittest
+from iam_docker_run import credential_cache
+from iam_docker_run import credentials_server
+from iam_docker_run import iam_docker_run
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+    from io import StringIO
+except ImportError:  # python 2
+    from urllib2 import Request, urlopen, HTTPError
+    from StringIO import StringIO
+
+
+def make_creds(access_key, expires_in):
+    return {
+        'AWS_ACCESS_KEY_ID': access_key,
+        'AWS_SECRET_ACCESS_KEY': 'secret-{}'.format(access_key),
+        'AWS_SESSION_TOKEN': 'token-{}'.format(access_key),
+        'expiration': time.strftime(credential_cache.EXPIRATION_FORMAT, time.gmtime(time.time() + expires_in)),
+    }
+
+
+class RefreshFunc(object):
+    """Fails the first refresh, then hands out new credentials."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        print("Assuming role given as argument")
+        if self.calls == 1:
+            raise Exception("throttled")
+        return make_creds('refreshed', 3600)
+
+
+class TestCredentialsServer(unittest.TestCase):
+    def setUp(self):
+        self._servers = []
+
+    def tearDown(self):
+        for server in self._servers:
+            server.stop()
+
+    def start_server(self, aws_creds, refresh_func=None, **kwargs):
+        server = credentials_server.CredentialsServer(refresh_func or RefreshFunc(), aws_creds, **kwargs)
+        server.start()
+        self._servers.append(server)
+        return server
+
+    def get(self, server, path, token):
+        request = Request('http://127.0.0.1:{}{}'.format(server.port, path))
+        if token:
+            request.add_header('Authorization', token)
+        try:
+            response = urlopen(request, timeout=5)
+            return response.getcode(), json.loads(response.read().decode('utf-8'))
+        except HTTPError as e:
+            return e.code, json.loads(e.read().decode('utf-8'))
+
+    def test_serves_credentials_only_with_the_token(self):
+        server = self.start_server(make_creds('initial', 3600))
+        self.assertEqual(server._server.server_address[0], '127.0.0.1')
+        status, body = self.get(server, credentials_server.CREDENTIALS_PATH, server.token)
+        self.assertEqual((status, body['AccessKeyId'], body['Token']), (200, 'initial', 'token-initial'))
+        self.assertEqual(self.get(server, credentials_server.CREDENTIALS_PATH, None)[0], 401)
+        self.assertEqual(self.get(server, credentials_server.CREDENTIALS_PATH, 'wrong')[0], 401)
+        self.assertEqual(self.get(server, '/other', server.token)[0], 404)
+
+    def test_refreshes_before_expiry_retrying_failures_quietly(self):
+        refresh_func = RefreshFunc()
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            # within the refresh margin, so refreshed straight away
+            server = self.start_server(
+                make_creds('initial', 60), refresh_func, refresh_margin=600, retry_interval=0.05)
+            deadline = time.time() + 5
+            while time.time() < deadline and server.get_ecs_credentials()['AccessKeyId'] != 'refreshed':
+                time.sleep(0.02)
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(server.get_ecs_credentials()['AccessKeyId'], 'refreshed')
+        self.assertEqual(refresh_func.calls, 2)
+        self.assertIn('Error refreshing container credentials: throttled', printed)
+        self.assertNotIn('Assuming role', printed)
+        # the refreshed credentials aren't due for refresh for a while
+        self.assertGreater(server.seconds_until_refresh(), 2000)
+
+    def test_requires_temporary_credentials(self):
+        creds = make_creds('static', 3600)
+        del creds['expiration']
+        server = credentials_server.CredentialsServer(RefreshFunc(), creds)
+        try:
+            with self.assertRaises(credentials_server.CredentialsServerError):
+                server.start()
+        finally:
+            server._server.server_close()
+
+    def test_launch_requires_host_network(self):
+        args = iam_docker_run.create_parser().parse_args(
+            ['--image', 'busybox', '--role', 'role-app', '--credentials-endpoint'])
+        with self.assertRaises(iam_docker_run.LaunchError):
+            iam_docker_run.launch(args)
+
+
+if __name__ == '__main__':
+    unittest.main()
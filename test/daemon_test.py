@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import unittest
+from iam_docker_run import daemon
+from iam_docker_run import daemon_client
+from iam_docker_run import iam_docker_run
+from iam_docker_run import session_pool
+from iam_docker_run import timings
+from iam_docker_run.aws_util_exceptions import ProfileParsingError
+
+try:
+    from io import StringIO
+except ImportError:  # python 2
+    from StringIO import StringIO
+
+
+def fake_get_aws_creds(profile_name=None, role_name=None, verbose=False, region=None, **kwargs):
+    """Prints and times like get_aws_creds, slowly enough for requests to overlap."""
+    if role_name == 'role-missing':
+        raise ProfileParsingError("No profile for {}".format(role_name))
+    print("Assuming role {}".format(role_name))
+    with timings.phase('sts:AssumeRole', role=role_name):
+        time.sleep(0.1)
+    print("Assumed role {}".format(role_name))
+    return {'AWS_ACCESS_KEY_ID': 'AKIA-{}'.format(role_name)}
+
+
+def pooled_get_aws_creds(profile_name=None, role_name=None, region=None, environ=None, **kwargs):
+    """Gets an STS client for the forwarded credentials, as assuming a role does."""
+    aws_creds = dict((name, environ[name]) for name in (
+        'AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN'))
+    session_pool.get_client(session_pool.get_session(aws_creds), 'sts', region)
+    return aws_creds
+
+
+def make_args(role):
+    return argparse.Namespace(
+        profile=None, role=role, role_arn=None, no_credential_cache=True,
+        credential_cache_min_ttl=None, verbose=False)
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._socket_path = os.path.join(self._temp_dir, 'daemon.sock')
+        self._get_aws_creds = iam_docker_run.get_aws_creds
+        iam_docker_run.get_aws_creds = fake_get_aws_creds
+        self._daemon = daemon.Daemon(self._socket_path)
+        self._thread = threading.Thread(target=self._daemon.serve_forever)
+        self._thread.start()
+        deadline = time.time() + 5
+        while not os.path.exists(self._socket_path) and time.time() < deadline:
+            time.sleep(0.01)
+
+    def tearDown(self):
+        daemon_client.send_request({'command': 'stop'}, self._socket_path)
+        self._thread.join(5)
+        iam_docker_run.get_aws_creds = self._get_aws_creds
+        shutil.rmtree(self._temp_dir)
+
+    def test_ping_and_unknown_commands(self):
+        response = daemon_client.send_request({'command': 'ping'}, self._socket_path)
+        self.assertEqual((response['status'], response['pid']), ('ok', os.getpid()))
+        response = daemon_client.send_request({'command': 'other'}, self._socket_path)
+        self.assertEqual(response, {'status': 'error', 'message': 'Unknown command other'})
+        with self.assertRaises(daemon.DaemonError):
+            daemon.remove_stale_socket(self._socket_path)
+
+    def test_concurrent_requests_keep_their_own_messages_and_timings(self):
+        responses = {}
+
+        def request(role):
+            responses[role] = daemon_client.request_aws_creds(make_args(role), None, self._socket_path)
+        threads = [threading.Thread(target=request, args=(role,)) for role in ('role-a', 'role-b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        for role, other in (('role-a', 'role-b'), ('role-b', 'role-a')):
+            response = responses[role]
+            self.assertEqual(response['aws_creds']['AWS_ACCESS_KEY_ID'], 'AKIA-{}'.format(role))
+            self.assertIn('Assuming role {}\nAssumed role {}\n'.format(role, role), response['messages'])
+            self.assertNotIn(other, response['messages'])
+            self.assertEqual(
+                [(span['name'], span['attributes']) for span in response['spans']],
+                [('sts:AssumeRole', {'role': role})])
+
+    def test_errors_are_reported_to_the_client(self):
+        response = daemon_client.request_aws_creds(make_args('role-missing'), None, self._socket_path)
+        self.assertEqual(response['status'], 'error')
+        self.assertEqual(response['message'], 'No profile for role-missing')
+
+    def test_launch_reports_the_daemon_messages_and_timings(self):
+        environ = dict(os.environ)
+        os.environ['IAM_DOCKER_RUN_USE_DAEMON'] = '1'
+        os.environ['IAM_DOCKER_RUN_DAEMON_SOCKET'] = self._socket_path
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            with timings.recording(timings.Timings()) as launch_timings:
+                aws_creds = iam_docker_run.resolve_aws_creds(make_args('role-app'), None)
+                with self.assertRaises(iam_docker_run.LaunchError):
+                    iam_docker_run.resolve_aws_creds(make_args('role-missing'), None)
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+            os.environ.clear()
+            os.environ.update(environ)
+        self.assertEqual(aws_creds['AWS_ACCESS_KEY_ID'], 'AKIA-role-app')
+        self.assertIn('Assuming role role-app\n', printed)
+        self.assertIn('(from idr daemon)', printed)
+        self.assertEqual([span['name'] for span in launch_timings.spans], ['daemon:sts:AssumeRole'])
+
+    def test_session_pool_stays_bounded(self):
+        iam_docker_run.get_aws_creds = pooled_get_aws_creds
+        max_sessions = session_pool.MAX_SESSIONS
+        session_pool.MAX_SESSIONS = 4
+        try:
+            # every CI job forwards its own credentials
+            for job in range(20):
+                response = self._daemon.handle_request({
+                    'command': 'aws_creds',
+                    'options': {'role': 'role-app', 'no_credential_cache': True},
+                    'region': 'eu-west-1',
+                    'env': {
+                        'AWS_ACCESS_KEY_ID': 'AKIAJOB{}'.format(job),
+                        'AWS_SECRET_ACCESS_KEY': 'secret',
+                        'AWS_SESSION_TOKEN': 'token',
+                    },
+                })
+                self.assertEqual(response['status'], 'ok')
+            self.assertEqual(len(session_pool._sessions), 4)
+            self.assertLessEqual(len(session_pool._clients), 4)
+        finally:
+            session_pool.MAX_SESSIONS = max_sessions
+
+    def test_unavailable_daemon(self):
+        missing = os.path.join(self._temp_dir, 'missing.sock')
+        with self.assertRaises(daemon_client.DaemonUnavailableError):
+            daemon_client.send_request({'command': 'ping'}, missing, timeout=1)
+        environ = dict(os.environ)
+        os.environ['IAM_DOCKER_RUN_DAEMON_SOCKET'] = missing
+        try:
+            self.assertIsNone(iam_docker_run.resolve_aws_creds_from_daemon(make_args('role-app'), None))
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+
+if __name__ == '__main__':
+    unittest.main()
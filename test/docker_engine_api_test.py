@@ -0,0 +1,183 @@
+import io
+import os
+import json
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+from iam_docker_run import docker_engine_api
+from iam_docker_run import iam_docker_run
+
+try:
+    import socketserver
+    from http.server import BaseHTTPRequestHandler
+except ImportError:  # python 2
+    import SocketServer as socketserver
+    from BaseHTTPServer import BaseHTTPRequestHandler
+
+
+# the progress a pull streams, the failing one ends with an error line
+PULL_PROGRESS = [
+    {'status': 'Pulling from library/busybox', 'id': 'latest'},
+    {'status': 'Downloading', 'progressDetail': {'current': 1024, 'total': 2048}, 'id': 'a1b2'},
+]
+PULL_ERROR = {'errorDetail': {'message': 'unexpected EOF'}, 'error': 'unexpected EOF'}
+
+
+def frame(stream_type, payload):
+    return struct.pack('>BxxxL', stream_type, len(payload)) + payload
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    """Just enough of the Docker Engine API to run a container."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json_lines(self, lines):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for line in lines:
+            data = json.dumps(line).encode('utf-8') + b'\r\n'
+            self.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.server.requests.append(('POST', self.path, body))
+        if '/images/create' in self.path:
+            if 'fromImage=missing' in self.path:
+                self.send_json_lines(PULL_PROGRESS + [PULL_ERROR])
+            else:
+                self.send_json_lines(PULL_PROGRESS + [{'status': 'Downloaded newer image for busybox:latest'}])
+        elif '/dropped/' in self.path:
+            self.close_connection = True
+        elif '/containers/create' in self.path:
+            self.server.created_spec = json.loads(body.decode('utf-8'))
+            self.send_json(201, {'Id': 'abc123', 'Warnings': []})
+        elif self.path.endswith('/start'):
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.path.endswith('/wait'):
+            self.send_json(200, {'StatusCode': 3})
+        elif '/attach' in self.path:
+            self.send_response(101)
+            self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+            self.send_header('Connection', 'Upgrade')
+            self.send_header('Upgrade', 'tcp')
+            self.end_headers()
+            self.wfile.write(frame(1, b'hello '))
+            self.wfile.write(frame(2, b'oops\n'))
+            self.wfile.write(frame(1, b'world\n'))
+            self.close_connection = True
+
+    def do_DELETE(self):
+        self.server.requests.append(('DELETE', self.path, b''))
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path, b''))
+        self.send_json(404, {'message': 'No such image'})
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = socketserver.UnixStreamServer.get_request(self)
+        # BaseHTTPRequestHandler expects an (address, port) client address
+        return request, ('local', 0)
+
+
+class TestDockerEngineApi(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._socket_path = os.path.join(self._temp_dir, 'docker.sock')
+        self._server = FakeDockerServer(self._socket_path, FakeDockerHandler)
+        self._server.requests = []
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self._client = docker_engine_api.DockerEngineClient(self._socket_path)
+
+    def tearDown(self):
+        self._client.close()
+        self._server.shutdown()
+        self._server.server_close()
+        shutil.rmtree(self._temp_dir)
+
+    def test_runs_container_and_returns_exit_code(self):
+        container_id = self._client.create_container({'Image': 'busybox'}, 'test')
+        attach_stream = self._client.attach_container(container_id)
+        self._client.start_container(container_id)
+        stdout, stderr = io.BytesIO(), io.BytesIO()
+        attach_stream.copy_output(stdout, stderr)
+        self.assertEqual(self._client.wait_container(container_id), 3)
+        self._client.remove_container(container_id)
+        self.assertEqual(stdout.getvalue(), b'hello world\n')
+        self.assertEqual(stderr.getvalue(), b'oops\n')
+        methods = [method for method, _, _ in self._server.requests]
+        self.assertEqual(methods, ['POST', 'POST', 'POST', 'POST', 'DELETE'])
+
+    def test_missing_image_returns_none(self):
+        self.assertIsNone(self._client.inspect_image('busybox:latest'))
+
+    def test_pull_reads_the_progress_stream(self):
+        self._client.pull_image('busybox', auth={'username': 'AWS', 'password': 'token'})
+        self.assertEqual(self._server.requests[-1][:2], ('POST', '/v1.25/images/create?fromImage=busybox&tag=latest'))
+        # the connection is left ready for the next request
+        self.assertIsNone(self._client.inspect_image('busybox:latest'))
+
+    def test_failed_pull_raises(self):
+        with self.assertRaises(docker_engine_api.DockerEngineApiError) as raised:
+            self._client.pull_image('missing/app:v1')
+        self.assertEqual(str(raised.exception), 'Error pulling image missing/app:v1: unexpected EOF')
+
+    def test_posts_are_not_retried(self):
+        # the engine got the request but dropped the connection before answering
+        with self.assertRaises(docker_engine_api.DockerEngineApiError):
+            self._client.start_container('dropped')
+        self.assertEqual([path for _, path, _ in self._server.requests], ['/v1.25/containers/dropped/start'])
+        self._client.start_container('abc123')
+
+    def test_create_spec_from_arguments(self):
+        args = iam_docker_run.create_parser().parse_args([
+            '--image', 'busybox',
+            '--full-entrypoint', "sh -c 'echo hi'",
+            '-p', '8080:80', '-p', '127.0.0.1:5353:53/udp',
+            '-v', '/tmp:/data',
+            '--shm-size', '128m',
+            '--network', 'testnet',
+        ])
+        spec = iam_docker_run.build_container_create_spec(
+            args, ['# comment', '', 'A=1', 'AWS_REGION=us-east-1'])
+        self.assertEqual(spec['Entrypoint'], ['sh'])
+        self.assertEqual(spec['Cmd'], ['-c', 'echo hi'])
+        self.assertEqual(spec['Env'], ['A=1', 'AWS_REGION=us-east-1'])
+        self.assertEqual(spec['HostConfig']['PortBindings'], {
+            '80/tcp': [{'HostIp': '', 'HostPort': '8080'}],
+            '53/udp': [{'HostIp': '127.0.0.1', 'HostPort': '5353'}],
+        })
+        self.assertEqual(spec['HostConfig']['Binds'], ['/tmp:/data'])
+        self.assertEqual(spec['HostConfig']['ShmSize'], 128 * 1024 * 1024)
+        self.assertEqual(spec['HostConfig']['NetworkMode'], 'testnet')
+
+
+if __name__ == '__main__':
+    unittest.main()
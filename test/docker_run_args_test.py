@@ -0,0 +1,73 @@
+import os
+import sys
+import subprocess
+import unittest
+from fake_docker import FakeDockerTestCase
+from iam_docker_run import iam_docker_run
+
+
+PACKAGE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# prints its arguments one per line, then the env file docker would read
+FAKE_DOCKER = """#!/bin/sh
+for arg in "$@"; do echo "$arg"; done
+while [ $# -gt 0 ]; do
+  if [ "$1" = --env-file ]; then echo "ENVFILE $(cat "$2")"; fi
+  shift
+done
+"""
+
+
+def parse_args(argv):
+    return iam_docker_run.create_parser().parse_args(argv)
+
+
+class TestDockerRunArgs(unittest.TestCase):
+    def test_builds_argument_list(self):
+        args = parse_args([
+            '--image', 'busybox', '-e', 'A=1', '-p', '8080:80', '-v', 'data:/data',
+            '--network', 'backend', '--workdir', '/app', '--cmd', 'echo "hello world"'])
+        docker_args = iam_docker_run.build_docker_run_args(args, 'test-name', '/dev/fd/3')
+        self.assertEqual(docker_args, [
+            'docker', 'run', '--rm', '--name', 'test-name', '--label', 'iam-docker-run=1',
+            '-p', '8080:80', '--env-file', '/dev/fd/3', '-v', 'data:/data',
+            '--network', 'backend', '--workdir', '/app', 'busybox', 'echo', 'hello world'])
+
+    def test_run_modes_and_entrypoints(self):
+        args = parse_args(['--image', 'busybox', '-d', '--full-entrypoint', 'python app.py --debug'])
+        docker_args = iam_docker_run.build_docker_run_args(args, 'test-name', None, remove=False)
+        self.assertEqual(docker_args[:4], ['docker', 'run', '-d', '--name'])
+        self.assertIn('iam-docker-run.reap=1', docker_args)
+        self.assertEqual(docker_args[-5:], ['--entrypoint', 'python', 'busybox', 'app.py', '--debug'])
+        self.assertNotIn('--env-file', docker_args)
+        args = parse_args(['--image', 'busybox', '--shell', '--cmd', 'ignored'])
+        docker_args = iam_docker_run.build_docker_run_args(args, 'test-name', None)
+        self.assertIn('-it', docker_args)
+        self.assertEqual(docker_args[-3:], ['--entrypoint', '/bin/bash', 'busybox'])
+
+
+class TestExecDocker(FakeDockerTestCase):
+    fake_docker = FAKE_DOCKER
+
+    def test_replaces_process_handing_over_the_env_file(self):
+        env_file = os.path.join(self._temp_dir, 'test.env')
+        with open(env_file, 'w') as f:
+            f.write('A=1\n')
+        script = (
+            "from iam_docker_run import docker_cli_utils\n"
+            "docker_cli_utils.exec_docker(['docker', 'run', '--env-file', {0!r}, 'busybox', 'a b'], {0!r})\n"
+        ).format(env_file)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = PACKAGE_ROOT
+        output = subprocess.check_output([sys.executable, '-c', script], env=env).decode('utf-8')
+        lines = output.splitlines()
+        # the printed command, then the arguments docker received
+        self.assertEqual(lines[1:3], ['run', '--env-file'])
+        self.assertTrue(lines[3].startswith('/dev/fd/'))
+        self.assertEqual(lines[4:6], ['busybox', 'a b'])
+        self.assertEqual(lines[-1], 'ENVFILE A=1')
+        # unlinked before the handoff, the descriptor keeps it readable
+        self.assertFalse(os.path.exists(env_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import unittest
+from fake_docker import FakeDockerTestCase
+from iam_docker_run import ecr_auth
+from iam_docker_run import runner
+
+
+REGISTRY = '123456789012.dkr.ecr.us-east-1.amazonaws.com'
+# images are present, and "docker run -d" prints the DOCKER_CONFIG it was run with
+FAKE_DOCKER = """#!/bin/sh
+case "$1" in
+  image) echo sha256:0123 ;;
+  run) echo "$DOCKER_CONFIG" ;;
+esac
+exit 0
+"""
+
+
+class FakeFetch(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, account_id, region, aws_creds=None, verbose=False):
+        self.calls += 1
+        return {'username': 'AWS', 'password': 'token-{}'.format(self.calls),
+                'expires_at': time.time() + 12 * 3600}
+
+
+class TestEcrAuth(FakeDockerTestCase):
+    fake_docker = FAKE_DOCKER
+
+    def setUp(self):
+        FakeDockerTestCase.setUp(self)
+        os.environ['DOCKER_CONFIG'] = os.path.join(self._temp_dir, 'docker')
+        os.makedirs(os.path.join(self._temp_dir, 'docker', 'contexts'))
+        with open(os.path.join(self._temp_dir, 'docker', 'config.json'), 'w') as f:
+            json.dump({'credsStore': 'desktop', 'currentContext': 'remote'}, f)
+
+    def test_parse_ecr_image(self):
+        self.assertEqual(
+            ecr_auth.parse_ecr_image(REGISTRY + '/app:1.0'), (REGISTRY, '123456789012', 'us-east-1'))
+        self.assertEqual(
+            ecr_auth.parse_ecr_image('123456789012.dkr.ecr-fips.us-gov-west-1.amazonaws.com/app')[2],
+            'us-gov-west-1')
+        self.assertEqual(
+            ecr_auth.parse_ecr_image('123456789012.dkr.ecr.cn-north-1.amazonaws.com.cn/app')[2],
+            'cn-north-1')
+        self.assertIsNone(ecr_auth.parse_ecr_image('busybox'))
+        self.assertIsNone(ecr_auth.parse_ecr_image('registry.example.com/123456789012.dkr.ecr.us-east-1.amazonaws.com'))
+
+    def test_token_is_cached_per_account_and_region(self):
+        fetch = FakeFetch()
+        token = ecr_auth.get_token(REGISTRY, '123456789012', 'us-east-1', fetch=fetch)
+        self.assertEqual(ecr_auth.get_token(REGISTRY, '123456789012', 'us-east-1', fetch=fetch), token)
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(ecr_auth.find_token('https://{}/v2/'.format(REGISTRY))['password'], 'token-1')
+        self.assertIsNone(ecr_auth.find_token('https://index.docker.io/v1/'))
+        ecr_auth.get_token(REGISTRY.replace('us-east-1', 'eu-west-1'), '123456789012', 'eu-west-1', fetch=fetch)
+        self.assertEqual(fetch.calls, 2)
+
+    def test_docker_config_overlays_the_users(self):
+        ecr_auth.get_token(REGISTRY, '123456789012', 'us-east-1', fetch=FakeFetch())
+        overlay_dir = ecr_auth.write_docker_config()
+        with open(os.path.join(overlay_dir, 'config.json')) as f:
+            config = json.load(f)
+        self.assertEqual(config['credHelpers'], {REGISTRY: 'idr'})
+        self.assertEqual((config['credsStore'], config['currentContext']), ('desktop', 'remote'))
+        self.assertTrue(os.path.isdir(os.path.join(overlay_dir, 'contexts')))
+        # written again from within a launch, the user's config is still the source
+        os.environ['DOCKER_CONFIG'] = overlay_dir
+        os.environ['HOME'] = self._temp_dir
+        os.rename(os.path.join(self._temp_dir, 'docker'), os.path.join(self._temp_dir, '.docker'))
+        with open(os.path.join(ecr_auth.write_docker_config(use_helper=False), 'config.json')) as f:
+            self.assertIn(REGISTRY, json.load(f)['auths'])
+
+    def test_login_leaves_the_process_environment_alone(self):
+        ecr_auth.get_token(REGISTRY, '123456789012', 'us-east-1', fetch=FakeFetch())
+        self.assertIsNone(ecr_auth.login('busybox'))
+        overlay_dir = ecr_auth.login(REGISTRY + '/app:1.0')
+        self.assertTrue(os.path.isfile(os.path.join(overlay_dir, 'config.json')))
+        self.assertEqual(os.environ['DOCKER_CONFIG'], os.path.join(self._temp_dir, 'docker'))
+        # only the launch's docker commands are pointed at the overlay
+        result = runner.Runner(log_dir=self._temp_dir).run(image=REGISTRY + '/app:1.0', detached=True)
+        self.assertEqual(result.container_id, overlay_dir)
+        self.assertEqual(os.environ['DOCKER_CONFIG'], os.path.join(self._temp_dir, 'docker'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+from iam_docker_run import env_assembly
+
+
+class TestEnvAssembly(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_parses_docker_env_file_syntax(self):
+        os.environ['IDR_TEST_PASSTHROUGH'] = 'from-host'
+        pairs = env_assembly.parse_env_lines([
+            '# a comment', '', 'A=1', 'B=has=equals', 'IDR_TEST_PASSTHROUGH', 'IDR_TEST_UNSET'])
+        self.assertEqual(pairs, [
+            ('A', '1'), ('B', 'has=equals'), ('IDR_TEST_PASSTHROUGH', 'from-host')])
+
+    def test_later_layers_take_precedence(self):
+        assembler = env_assembly.EnvAssembler()
+        assembler.add('aws', [('AWS_REGION', 'us-east-1')])
+        assembler.add_lines('custom_env_file', ['A=file', 'AWS_REGION=eu-west-1', 'B=file'])
+        assembler.add_lines('envvars', ['A=arg'])
+        assembler.add('defaults', [('B', 'default')])
+        assembler.add('required', [('PYTHONUNBUFFERED', '1')])
+        assembler.add_lines('custom_env_file', ['PYTHONUNBUFFERED=0'])
+        self.assertEqual(assembler.lines(), [
+            'B=file', 'A=arg', 'AWS_REGION=us-east-1', 'PYTHONUNBUFFERED=1'])
+
+    def test_parsed_env_file_is_reparsed_when_changed(self):
+        path = os.path.join(self._temp_dir, 'test.env')
+        with open(path, 'w') as f:
+            f.write('A=1\n')
+        self.assertEqual(env_assembly.read_env_file(path), [('A', '1')])
+        with open(path, 'w') as f:
+            f.write('A=22\n')
+        self.assertEqual(env_assembly.read_env_file(path), [('A', '22')])
+
+    def test_written_env_file_is_readable_until_released(self):
+        path = env_assembly.write_env_file(['A=1', 'B=2'])
+        with open(path, 'r') as f:
+            self.assertEqual(f.read(), 'A=1\nB=2\n')
+        env_assembly.release_env_file(path)
+        self.assertFalse(env_assembly.is_memfd_env_file(path))
+        if not path.startswith('/dev/fd/'):
+            self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
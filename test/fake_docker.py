@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def install_fake_docker(bin_dir, script):
+    """Write the shell script as an executable docker in bin_dir."""
+    if not os.path.isdir(bin_dir):
+        os.makedirs(bin_dir)
+    docker_path = os.path.join(bin_dir, 'docker')
+    with open(docker_path, 'w') as f:
+        f.write(script)
+    os.chmod(docker_path, 0o755)
+    return docker_path
+
+
+class FakeDockerTestCase(unittest.TestCase):
+    """Runs each test with the class's fake_docker script first on the PATH as
+    docker, its state kept in $FAKE_DOCKER_STATE, and the cache directory in the
+    test's temp dir.  The environment is restored after each test."""
+
+    fake_docker = """#!/bin/sh
+exit 0
+"""
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._bin_dir = os.path.join(self._temp_dir, 'bin')
+        self._state_dir = os.path.join(self._temp_dir, 'state')
+        os.makedirs(self._state_dir)
+        install_fake_docker(self._bin_dir, self.fake_docker)
+        self._environ = dict(os.environ)
+        os.environ['PATH'] = self._bin_dir + os.pathsep + os.environ.get('PATH', '')
+        os.environ['FAKE_DOCKER_STATE'] = self._state_dir
+        os.environ['IAM_DOCKER_RUN_CACHE_DIR'] = os.path.join(self._temp_dir, 'cache')
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environ)
+        shutil.rmtree(self._temp_dir)
+
+    def read_state(self, name):
+        """The contents of a file the fake docker wrote to its state dir."""
+        with open(os.path.join(self._state_dir, name)) as f:
+            return f.read()
@@ -0,0 +1,83 @@
+import os
+import unittest
+from fake_docker import FakeDockerTestCase
+from iam_docker_run import image_build
+
+
+# records builds in $FAKE_DOCKER_STATE, and reports an image as present once built
+FAKE_DOCKER = """#!/bin/sh
+case "$1" in
+  build) echo "$DOCKER_BUILDKIT $@" >> "$FAKE_DOCKER_STATE/builds"; touch "$FAKE_DOCKER_STATE/built" ;;
+  image) if [ -f "$FAKE_DOCKER_STATE/built" ]; then echo sha256:0123; fi ;;
+  tag) echo "$@" >> "$FAKE_DOCKER_STATE/tags" ;;
+esac
+exit 0
+"""
+
+
+class TestImageBuild(FakeDockerTestCase):
+    fake_docker = FAKE_DOCKER
+
+    def setUp(self):
+        FakeDockerTestCase.setUp(self)
+        self._context = os.path.join(self._temp_dir, 'app')
+        self._write('Dockerfile', 'FROM busybox\nCOPY . /app\n')
+        self._write('.dockerignore', '# build output\nnode_modules\n**/*.pyc\nlogs/*\n!logs/keep.log\n')
+        self._write('src/main.py', 'print("hello")\n')
+        self._write('src/main.pyc', 'compiled')
+        self._write('node_modules/lib/index.js', 'module')
+        self._write('logs/debug.log', 'debug')
+        self._write('logs/keep.log', 'keep')
+
+    def _write(self, path, content):
+        full_path = os.path.join(self._context, path)
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+        with open(full_path, 'w') as f:
+            f.write(content)
+
+    def _read_builds(self):
+        return self.read_state('builds').splitlines()
+
+    def test_dockerignore_rules(self):
+        rules = image_build.read_dockerignore(self._context)
+        self.assertEqual(
+            image_build.list_context_files(self._context, rules),
+            ['.dockerignore', 'Dockerfile', 'logs/keep.log', 'src/main.py'])
+        rules = [(image_build.compile_pattern('src/*/test?.py'), True)]
+        self.assertTrue(image_build.is_ignored('src/pkg/test1.py', rules))
+        self.assertFalse(image_build.is_ignored('src/pkg/sub/test1.py', rules))
+
+    def test_digest_changes_only_with_the_build_inputs(self):
+        digest = image_build.compute_context_digest(self._context, os.path.join(self._context, 'Dockerfile'))
+        self._write('logs/debug.log', 'more debug')
+        self._write('src/main.pyc', 'recompiled')
+        self.assertEqual(
+            image_build.compute_context_digest(self._context, os.path.join(self._context, 'Dockerfile')),
+            digest)
+        self.assertNotEqual(
+            image_build.compute_context_digest(
+                self._context, os.path.join(self._context, 'Dockerfile'), ['VERSION=2']),
+            digest)
+        self._write('src/main.py', 'print("goodbye")\n')
+        self.assertNotEqual(
+            image_build.compute_context_digest(self._context, os.path.join(self._context, 'Dockerfile')),
+            digest)
+
+    def test_builds_only_when_the_context_changed(self):
+        tag = image_build.ensure_built(self._context)
+        self.assertTrue(tag.startswith('idr-build/app:'))
+        self.assertEqual(image_build.ensure_built(self._context), tag)
+        builds = self._read_builds()
+        self.assertEqual(len(builds), 1)
+        self.assertTrue(builds[0].startswith('1 build -f'))
+        self.assertIn('--label iam-docker-run.build-digest=', builds[0])
+        self.assertEqual(image_build.ensure_built(self._context, tag='mycompany/app:dev'), 'mycompany/app:dev')
+        self.assertEqual(len(self._read_builds()), 1)
+        self._write('src/main.py', 'print("goodbye")\n')
+        image_build.ensure_built(self._context)
+        self.assertEqual(len(self._read_builds()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
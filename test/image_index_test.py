@@ -0,0 +1,157 @@
+import sys
+import time
+import unittest
+from fake_docker import FakeDockerTestCase
+from iam_docker_run import iam_docker_run
+from iam_docker_run import image_index
+from iam_docker_run import prefetch
+from iam_docker_run import registry_manifest
+
+try:
+    from io import StringIO
+except ImportError:  # python 2
+    from StringIO import StringIO
+
+
+# images are present once pulled, "docker pull" records its image in
+# $FAKE_DOCKER_STATE/pulls and fails for images under missing/
+FAKE_DOCKER = """#!/bin/sh
+if [ "$1" = image ] && [ "$2" = inspect ]; then
+  for arg; do image="$arg"; done
+  grep -qx "$image" "$FAKE_DOCKER_STATE/pulls" 2>/dev/null || exit 1
+  case "$*" in
+    *RepoDigests*) echo "[\\"${image%:*}@sha256:pulled\\"]" ;;
+    *) echo sha256:local ;;
+  esac
+  exit 0
+fi
+if [ "$1" = pull ]; then
+  for arg; do image="$arg"; done
+  case "$image" in missing/*) exit 1 ;; esac
+  echo "$image" >> "$FAKE_DOCKER_STATE/pulls"
+fi
+exit 0
+"""
+
+
+class FakeImages(object):
+    """Stands in for the docker and registry handlers ensure_image is given."""
+
+    def __init__(self, present=True, registry_digest='sha256:one'):
+        self.image_id = 'sha256:local' if present else None
+        self.registry_digest = registry_digest
+        self.registry_error = None
+        self.pulls = 0
+        self.registry_checks = 0
+
+    def get_image_id(self, image):
+        return self.image_id
+
+    def pull_image(self, image):
+        self.pulls += 1
+        self.image_id = 'sha256:local'
+
+    def get_repo_digest(self, image):
+        return self.registry_digest
+
+    def get_registry_digest(self, image):
+        self.registry_checks += 1
+        if self.registry_error:
+            raise self.registry_error
+        return self.registry_digest
+
+    def ensure(self, policy, ttl=None, index=None):
+        return image_index.ensure_image(
+            'busybox:latest', policy, ttl, self.get_image_id, self.pull_image, index=index,
+            get_repo_digest=self.get_repo_digest, get_registry_digest=self.get_registry_digest)
+
+
+class TestImageIndex(FakeDockerTestCase):
+    fake_docker = FAKE_DOCKER
+
+    def setUp(self):
+        FakeDockerTestCase.setUp(self)
+        self._index = image_index.ImageIndex()
+        self._get_registry_digest = iam_docker_run.get_registry_digest
+
+    def tearDown(self):
+        iam_docker_run.get_registry_digest = self._get_registry_digest
+        FakeDockerTestCase.tearDown(self)
+
+    def test_parse_pull_policy(self):
+        self.assertEqual(image_index.parse_pull_policy(None), ('missing', None))
+        self.assertEqual(image_index.parse_pull_policy('always'), ('always', None))
+        self.assertEqual(image_index.parse_pull_policy('if-stale:90'), ('if-stale', 90))
+        self.assertEqual(image_index.parse_pull_policy('if-stale:12h'), ('if-stale', 43200))
+        for value in ('sometimes', 'if-stale', 'if-stale:soon', 'always:1h'):
+            with self.assertRaises(image_index.PullPolicyError):
+                image_index.parse_pull_policy(value)
+
+    def test_missing_always_and_never(self):
+        images = FakeImages(present=False)
+        with self.assertRaises(image_index.PullPolicyError):
+            images.ensure('never')
+        self.assertTrue(images.ensure('missing'))
+        self.assertFalse(images.ensure('missing'))
+        self.assertFalse(images.ensure('never'))
+        self.assertTrue(images.ensure('always'))
+        self.assertEqual(images.pulls, 2)
+
+    def test_if_stale_checks_the_registry_digest(self):
+        images = FakeImages()
+        self.assertTrue(images.ensure('if-stale', 3600, self._index))
+        self.assertEqual(self._index.get('busybox:latest')['digest'], 'sha256:one')
+        # checked within the ttl, so neither pulled nor checked
+        self.assertFalse(images.ensure('if-stale', 3600, self._index))
+        self.assertEqual((images.pulls, images.registry_checks), (1, 0))
+        # stale, but the registry still serves the same digest
+        self.assertFalse(images.ensure('if-stale', 0, self._index))
+        self.assertEqual((images.pulls, images.registry_checks), (1, 1))
+        images.registry_digest = 'sha256:two'
+        self.assertTrue(images.ensure('if-stale', 0, self._index))
+        self.assertEqual(self._index.get('busybox:latest')['digest'], 'sha256:two')
+        images.registry_error = registry_manifest.RegistryError('unreachable')
+        self.assertTrue(images.ensure('if-stale', 0, self._index))
+        self.assertEqual(images.pulls, 3)
+
+    def test_repo_digests_and_references(self):
+        digests = ['busybox@sha256:hub', 'registry.example.com:5000/team/app@sha256:own']
+        self.assertEqual(image_index.select_repo_digest('busybox:1.36', digests), 'sha256:hub')
+        self.assertEqual(
+            image_index.select_repo_digest('registry.example.com:5000/team/app', digests), 'sha256:own')
+        self.assertIsNone(image_index.select_repo_digest('alpine', digests))
+        self.assertEqual(
+            registry_manifest.parse_image_reference('busybox'),
+            ('registry-1.docker.io', 'library/busybox', 'latest'))
+        self.assertEqual(
+            registry_manifest.parse_image_reference('docker.io/team/app:v1'),
+            ('registry-1.docker.io', 'team/app', 'v1'))
+        self.assertEqual(
+            registry_manifest.parse_image_reference('localhost:5000/app@sha256:abc'),
+            ('localhost:5000', 'app', 'sha256:abc'))
+        self.assertEqual(registry_manifest.get_manifest_digest('app@sha256:abc'), 'sha256:abc')
+
+    def test_prefetch_images(self):
+        checked = []
+        iam_docker_run.get_registry_digest = lambda image: checked.append(image) or 'sha256:pulled'
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            first = prefetch.prefetch_images_main(['busybox', 'alpine:3'])
+            second = prefetch.prefetch_images_main(['busybox', 'alpine:3'])
+            failed = prefetch.prefetch_images_main(['busybox', 'missing/app', '--pull', 'always'])
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual((first, second, failed), (0, 0, 1))
+        self.assertEqual(sorted(self.read_state('pulls').split()), ['alpine:3', 'busybox', 'busybox'])
+        self.assertIn('busybox: up to date', printed)
+        self.assertIn('missing/app: failed', printed)
+        self.assertEqual(checked, [])
+        entry = image_index.ImageIndex().get('alpine:3')
+        self.assertEqual((entry['image_id'], entry['digest']), ('sha256:local', 'sha256:pulled'))
+        self.assertLess(time.time() - entry['checked_at'], 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import subprocess
+import unittest
+from fake_docker import FakeDockerTestCase
+
+
+PACKAGE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# cumulative import time allowed for a launch which never touches AWS; measured
+# at roughly 45ms, the budget leaves room for slower CI hosts
+IMPORT_BUDGET_MS = int(os.environ.get('IAM_DOCKER_RUN_IMPORT_BUDGET_MS', 150))
+FAKE_DOCKER = """#!/bin/sh
+if [ "$1" = inspect ]; then echo "'0'"; fi
+exit 0
+"""
+
+
+def parse_importtime(output):
+    """Return (module name, cumulative microseconds) for the top level imports
+    reported by python -X importtime, from the launcher's first import on."""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # nested imports are indented below the module that triggered them
+        if name[1:].startswith(' '):
+            continue
+        imports.append((name.strip(), int(cumulative)))
+    names = [name for name, _ in imports]
+    first = names.index('iam_docker_run') if 'iam_docker_run' in names else 0
+    return imports[first:]
+
+
+class TestImportTime(FakeDockerTestCase):
+    fake_docker = FAKE_DOCKER
+
+    def run_launcher(self, args):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = PACKAGE_ROOT
+        env['IAM_DOCKER_RUN_DISABLE_CONTAINER_NAME_TEMPFILE'] = 'true'
+        p = subprocess.Popen(
+            [sys.executable, '-X', 'importtime', '-m', 'iam_docker_run'] + args,
+            cwd=self._temp_dir, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        _, stderr = p.communicate()
+        self.assertEqual(p.returncode, 0, stderr)
+        return stderr.decode('utf-8')
+
+    def test_launch_without_aws_does_not_import_boto(self):
+        output = self.run_launcher(['--image', 'busybox'])
+        self.assertNotIn(' boto3', output)
+        self.assertNotIn(' botocore', output)
+
+    def test_cold_start_import_budget(self):
+        output = self.run_launcher(['--image', 'busybox'])
+        total_us = sum(cumulative for _, cumulative in parse_importtime(output))
+        self.assertLess(
+            total_us / 1000.0, IMPORT_BUDGET_MS,
+            "launcher imports took {:.1f}ms, budget is {}ms".format(
+                total_us / 1000.0, IMPORT_BUDGET_MS))
+
+
+if __name__ == '__main__':
+    unittest.main()
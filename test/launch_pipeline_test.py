@@ -0,0 +1,59 @@
+import time
+import threading
+import unittest
+from iam_docker_run import iam_docker_run
+from iam_docker_run import launch_pipeline
+
+
+class TestLaunchPipeline(unittest.TestCase):
+    def test_stages_run_concurrently(self):
+        started = threading.Event()
+        pipeline = launch_pipeline.LaunchPipeline()
+        # the first stage can only finish once the second has started
+        pipeline.add_stage('waits', lambda: started.wait(5) and 'waited')
+        pipeline.add_stage('starts', started.set)
+        self.assertEqual(pipeline.result('waits'), 'waited')
+        pipeline.join()
+        self.assertEqual([name for name, _, _ in pipeline.timings()], ['waits', 'starts'])
+        self.assertIn('total', pipeline.format_timings())
+
+    def test_result_waits_and_passes_arguments(self):
+        pipeline = launch_pipeline.LaunchPipeline()
+        pipeline.add_stage('slow', lambda value, suffix='': time.sleep(0.05) or value + suffix, 'a', suffix='b')
+        self.assertTrue(pipeline.has_stage('slow'))
+        self.assertFalse(pipeline.has_stage('other'))
+        self.assertEqual(pipeline.result('slow'), 'ab')
+        self.assertGreaterEqual(pipeline.stages[0].duration, 0.04)
+
+    def test_errors_are_raised_in_stage_order(self):
+        def fail(message, delay):
+            time.sleep(delay)
+            raise ValueError(message)
+        pipeline = launch_pipeline.LaunchPipeline()
+        pipeline.add_stage('ok', lambda: 'fine')
+        # the first failing stage in order wins, even though it fails last
+        pipeline.add_stage('first', fail, 'first', 0.05)
+        pipeline.add_stage('second', fail, 'second', 0)
+        self.assertEqual(pipeline.result('ok'), 'fine')
+        with self.assertRaises(ValueError) as raised:
+            pipeline.result('second')
+        self.assertEqual(str(raised.exception), 'second')
+        with self.assertRaises(ValueError) as raised:
+            pipeline.join()
+        self.assertEqual(str(raised.exception), 'first')
+
+    def test_only_needed_stages_are_run(self):
+        parser = iam_docker_run.create_parser()
+        args = parser.parse_args(['--image', 'busybox', '--exec-docker', '-v', 'data:/data'])
+        self.assertFalse(iam_docker_run.needs_image_check(args))
+        self.assertFalse(iam_docker_run.needs_docker_resource_check(args))
+        args = parser.parse_args(['--image', 'busybox', '--exec-docker', '--pull', 'always', '--network', 'backend'])
+        self.assertTrue(iam_docker_run.needs_image_check(args))
+        self.assertTrue(iam_docker_run.needs_docker_resource_check(args))
+        args = parser.parse_args(['--image', 'busybox', '--network', 'container:other'])
+        self.assertTrue(iam_docker_run.needs_image_check(args))
+        self.assertFalse(iam_docker_run.needs_docker_resource_check(args))
+
+
+if __name__ == '__main__':
+    unittest.main()
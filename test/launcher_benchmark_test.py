@@ -0,0 +1,367 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import unittest
+from datetime import datetime, timedelta
+from fake_docker import install_fake_docker
+
+try:
+    import socketserver
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import parse_qs
+except ImportError:  # python 2
+    import SocketServer as socketserver
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from urlparse import parse_qs
+
+
+PACKAGE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'launcher_benchmark_baselines.json')
+# set to rewrite the baselines from this run instead of checking against them
+UPDATE_BASELINES = bool(os.environ.get('IAM_DOCKER_RUN_BENCHMARK_UPDATE'))
+# how much slower than its baseline a scenario may get before it counts as a regression
+TOLERANCE = float(os.environ.get('IAM_DOCKER_RUN_BENCHMARK_TOLERANCE', 2.0))
+REPEAT = int(os.environ.get('IAM_DOCKER_RUN_BENCHMARK_REPEAT', 3))
+# simulated round trip to AWS, so the scenarios which avoid calls show it
+AWS_LATENCY = float(os.environ.get('IAM_DOCKER_RUN_BENCHMARK_AWS_LATENCY', 0.05))
+CONCURRENT_LAUNCHES = 8
+LARGE_ENV_FILE_LINES = 20000
+ACCOUNT_ID = '123456789012'
+FAKE_DOCKER = """#!/bin/sh
+prev=""
+for arg in "$@"; do
+    if [ "$prev" = "--env-file" ]; then cat "$arg" > /dev/null; fi
+    prev="$arg"
+done
+if [ "$1" = inspect ]; then echo "'0'"; fi
+exit 0
+"""
+AWS_CONFIG = """[profile chained]
+role_arn = arn:aws:iam::{account_id}:role/base
+source_profile = source
+""".format(account_id=ACCOUNT_ID)
+AWS_CREDENTIALS = """[source]
+aws_access_key_id = AKIASOURCE
+aws_secret_access_key = source-secret
+"""
+
+STS_RESPONSES = {
+    'AssumeRole': """<AssumeRoleResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <AssumeRoleResult>
+    <Credentials>
+      <AccessKeyId>ASIA{n:016d}</AccessKeyId>
+      <SecretAccessKey>secret-{n}</SecretAccessKey>
+      <SessionToken>token-{n}</SessionToken>
+      <Expiration>{expiration}</Expiration>
+    </Credentials>
+    <AssumedRoleUser>
+      <AssumedRoleId>AROA{n:016d}:session</AssumedRoleId>
+      <Arn>arn:aws:sts::{account_id}:assumed-role/bench/session</Arn>
+    </AssumedRoleUser>
+  </AssumeRoleResult>
+  <ResponseMetadata><RequestId>{n}</RequestId></ResponseMetadata>
+</AssumeRoleResponse>""",
+    'GetCallerIdentity': """<GetCallerIdentityResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <GetCallerIdentityResult>
+    <Arn>arn:aws:iam::{account_id}:user/bench</Arn>
+    <UserId>AIDABENCH</UserId>
+    <Account>{account_id}</Account>
+  </GetCallerIdentityResult>
+  <ResponseMetadata><RequestId>{n}</RequestId></ResponseMetadata>
+</GetCallerIdentityResponse>""",
+    'GetRole': """<GetRoleResponse xmlns="https://iam.amazonaws.com/doc/2010-05-08/">
+  <GetRoleResult>
+    <Role>
+      <Path>/</Path>
+      <RoleName>{role_name}</RoleName>
+      <RoleId>AROABENCH</RoleId>
+      <Arn>arn:aws:iam::{account_id}:role/{role_name}</Arn>
+      <CreateDate>2020-01-01T00:00:00Z</CreateDate>
+    </Role>
+  </GetRoleResult>
+  <ResponseMetadata><RequestId>{n}</RequestId></ResponseMetadata>
+</GetRoleResponse>""",
+}
+
+
+class FakeAwsHandler(BaseHTTPRequestHandler):
+    """Just enough of the STS and IAM query APIs for the launcher."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        params = parse_qs(self.rfile.read(length).decode('utf-8'))
+        action = params['Action'][0]
+        with self.server.lock:
+            self.server.calls.append(action)
+            n = len(self.server.calls)
+        time.sleep(AWS_LATENCY)
+        expiration = (datetime.utcnow() + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        body = STS_RESPONSES[action].format(
+            n=n, account_id=ACCOUNT_ID, expiration=expiration,
+            role_name=params.get('RoleName', [''])[0]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeAwsServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.TCPServer.__init__(self, ('127.0.0.1', 0), FakeAwsHandler)
+        self.lock = threading.Lock()
+        self.calls = []
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def take_calls(self):
+        with self.lock:
+            calls, self.calls = self.calls, []
+        return calls
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def read_baselines():
+    try:
+        with open(BASELINES_PATH) as f:
+            return json.load(f)['scenarios']
+    except (IOError, OSError, ValueError, KeyError):
+        return {}
+
+
+def write_baselines(results):
+    with open(BASELINES_PATH, 'w') as f:
+        json.dump({
+            'comment': 'Launch times relative to starting the python interpreter, '
+                       'regenerate with IAM_DOCKER_RUN_BENCHMARK_UPDATE=1',
+            'scenarios': results,
+        }, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+class TestLauncherBenchmark(unittest.TestCase):
+    """End to end launches against a fake STS/IAM endpoint and a fake docker cli,
+    timed and compared with the stored baselines.  Times are kept relative to how
+    long the interpreter takes to start, so baselines carry across machines."""
+
+    results = {}
+
+    @classmethod
+    def setUpClass(cls):
+        cls._temp_dir = tempfile.mkdtemp()
+        cls._bin_dir = os.path.join(cls._temp_dir, 'bin')
+        cls._home_dir = os.path.join(cls._temp_dir, 'home')
+        os.makedirs(os.path.join(cls._home_dir, '.aws'))
+        install_fake_docker(cls._bin_dir, FAKE_DOCKER)
+        with open(os.path.join(cls._home_dir, '.aws', 'config'), 'w') as f:
+            f.write(AWS_CONFIG)
+        with open(os.path.join(cls._home_dir, '.aws', 'credentials'), 'w') as f:
+            f.write(AWS_CREDENTIALS)
+        cls._large_env_file = os.path.join(cls._temp_dir, 'large.env')
+        with open(cls._large_env_file, 'w') as f:
+            for i in range(LARGE_ENV_FILE_LINES):
+                f.write('VARIABLE_{}=value-{}\n'.format(i, 'x' * 40))
+
+        cls.server = FakeAwsServer()
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        cls.interpreter_startup = median(
+            [cls.time_command([sys.executable, '-c', 'pass']) for _ in range(5)])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls._temp_dir)
+        cls.report()
+
+    @classmethod
+    def time_command(cls, command, env=None):
+        start = time.time()
+        p = subprocess.Popen(
+            command, env=env, cwd=cls._temp_dir,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output, _ = p.communicate()
+        elapsed = time.time() - start
+        if p.returncode != 0:
+            raise AssertionError("{} exited with {}:\n{}".format(
+                command, p.returncode, output.decode('utf-8', 'replace')))
+        return elapsed
+
+    def launcher_env(self, cache_dir):
+        env = dict(os.environ)
+        for name in ('AWS_PROFILE', 'AWS_DEFAULT_PROFILE', 'AWS_CONFIG_FILE',
+                     'AWS_SHARED_CREDENTIALS_FILE', 'AWS_SESSION_TOKEN'):
+            env.pop(name, None)
+        env.update({
+            'PATH': self._bin_dir + os.pathsep + env.get('PATH', ''),
+            'PYTHONPATH': PACKAGE_ROOT,
+            'HOME': self._home_dir,
+            'AWS_ACCESS_KEY_ID': 'AKIAENVIRONMENT',
+            'AWS_SECRET_ACCESS_KEY': 'environment-secret',
+            'AWS_REGION': 'us-east-1',
+            'AWS_EC2_METADATA_DISABLED': 'true',
+            'IAM_DOCKER_RUN_STS_ENDPOINT_URL': self.server.url,
+            'IAM_DOCKER_RUN_IAM_ENDPOINT_URL': self.server.url,
+            'IAM_DOCKER_RUN_CACHE_DIR': cache_dir,
+            'IAM_DOCKER_RUN_DISABLE_CONTAINER_NAME_TEMPFILE': 'true',
+        })
+        return env
+
+    def launch(self, args, cache_dir, extra_env=None):
+        env = self.launcher_env(cache_dir)
+        env.update(extra_env or {})
+        return self.time_command(
+            [sys.executable, '-m', 'iam_docker_run', '--image', 'busybox'] + args, env=env)
+
+    def new_cache_dir(self):
+        return tempfile.mkdtemp(dir=self._temp_dir)
+
+    def record(self, scenario, seconds):
+        relative = seconds / self.interpreter_startup
+        self.results[scenario] = {
+            'seconds': round(seconds, 4),
+            'relative': round(relative, 2),
+        }
+        baseline = read_baselines().get(scenario)
+        if baseline and not UPDATE_BASELINES:
+            self.assertLess(
+                relative, baseline['relative'] * TOLERANCE,
+                "{} regressed: {:.2f}x interpreter startup against a baseline of {:.2f}x".format(
+                    scenario, relative, baseline['relative']))
+
+    def test_cold_start(self):
+        times = []
+        for _ in range(REPEAT):
+            times.append(self.launch(['--role', 'app'], self.new_cache_dir()))
+            self.assertEqual(sorted(self.server.take_calls()), ['AssumeRole', 'GetCallerIdentity'])
+        self.record('cold_start', median(times))
+
+    def test_warm_start(self):
+        cache_dir = self.new_cache_dir()
+        self.launch(['--role', 'app'], cache_dir)
+        self.server.take_calls()
+        times = [self.launch(['--role', 'app'], cache_dir) for _ in range(REPEAT)]
+        self.assertEqual(self.server.take_calls(), [])
+        self.record('warm_start', median(times))
+
+    def test_chained_roles(self):
+        times = []
+        for _ in range(REPEAT):
+            times.append(self.launch(['--profile', 'chained', '--role', 'app'], self.new_cache_dir()))
+            self.assertEqual(
+                sorted(self.server.take_calls()), ['AssumeRole', 'AssumeRole', 'GetCallerIdentity'])
+        self.record('chained_roles', median(times))
+
+    def test_large_env_file(self):
+        cache_dir = self.new_cache_dir()
+        times = [
+            self.launch(['--custom-env-file', self._large_env_file], cache_dir)
+            for _ in range(REPEAT)]
+        self.record('large_env_file', median(times))
+
+    def test_concurrent_launches(self):
+        cache_dir = self.new_cache_dir()
+        self.launch(['--role', 'app'], cache_dir)
+        self.server.take_calls()
+        times = []
+        errors = []
+
+        def launch():
+            try:
+                self.launch(['--role', 'app'], cache_dir)
+            except AssertionError as e:
+                errors.append(e)
+
+        for _ in range(REPEAT):
+            threads = [threading.Thread(target=launch) for _ in range(CONCURRENT_LAUNCHES)]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            times.append(time.time() - start)
+        self.assertEqual(errors, [])
+        self.assertEqual(self.server.take_calls(), [])
+        self.record('concurrent_launches', median(times))
+
+    def test_prefetch_roles(self):
+        cache_dir = self.new_cache_dir()
+        roles = ['app-{}'.format(i) for i in range(CONCURRENT_LAUNCHES)]
+        command = [sys.executable, '-m', 'iam_docker_run', 'prefetch', '--profile', 'chained']
+        for role in roles:
+            command.extend(['--role', role])
+        seconds = self.time_command(command, env=self.launcher_env(cache_dir))
+        self.assertEqual(self.server.take_calls().count('AssumeRole'), 1 + len(roles))
+        self.launch(['--profile', 'chained', '--role', roles[-1]], cache_dir)
+        self.assertEqual(self.server.take_calls(), [])
+        self.record('prefetch_roles', seconds)
+
+    def test_daemon_warm_start(self):
+        cache_dir = self.new_cache_dir()
+        socket_path = os.path.join(cache_dir, 'daemon.sock')
+        daemon = subprocess.Popen(
+            [sys.executable, '-m', 'iam_docker_run', 'daemon', '--socket', socket_path],
+            env=self.launcher_env(cache_dir), cwd=self._temp_dir,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            # the daemon prints once it has imported boto3 and is about to listen
+            daemon.stdout.readline()
+            deadline = time.time() + 10
+            while not os.path.exists(socket_path) and time.time() < deadline:
+                time.sleep(0.01)
+            daemon_env = {
+                'IAM_DOCKER_RUN_USE_DAEMON': '1',
+                'IAM_DOCKER_RUN_DAEMON_SOCKET': socket_path,
+            }
+            self.launch(['--role', 'app'], cache_dir, daemon_env)
+            self.assertEqual(sorted(self.server.take_calls()), ['AssumeRole', 'GetCallerIdentity'])
+            times = [self.launch(['--role', 'app'], cache_dir, daemon_env) for _ in range(REPEAT)]
+            self.assertEqual(self.server.take_calls(), [])
+        finally:
+            daemon.terminate()
+            daemon.communicate()
+        self.record('daemon_warm_start', median(times))
+
+    @classmethod
+    def report(cls):
+        baselines = read_baselines()
+        lines = ['', 'Launcher benchmark (interpreter startup {:.3f}s):'.format(cls.interpreter_startup)]
+        for scenario in sorted(cls.results):
+            result = cls.results[scenario]
+            baseline = baselines.get(scenario)
+            lines.append('  {:<22} {:>8.3f}s {:>7.2f}x  baseline {}'.format(
+                scenario, result['seconds'], result['relative'],
+                '{:.2f}x'.format(baseline['relative']) if baseline else 'none'))
+        sys.stderr.write('\n'.join(lines) + '\n')
+        if UPDATE_BASELINES and cls.results:
+            updated = dict(baselines)
+            updated.update(cls.results)
+            write_baselines(updated)
+
+
+if __name__ == '__main__':
+    unittest.main()
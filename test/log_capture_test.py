@@ -0,0 +1,69 @@
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import unittest
+from iam_docker_run import log_capture
+
+
+class TestLogCapture(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._temp_dir, 'container.log')
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def read_lines(self, path):
+        with open(path, 'rb') as f:
+            return f.read().decode('utf-8').splitlines()
+
+    def test_timestamps_lines_split_across_chunks_and_streams(self):
+        writer = log_capture.RotatingLogWriter(self._path)
+        writer.write('stdout', b'hel')
+        writer.write('stdout', b'lo\nwor')
+        writer.write('stderr', b'oops\n')
+        writer.write('stdout', b'ld\n')
+        writer.close()
+        lines = [line.split(' ', 1)[1] for line in self.read_lines(self._path)]
+        self.assertEqual(lines, [
+            'stdout | hello', 'stdout | wor', 'stderr | oops', 'stdout | ld'])
+
+    def test_rotates_and_compresses_keeping_backups(self):
+        writer = log_capture.RotatingLogWriter(
+            self._path, max_bytes=100, backups=2, compress=True)
+        for index in range(10):
+            writer.write('stdout', '{}\n'.format(index).encode('utf-8') * 5)
+        writer.close()
+        self.assertEqual(sorted(os.listdir(self._temp_dir)), [
+            'container.log', 'container.log.1.gz', 'container.log.2.gz'])
+        with gzip.open(self._path + '.1.gz') as f:
+            self.assertTrue(f.read().decode('utf-8').endswith('stdout | 9\n'))
+
+    def test_rotates_part_way_through_a_line(self):
+        writer = log_capture.RotatingLogWriter(self._path, max_bytes=100, backups=10)
+        for _ in range(10):
+            writer.write('stdout', b'#' * 40)
+        writer.close()
+        paths = [os.path.join(self._temp_dir, name) for name in os.listdir(self._temp_dir)]
+        self.assertGreater(len(paths), 3)
+        lines = []
+        for path in paths:
+            self.assertLess(os.path.getsize(path), 200)
+            lines.extend(self.read_lines(path))
+        # each piece of the split line is a line of its own, and nothing is lost
+        self.assertEqual(set(line.split(' ', 1)[1].rstrip('#') for line in lines), set(['stdout | ']))
+        self.assertEqual(sum(line.count('#') for line in lines), 400)
+
+    def test_run_captured_returns_exit_code(self):
+        writer = log_capture.RotatingLogWriter(self._path)
+        exit_code = log_capture.run_captured(
+            [sys.executable, '-c', 'import sys; print("out"); sys.exit(3)'], writer)
+        writer.close()
+        self.assertEqual(exit_code, 3)
+        self.assertTrue(self.read_lines(self._path)[0].endswith('stdout | out'))
+
+
+if __name__ == '__main__':
+    unittest.main()
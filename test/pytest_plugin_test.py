@@ -0,0 +1,65 @@
+import os
+import unittest
+from fake_docker import FakeDockerTestCase
+from iam_docker_run import pytest_plugin
+from iam_docker_run import runner
+
+
+# starts detached containers, echoes exec'd commands and records removed containers
+FAKE_DOCKER = """#!/bin/sh
+case "$1" in
+  image) echo sha256:0123 ;;
+  run)
+    echo "$@" >> "$FAKE_DOCKER_STATE/started"
+    # the slim image has no tail
+    case "$*" in *"--entrypoint tail"*slim*) exit 127 ;; esac
+    echo 4567 ;;
+  exec) shift; echo "$@"; exit 2 ;;
+  rm) shift; echo "$@" >> "$FAKE_DOCKER_STATE/removed" ;;
+esac
+exit 0
+"""
+
+
+class TestPytestPlugin(FakeDockerTestCase):
+    fake_docker = FAKE_DOCKER
+
+    def setUp(self):
+        FakeDockerTestCase.setUp(self)
+        os.environ['PYTEST_XDIST_WORKER'] = 'gw1'
+        self._factory = pytest_plugin.ContainerFactory(
+            runner.Runner(log_dir=self._temp_dir), {'region': 'us-east-1'})
+
+    def test_containers_are_started_once_per_options(self):
+        container = self._factory.start('busybox', envvars=['A=1'])
+        self.assertIs(self._factory.start('busybox', envvars=['A=1']), container)
+        self.assertIsNot(self._factory.start('busybox'), container)
+        self.assertEqual(container.container_id, '4567')
+        self.assertTrue(container.name.startswith('idr-pytest-gw1-'))
+        started = self.read_state('started').splitlines()
+        self.assertEqual(len(started), 2)
+        self.assertIn('--entrypoint tail', started[0])
+        self.assertTrue(started[0].endswith('busybox -f /dev/null'))
+        self._factory.close()
+        self.assertIn(container.name, self.read_state('removed').split())
+
+    def test_images_without_tail_idle_with_sleep(self):
+        container = self._factory.start('slim')
+        self.assertEqual(container.container_id, '4567')
+        started = self.read_state('started').splitlines()
+        self.assertIn('--entrypoint tail', started[0])
+        self.assertIn('--entrypoint sleep', started[1])
+        self.assertIn(container.name, self.read_state('removed').split())
+
+    def test_exec_command_runs_in_the_container(self):
+        container = self._factory.start('busybox')
+        result = container.exec_command('ls -l "/some dir"', envvars=['B=2'], workdir='/app')
+        self.assertEqual(result.exit_code, 2)
+        self.assertFalse(result.ok)
+        self.assertIn('-w /app', result.stdout)
+        self.assertIn('-e B=2', result.stdout)
+        self.assertTrue(result.stdout.strip().endswith('{} ls -l /some dir'.format(container.name)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import time
+import tempfile
+import unittest
+from fake_docker import FakeDockerTestCase
+from iam_docker_run import env_assembly
+from iam_docker_run import reaper
+
+
+# lists containers from files in $FAKE_DOCKER_STATE and records the ones removed
+FAKE_DOCKER = """#!/bin/sh
+case "$1" in
+  ps)
+    case "$*" in
+      *label=iam-docker-run.reap*) cat "$FAKE_DOCKER_STATE/detached" ;;
+      *label=iam-docker-run*) cat "$FAKE_DOCKER_STATE/launched" ;;
+      *) cat "$FAKE_DOCKER_STATE/all" ;;
+    esac ;;
+  inspect) cat "$FAKE_DOCKER_STATE/finished" ;;
+  rm) shift; shift; echo "$@" >> "$FAKE_DOCKER_STATE/removed" ;;
+esac
+exit 0
+"""
+
+
+class TestReaper(FakeDockerTestCase):
+    fake_docker = FAKE_DOCKER
+
+    def setUp(self):
+        FakeDockerTestCase.setUp(self)
+        self._tmpfs_dir = env_assembly.TMPFS_DIR
+        self._tempdir = tempfile.tempdir
+
+    def tearDown(self):
+        env_assembly.TMPFS_DIR = self._tmpfs_dir
+        tempfile.tempdir = self._tempdir
+        FakeDockerTestCase.tearDown(self)
+
+    def write_state(self, name, lines):
+        with open(os.path.join(self._state_dir, name), 'w') as f:
+            f.write(''.join('{}\n'.format(line) for line in lines))
+
+    def write_file(self, path, content='', age=0):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        os.utime(path, (time.time() - age, time.time() - age))
+
+    def test_removes_detached_and_long_stopped_foreground_containers(self):
+        self.write_state('detached', ['detached'])
+        self.write_state('launched', ['detached', 'orphaned', 'just-exited'])
+        self.write_state('finished', [
+            '/orphaned\t2000-01-01T00:00:00.123456789Z',
+            '/just-exited\t{}'.format(time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()))])
+        self.assertEqual(reaper.find_stopped_containers(), ['detached', 'orphaned'])
+
+    def test_sweeps_stale_env_and_container_name_files(self):
+        env_assembly.TMPFS_DIR = os.path.join(self._temp_dir, 'shm')
+        tempfile.tempdir = self._state_dir
+        stale_env_file = os.path.join(env_assembly.TMPFS_DIR, 'idr-env-stale')
+        self.write_file(stale_env_file, age=7200)
+        self.write_file(os.path.join(env_assembly.TMPFS_DIR, 'idr-env-fresh'))
+        self.write_file(os.path.join(env_assembly.TMPFS_DIR, 'other'), age=7200)
+        names_dir = os.path.join(self._temp_dir, 'names')
+        stale_name_file = os.path.join(names_dir, 'gone', '_container_name.txt')
+        self.write_file(stale_name_file, 'gone', age=600)
+        self.write_file(os.path.join(names_dir, 'running', '_container_name.txt'), 'running', age=600)
+        self.write_state('all', ['running'])
+        containers, env_files, name_files = reaper.reap(path_prefix=names_dir)
+        self.assertEqual(env_files, [stale_env_file])
+        self.assertEqual(name_files, [stale_name_file])
+        self.assertFalse(os.path.exists(stale_env_file))
+        self.assertTrue(os.path.exists(os.path.join(env_assembly.TMPFS_DIR, 'idr-env-fresh')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import time
+import shutil
+import tempfile
+import unittest
+from iam_docker_run import aws_iam_utils
+from iam_docker_run import iam_docker_run
+from iam_docker_run import role_index
+from iam_docker_run.aws_util_exceptions import AssumeRoleError
+
+
+SOURCE_CREDS = {'AWS_ACCESS_KEY_ID': 'AKIASOURCE', 'AWS_SECRET_ACCESS_KEY': 'secret'}
+PATH_ROLE_ARN = 'arn:aws:iam::123456789012:role/service/role-app'
+
+
+class FakeIam(object):
+    """Stands in for the IAM and STS calls: only PATH_ROLE_ARN can be assumed."""
+
+    def __init__(self):
+        self.assumed = []
+        self.get_role_calls = 0
+
+    def generate_aws_temp_creds(self, role_arn, aws_creds=None, verbose=False, region=None, **kwargs):
+        self.assumed.append(role_arn)
+        if role_arn != PATH_ROLE_ARN:
+            raise AssumeRoleError('test', 'Error assuming role {}'.format(role_arn))
+        return {'AWS_ACCESS_KEY_ID': 'AKIAASSUMED'}
+
+    def get_role_arn_from_name(self, aws_creds, role_name, verbose=False, account_id=None):
+        self.get_role_calls += 1
+        return PATH_ROLE_ARN
+
+
+class TestRoleIndex(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._index = role_index.RoleIndex(self._temp_dir)
+        self._index.put_account('AKIASOURCE', '123456789012', 'aws')
+        self._iam = FakeIam()
+        self._originals = (aws_iam_utils.generate_aws_temp_creds, aws_iam_utils.get_role_arn_from_name)
+        aws_iam_utils.generate_aws_temp_creds = self._iam.generate_aws_temp_creds
+        aws_iam_utils.get_role_arn_from_name = self._iam.get_role_arn_from_name
+
+    def tearDown(self):
+        aws_iam_utils.generate_aws_temp_creds, aws_iam_utils.get_role_arn_from_name = self._originals
+        shutil.rmtree(self._temp_dir)
+
+    def test_role_arns_per_account(self):
+        self.assertEqual(
+            role_index.build_role_arn('123456789012', 'role-app', 'aws-cn'),
+            'arn:aws-cn:iam::123456789012:role/role-app')
+        self._index.put_role_arn('123456789012', 'role-app', PATH_ROLE_ARN)
+        self.assertEqual(self._index.get_role_arn('123456789012', 'role-app'), PATH_ROLE_ARN)
+        self.assertIsNone(self._index.get_role_arn('210987654321', 'role-app'))
+        self._index.remove_role_arn('123456789012', 'role-app')
+        self.assertIsNone(self._index.get_role_arn('123456789012', 'role-app'))
+
+    def test_accounts_expire_and_are_capped(self):
+        self.assertEqual(self._index.get_account('AKIASOURCE')['account_id'], '123456789012')
+        self.assertIsNone(self._index.get_account('AKIAOTHER'))
+        original_max = role_index.MAX_ACCOUNTS
+        role_index.MAX_ACCOUNTS = 3
+        try:
+            for number in range(5):
+                self._index.put_account('AKIATEMP{}'.format(number), '123456789012', 'aws')
+                time.sleep(0.01)
+        finally:
+            role_index.MAX_ACCOUNTS = original_max
+        self.assertIsNone(self._index.get_account('AKIASOURCE'))
+        self.assertIsNone(self._index.get_account('AKIATEMP1'))
+        self.assertIsNotNone(self._index.get_account('AKIATEMP4'))
+        original_age = role_index.ACCOUNT_MAX_AGE
+        role_index.ACCOUNT_MAX_AGE = 0
+        try:
+            self.assertIsNone(self._index.get_account('AKIATEMP4'))
+        finally:
+            role_index.ACCOUNT_MAX_AGE = original_age
+
+    def test_resolve_role_arn_from_index_or_account(self):
+        self.assertEqual(
+            aws_iam_utils.resolve_role_arn(SOURCE_CREDS, 'role-app', self._index),
+            ('arn:aws:iam::123456789012:role/role-app', '123456789012', False))
+        self._index.put_role_arn('123456789012', 'role-app', PATH_ROLE_ARN)
+        self.assertEqual(
+            aws_iam_utils.resolve_role_arn(SOURCE_CREDS, 'role-app', self._index),
+            (PATH_ROLE_ARN, '123456789012', True))
+
+    def test_constructed_arn_falls_back_to_get_role(self):
+        creds = iam_docker_run.assume_role_from_name(SOURCE_CREDS, 'role-app', self._index)
+        self.assertEqual(creds['AWS_ACCESS_KEY_ID'], 'AKIAASSUMED')
+        self.assertEqual(self._iam.get_role_calls, 1)
+        self.assertEqual(self._index.get_role_arn('123456789012', 'role-app'), PATH_ROLE_ARN)
+        # now indexed, GetRole isn't needed again
+        iam_docker_run.assume_role_from_name(SOURCE_CREDS, 'role-app', self._index)
+        self.assertEqual(self._iam.get_role_calls, 1)
+
+    def test_stale_indexed_arn_falls_back_to_get_role(self):
+        self._index.put_role_arn('123456789012', 'role-app', 'arn:aws:iam::123456789012:role/role-app')
+        creds = iam_docker_run.assume_role_from_name(SOURCE_CREDS, 'role-app', self._index)
+        self.assertEqual(creds['AWS_ACCESS_KEY_ID'], 'AKIAASSUMED')
+        self.assertEqual(self._iam.get_role_calls, 1)
+        self.assertEqual(self._index.get_role_arn('123456789012', 'role-app'), PATH_ROLE_ARN)
+
+
+if __name__ == '__main__':
+    unittest.main()
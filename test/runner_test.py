@@ -0,0 +1,76 @@
+import os
+import unittest
+import threading
+from fake_docker import FakeDockerTestCase
+from iam_docker_run import runner
+from iam_docker_run import timings
+
+
+# prints from "docker run", and records removed containers in $FAKE_DOCKER_STATE
+FAKE_DOCKER = """#!/bin/sh
+case "$1" in
+  image) echo sha256:0123 ;;
+  run)
+    for arg in "$@"; do
+      if [ "$arg" = -d ]; then echo 4567; exit 0; fi
+    done
+    echo hello; echo oops >&2 ;;
+  inspect) echo 89ab 3 ;;
+  rm) echo "$2" >> "$FAKE_DOCKER_STATE/removed" ;;
+esac
+exit 0
+"""
+
+
+class TestRunner(FakeDockerTestCase):
+    fake_docker = FAKE_DOCKER
+
+    def setUp(self):
+        FakeDockerTestCase.setUp(self)
+        self._runner = runner.Runner(log_dir=os.path.join(self._temp_dir, 'logs'))
+
+    def test_launch_spec_takes_command_line_options(self):
+        spec = runner.LaunchSpec('busybox', cmd='env', envvars=['A=1'], shards='2')
+        args = spec.to_args()
+        self.assertEqual((args.image, args.cmd, args.envvars, args.shards), ('busybox', 'env', ['A=1'], 2))
+        self.assertEqual(args.pull, 'missing')
+        self.assertEqual(spec.replace(cmd='true').cmd, 'true')
+        with self.assertRaises(TypeError):
+            runner.LaunchSpec('busybox', no_such_option=True)
+
+    def test_run_returns_exit_code_container_and_log(self):
+        result = self._runner.run(image='busybox', name='test-run', cmd='echo hello')
+        self.assertEqual((result.exit_code, result.container_name, result.container_id), (3, 'test-run', '89ab'))
+        with result.open_log() as f:
+            lines = [line.split(b' ', 1)[1] for line in f.read().splitlines()]
+        self.assertEqual(sorted(lines), [b'stderr | oops', b'stdout | hello'])
+        self.assertIn('docker:run', [span['name'] for span in result.timings])
+        self.assertEqual(self.read_state('removed').split(), ['test-run'])
+
+    def test_each_run_records_its_own_timings(self):
+        process_spans = len(timings.recorder.spans)
+        results = {}
+
+        def run(name):
+            results[name] = self._runner.run(image='busybox', name=name, cmd='true')
+        threads = [threading.Thread(target=run, args=(name,)) for name in ('run-a', 'run-b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        for result in results.values():
+            names = [span['name'] for span in result.timings]
+            self.assertEqual(names.count('docker:run'), 1)
+            # including the phases of the launch stages run on other threads
+            self.assertIn('stage:image', names)
+        self.assertEqual(len(timings.recorder.spans), process_spans)
+
+    def test_detached_run_returns_container_id(self):
+        result = self._runner.run(runner.LaunchSpec('busybox', detached=True))
+        self.assertEqual((result.exit_code, result.container_id, result.log_path), (0, '4567', None))
+        with self.assertRaises(runner.LaunchError):
+            self._runner.run(image='busybox', interactive=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from iam_docker_run import session_pool
+
+
+def make_creds(access_key):
+    return {'AWS_ACCESS_KEY_ID': access_key, 'AWS_SECRET_ACCESS_KEY': 'secret', 'AWS_SESSION_TOKEN': 'token'}
+
+
+class TestSessionPool(unittest.TestCase):
+    def test_sessions_and_clients_are_reused(self):
+        session = session_pool.get_session(make_creds('AKIAONE'))
+        self.assertIs(session_pool.get_session(make_creds('AKIAONE')), session)
+        self.assertIsNot(session_pool.get_session(make_creds('AKIATWO')), session)
+        client = session_pool.get_client(session, 'sts', 'eu-west-1')
+        self.assertIs(session_pool.get_client(session, 'sts', 'eu-west-1'), client)
+        self.assertIsNot(session_pool.get_client(session, 'sts', 'us-west-2'), client)
+        self.assertEqual(client.meta.endpoint_url, 'https://sts.eu-west-1.amazonaws.com')
+
+    def test_clients_for_one_endpoint_share_connections(self):
+        first = session_pool.get_client(session_pool.get_session(make_creds('AKIATHREE')), 'sts', 'ap-south-1')
+        second = session_pool.get_client(session_pool.get_session(make_creds('AKIAFOUR')), 'sts', 'ap-south-1')
+        self.assertIsNot(first, second)
+        self.assertIs(first._endpoint.http_session, second._endpoint.http_session)
+
+    def test_replaced_connection_pool_is_closed(self):
+        session = session_pool.get_session(make_creds('AKIAFIVE'))
+        session_pool.get_client(session, 'sts', 'ca-central-1')
+        client = session.client('sts', region_name='ca-central-1')
+        own_http_session = client._endpoint.http_session
+        closed = []
+        own_http_session.close = lambda: closed.append(True)
+        session_pool._share_http_session(client, client.meta.endpoint_url)
+        self.assertEqual(closed, [True])
+        self.assertIsNot(client._endpoint.http_session, own_http_session)
+
+    def test_least_recently_used_sessions_are_evicted(self):
+        max_sessions = session_pool.MAX_SESSIONS
+        session_pool.MAX_SESSIONS = 2
+        try:
+            first = session_pool.get_session(make_creds('AKIAEVICT1'))
+            session_pool.get_client(first, 'sts', 'eu-west-1')
+            second = session_pool.get_session(make_creds('AKIAEVICT2'))
+            session_pool.get_client(second, 'sts', 'eu-west-1')
+            # using the first session again makes the second the least recently used
+            self.assertIs(session_pool.get_session(make_creds('AKIAEVICT1')), first)
+            session_pool.get_session(make_creds('AKIAEVICT3'))
+            self.assertEqual(len(session_pool._sessions), 2)
+            self.assertNotIn((id(second), 'sts', 'eu-west-1'), session_pool._clients)
+            self.assertIn((id(first), 'sts', 'eu-west-1'), session_pool._clients)
+            self.assertIsNot(session_pool.get_session(make_creds('AKIAEVICT2')), second)
+        finally:
+            session_pool.MAX_SESSIONS = max_sessions
+
+    def test_sts_endpoint_urls(self):
+        self.assertEqual(session_pool.get_sts_endpoint_url('cn-north-1'), 'https://sts.cn-north-1.amazonaws.com.cn')
+        self.assertIsNone(session_pool.get_sts_endpoint_url(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
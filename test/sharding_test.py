@@ -0,0 +1,73 @@
+import os
+import unittest
+from fake_docker import FakeDockerTestCase
+from iam_docker_run import iam_docker_run
+from iam_docker_run import sharding
+
+
+# "docker run" exits with the shard's SHARD_INDEX read from the env file, and
+# "docker rm" records the removed containers in $FAKE_DOCKER_STATE
+FAKE_DOCKER = """#!/bin/sh
+case "$1" in
+  run)
+    while [ $# -gt 0 ]; do
+      if [ "$1" = --env-file ]; then env_file="$2"; fi
+      shift
+    done
+    index=$(grep '^SHARD_INDEX=' "$env_file" | cut -d= -f2)
+    grep '^SHARD_SPEC=' "$env_file"
+    exit "$index" ;;
+  rm) shift; shift; echo "$@" >> "$FAKE_DOCKER_STATE/removed" ;;
+esac
+exit 0
+"""
+
+
+def parse_args(argv):
+    return iam_docker_run.create_parser().parse_args(['--image', 'busybox'] + argv)
+
+
+class TestSharding(FakeDockerTestCase):
+    fake_docker = FAKE_DOCKER
+
+    def test_shard_specs_from_count_or_manifest(self):
+        self.assertEqual(sharding.get_shard_specs(parse_args(['--shards', '3'])), [None, None, None])
+        manifest = os.path.join(self._temp_dir, 'manifest.txt')
+        with open(manifest, 'w') as f:
+            f.write('# suites\ntests/unit\n\n  tests/integration  \n')
+        self.assertEqual(
+            sharding.get_shard_specs(parse_args(['--shard-manifest', manifest])),
+            ['tests/unit', 'tests/integration'])
+        with open(manifest, 'w') as f:
+            f.write('# nothing\n')
+        with self.assertRaises(sharding.ShardManifestError):
+            sharding.read_shard_manifest(manifest)
+        with self.assertRaises(sharding.ShardManifestError):
+            sharding.read_shard_manifest(os.path.join(self._temp_dir, 'missing.txt'))
+
+    def test_shard_counts_below_one_are_rejected(self):
+        for value in ('0', '-1', 'x'):
+            with self.assertRaises(SystemExit):
+                parse_args(['--shards', value])
+        with self.assertRaises(SystemExit):
+            parse_args(['--shards', '2', '--shard-parallelism', '0'])
+
+    def test_log_dir_is_rejected(self):
+        for argv in (['--shards', '2'], ['--shard-manifest', 'manifest.txt']):
+            with self.assertRaises(iam_docker_run.LaunchError) as raised:
+                iam_docker_run.launch(parse_args(argv + ['--log-dir', self._temp_dir]))
+            self.assertIn('--log-dir cannot be combined', str(raised.exception))
+
+    def test_runs_every_shard_and_aggregates_exit_codes(self):
+        runner = sharding.ShardRunner(
+            parse_args(['--shards', '3']), 'test', {}, 'us-east-1', [None, 'b', None], max_workers=2)
+        exit_codes = runner.run()
+        self.assertEqual(exit_codes, [0, 1, 2])
+        self.assertEqual(sharding.aggregate_exit_code(exit_codes), 1)
+        self.assertEqual(sharding.aggregate_exit_code([0, 0]), 0)
+        runner.remove_containers()
+        self.assertEqual(sorted(self.read_state('removed').split()), ['test-shard-0', 'test-shard-1', 'test-shard-2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from iam_docker_run import stack
+
+
+SPEC = {
+    'name': 'local',
+    'defaults': {'profile': 'dev'},
+    'services': {
+        'db': {'image': 'postgres', 'env': {'POSTGRES_PASSWORD': 'secret'}},
+        'queue': {'image': 'localstack/localstack', 'portmap': ['4566:4566']},
+        'app': {
+            'image': 'mycompany/app',
+            'role': 'role-app',
+            'volume': ['./src:/app'],
+            'cmd': '-m app',
+            'depends_on': ['db', 'queue'],
+        },
+        'worker': {'image': 'mycompany/app', 'role': 'role-app', 'depends_on': ['app']},
+    },
+}
+
+
+class TestStack(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_starts_services_in_dependency_waves(self):
+        self.assertEqual(stack.get_start_order(SPEC['services']), [
+            ['db', 'queue'], ['app'], ['worker']])
+        with self.assertRaises(stack.StackError):
+            stack.get_start_order({
+                'a': {'image': 'a', 'depends_on': ['b']},
+                'b': {'image': 'b', 'depends_on': ['a']}})
+
+    def test_maps_service_options_to_launch_args(self):
+        app = stack.parse_service_args('local', 'local', 'app', SPEC['services']['app'], SPEC['defaults'])
+        self.assertEqual((app.profile, app.role, app.volumes, app.cmd), (
+            'dev', 'role-app', ['./src:/app'], '-m app'))
+        self.assertEqual((app.name, app.network, app.detached), ('local-app', 'local', True))
+        db = stack.parse_service_args('local', 'local', 'db', SPEC['services']['db'])
+        self.assertEqual(db.envvars, ['POSTGRES_PASSWORD=secret'])
+        with self.assertRaises(stack.StackError):
+            stack.parse_service_args('local', 'local', 'db', {'image': 'postgres', 'network': 'host'})
+
+    def test_loads_json_spec(self):
+        path = os.path.join(self._temp_dir, 'stack.json')
+        with open(path, 'w') as f:
+            json.dump(SPEC, f)
+        spec = stack.load_spec(path)
+        self.assertEqual(stack.get_stack_name(spec, path), 'local')
+        del spec['name']
+        self.assertEqual(stack.get_stack_name(spec, path), os.path.basename(self._temp_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from iam_docker_run import timings
+
+
+class TestTimings(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_records_phases_including_failures(self):
+        recorder = timings.Timings()
+        with recorder.phase('sts:AssumeRole', role_arn='arn:aws:iam::123456789012:role/test'):
+            pass
+        with self.assertRaises(ValueError):
+            with recorder.phase('docker:run'):
+                raise ValueError('boom')
+        self.assertEqual([span['name'] for span in recorder.spans], ['sts:AssumeRole', 'docker:run'])
+        self.assertEqual(recorder.spans[1]['error'], 'ValueError')
+        table = recorder.format_table()
+        self.assertIn('sts:AssumeRole', table)
+        self.assertIn('docker:run (ValueError)', table)
+
+    def test_writes_json_lines_and_otlp(self):
+        recorder = timings.Timings()
+        with recorder.phase('env_file:write', variables=3):
+            pass
+        path = os.path.join(self._temp_dir, 'timings.jsonl')
+        recorder.write_file(path)
+        recorder.write_file(path)
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['attributes'], {'variables': 3})
+
+        spans = recorder.to_otlp()['resourceSpans'][0]['scopeSpans'][0]['spans']
+        self.assertEqual([span['name'] for span in spans], ['launch', 'env_file:write'])
+        self.assertEqual(spans[1]['parentSpanId'], spans[0]['spanId'])
+        self.assertEqual(spans[1]['attributes'], [{'key': 'variables', 'value': {'stringValue': '3'}}])
+
+
+if __name__ == '__main__':
+    unittest.main()